@@ -0,0 +1,177 @@
+import os
+import asyncio
+import math
+import time
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Optional
+from dotenv import load_dotenv
+from metrics import metrics
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted before its deadline"""
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class _Waiter:
+    __slots__ = ("key", "future", "enqueued_at")
+
+    def __init__(self, key: str, future: asyncio.Future):
+        self.key = key
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+class AdmissionController:
+    """Global concurrency limit with per-key fair queuing and adaptive (AIMD) sizing"""
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int = 16,
+        min_concurrency: int = 2,
+        max_queue: int = 64,
+        max_queue_per_key: int = 4,
+        max_wait: float = 10.0,
+        latency_target: float = 8.0,
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_key = max_queue_per_key
+        self.max_wait = max_wait
+        self.latency_target = latency_target
+        self.limit = float(max_concurrency)
+        self.active = 0
+        self.queued = 0
+        # Round-robin order of keys that have waiters; each key has its own FIFO
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._latency_ewma: Optional[float] = None
+
+    def _estimated_wait(self, position: int) -> float:
+        service_time = self._latency_ewma if self._latency_ewma is not None else self.latency_target / 2
+        return position / max(self.limit, 1.0) * service_time
+
+    def _reject(self, reason: str, estimated_wait: float):
+        metrics.incr(f"admission.{self.name}.rejected")
+        retry_after = max(1, math.ceil(estimated_wait))
+        logger.warning(f"Admission rejected for {self.name}: {reason} (retry after {retry_after}s)")
+        raise AdmissionRejected(reason, retry_after)
+
+    async def acquire(self, key: str, max_wait: Optional[float] = None):
+        """Wait for a slot, or raise AdmissionRejected when the deadline can't be met"""
+        max_wait = self.max_wait if max_wait is None else max_wait
+
+        if self.queued == 0 and self.active < int(self.limit):
+            self.active += 1
+            metrics.observe(f"admission.{self.name}.wait", 0.0)
+            return
+
+        estimated_wait = self._estimated_wait(self.queued + 1)
+        if self.queued >= self.max_queue:
+            self._reject("queue full", estimated_wait)
+        if len(self._queues.get(key, ())) >= self.max_queue_per_key:
+            self._reject("too many queued requests for this user", estimated_wait)
+        if estimated_wait > max_wait:
+            self._reject("estimated wait exceeds deadline", estimated_wait)
+
+        waiter = _Waiter(key, asyncio.get_running_loop().create_future())
+        self._queues.setdefault(key, deque()).append(waiter)
+        self.queued += 1
+        self._update_gauges()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was granted just as we gave up; hand it on
+                self.release(None, success=True)
+            else:
+                waiter.future.cancel()
+                self._discard(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject("timed out waiting in queue", self._estimated_wait(self.queued + 1))
+            raise
+        metrics.observe(f"admission.{self.name}.wait", time.monotonic() - waiter.enqueued_at)
+
+    def release(self, latency: Optional[float], success: bool):
+        """Free a slot, feed the adaptive limit and wake the next waiter in round-robin order"""
+        self.active -= 1
+        if latency is not None:
+            self._adapt(latency, success)
+        self._dispatch()
+        self._update_gauges()
+
+    def _adapt(self, latency: float, success: bool):
+        self._latency_ewma = latency if self._latency_ewma is None else 0.8 * self._latency_ewma + 0.2 * latency
+        if not success or latency > self.latency_target:
+            self.limit = max(float(self.min_concurrency), self.limit * 0.9)
+        else:
+            self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+
+    def _dispatch(self):
+        while self._queues and self.active < int(self.limit):
+            key, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+            self.queued -= 1
+            if waiter.future.done():
+                continue
+            self.active += 1
+            waiter.future.set_result(True)
+
+    def _discard(self, waiter: _Waiter):
+        queue = self._queues.get(waiter.key)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            self.queued -= 1
+            if not queue:
+                del self._queues[waiter.key]
+        self._update_gauges()
+
+    def _update_gauges(self):
+        metrics.set_gauge(f"admission.{self.name}.queue_depth", self.queued)
+        metrics.set_gauge(f"admission.{self.name}.active", self.active)
+        metrics.set_gauge(f"admission.{self.name}.limit", round(self.limit, 2))
+
+    @asynccontextmanager
+    async def slot(self, key: str, max_wait: Optional[float] = None):
+        """Hold a slot for the duration of the block, recording latency and failures"""
+        await self.acquire(key, max_wait)
+        started = time.monotonic()
+        success = False
+        try:
+            yield
+            success = True
+        finally:
+            self.release(time.monotonic() - started, success)
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "active": self.active,
+            "queued": self.queued,
+            "queued_keys": len(self._queues),
+            "latency_ewma_ms": round(self._latency_ewma * 1000, 2) if self._latency_ewma is not None else None,
+        }
+
+bastion_admission = AdmissionController(
+    "bastion",
+    max_concurrency=int(os.getenv("BASTION_MAX_CONCURRENCY", "16")),
+    min_concurrency=int(os.getenv("BASTION_MIN_CONCURRENCY", "2")),
+    max_queue=int(os.getenv("BASTION_MAX_QUEUE", "64")),
+    max_queue_per_key=int(os.getenv("BASTION_MAX_QUEUE_PER_USER", "4")),
+    max_wait=float(os.getenv("BASTION_MAX_QUEUE_WAIT_SECONDS", "10")),
+    latency_target=float(os.getenv("BASTION_LATENCY_TARGET_SECONDS", "8")),
+)
@@ -0,0 +1,178 @@
+import os
+import asyncio
+import hashlib
+import time
+import logging
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+import jwt
+import httpx
+from fastapi import HTTPException, Request
+from http_clients import http_clients
+from resilience import upstreams, CircuitOpenError
+from utils.cache import TTLCache
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+SUPABASE_JWKS_PATH = "/auth/v1/.well-known/jwks.json"
+JWKS_REFRESH_SECONDS = float(os.getenv("SUPABASE_JWKS_REFRESH_SECONDS", "600"))
+VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv("VERIFIED_TOKEN_CACHE_SIZE", "10000"))
+
+# Tolerated clock skew between Supabase and this server when checking exp/iat
+CLOCK_SKEW_SECONDS = 30
+
+class SupabaseJWTVerifier:
+    """Verifies Supabase access tokens locally with the project secret or cached JWKS"""
+
+    def __init__(self, jwt_secret: Optional[str] = SUPABASE_JWT_SECRET, refresh_interval: float = JWKS_REFRESH_SECONDS):
+        self.jwt_secret = jwt_secret
+        self.refresh_interval = refresh_interval
+        # kid -> PyJWK; each key carries the one algorithm it may be used with
+        self._keys: Dict[str, jwt.PyJWK] = {}
+        self._keys_fetched_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        # sha256(token) -> verified claims, held until the token expires
+        self._verified = TTLCache(max_entries=VERIFIED_TOKEN_CACHE_SIZE, ttl=3600)
+
+    async def start(self):
+        """Load signing keys and keep them fresh in the background"""
+        try:
+            await self.refresh_keys()
+        except Exception as e:
+            logger.warning(f"Could not load Supabase JWKS at startup: {str(e)}")
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh_keys()
+            except Exception as e:
+                logger.warning(f"Could not refresh Supabase JWKS: {str(e)}")
+
+    async def refresh_keys(self):
+        """Fetch the project's JWKS (asymmetric signing keys)"""
+        async with self._refresh_lock:
+            client = http_clients.get("supabase")
+            response = await upstreams["supabase"].call(lambda: client.get(SUPABASE_JWKS_PATH), idempotent=True)
+            if not response.is_success:
+                logger.warning(f"Supabase JWKS fetch failed: {response.status_code}")
+                return
+            keys = {}
+            for jwk in response.json().get("keys", []):
+                try:
+                    keys[jwk.get("kid")] = jwt.PyJWK(jwk)
+                except Exception as e:
+                    logger.warning(f"Skipping unsupported JWKS key {jwk.get('kid')}: {str(e)}")
+            self._keys = keys
+            self._keys_fetched_at = time.monotonic()
+            logger.info(f"Loaded {len(keys)} Supabase signing key(s)")
+
+    async def _signing_key(self, header: dict) -> Tuple[Optional[object], Optional[str]]:
+        """(key, algorithm) to verify with; the algorithm comes from our key, never the token"""
+        if header.get("alg") == "HS256":
+            return self.jwt_secret, "HS256"
+        kid = header.get("kid")
+        jwk = self._keys.get(kid)
+        # Unknown kid usually means the keys were rotated; refetch at most every 30s
+        if jwk is None and time.monotonic() - self._keys_fetched_at > 30:
+            await self.refresh_keys()
+            jwk = self._keys.get(kid)
+        if jwk is None:
+            return None, None
+        return jwk.key, jwk.algorithm_name
+
+    async def verify(self, token: str) -> dict:
+        """Return the token's claims, raising jwt.PyJWTError if it is not valid"""
+        cache_key = hashlib.sha256(token.encode()).hexdigest()
+        claims = self._verified.get(cache_key)
+        if claims is not None and claims.get("exp", 0) > time.time() - CLOCK_SKEW_SECONDS:
+            return claims
+
+        header = jwt.get_unverified_header(token)
+        key, algorithm = await self._signing_key(header)
+        if key is not None:
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=[algorithm],
+                options={"verify_aud": False, "require": ["exp"]},
+                leeway=CLOCK_SKEW_SECONDS,
+            )
+        else:
+            # No local key for this token (secret not configured): ask Supabase once, then cache
+            claims = await self._verify_remote(token)
+
+        ttl = claims.get("exp", time.time()) - time.time()
+        if ttl > 0:
+            self._verified.set(cache_key, claims, ttl=ttl)
+        return claims
+
+    async def _verify_remote(self, token: str) -> dict:
+        client = http_clients.get("supabase")
+        response = await upstreams["supabase"].call(
+            lambda: client.get("/auth/v1/user", headers={"Authorization": f"Bearer {token}"}),
+            idempotent=True,
+            hedge=True
+        )
+        if not response.is_success:
+            raise jwt.InvalidTokenError(f"Supabase rejected token ({response.status_code})")
+        claims = jwt.decode(token, options={"verify_signature": False})
+        claims["sub"] = response.json().get("id")
+        return claims
+
+    def stats(self) -> dict:
+        return {"signing_keys": len(self._keys), "verified_tokens": self._verified.stats()}
+
+# Create a global instance
+jwt_verifier = SupabaseJWTVerifier()
+
+async def authenticate(request: Request):
+    """App-wide dependency: verify any bearer token and expose the caller on request.state"""
+    request.state.user_id = None
+    request.state.claims = None
+
+    auth_header = request.headers.get("authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return
+
+    try:
+        claims = await jwt_verifier.verify(auth_header[7:])
+    except jwt.PyJWTError as e:
+        # Includes InvalidKeyError (e.g. alg "none" or a mismatched alg with a known kid), not just InvalidTokenError
+        logger.warning(f"Rejected auth token: {str(e)}")
+        raise HTTPException(status_code=401, detail="Invalid or expired auth token")
+    except (httpx.HTTPError, CircuitOpenError) as e:
+        # Supabase unreachable and no local key to check against: continue unauthenticated
+        logger.warning(f"Could not verify auth token: {str(e)}")
+        return
+
+    request.state.claims = claims
+    if claims.get("role") == "authenticated":
+        request.state.user_id = claims.get("sub")
+
+def get_current_user_id(request: Request) -> Optional[str]:
+    """Supabase user id of the caller, or None for anonymous requests"""
+    return getattr(request.state, "user_id", None)
+
+def require_user(request: Request) -> str:
+    user_id = get_current_user_id(request)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    return user_id
+
+def require_service_role(request: Request):
+    """Restrict bulk/admin endpoints to callers holding the Supabase service-role key"""
+    claims = getattr(request.state, "claims", None)
+    if not claims or claims.get("role") != "service_role":
+        raise HTTPException(status_code=403, detail="Service role required")
@@ -0,0 +1,153 @@
+import os
+import sys
+import csv
+import io
+import json
+import time
+import uuid
+import asyncio
+import logging
+import resource
+from datetime import date, datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+from dotenv import load_dotenv
+from sqlalchemy import select
+from database import ReadSessionLocal
+from models import VeteranProfile
+from utils.encryption import encryption_service
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Columns that may be exported; ssn_encrypted is never exported raw
+EXPORTABLE_COLUMNS = [
+    "id", "email", "first_name", "middle_initial", "last_name", "ssn_last4", "phone", "date_of_birth",
+    "file_number", "veterans_service_number", "military_service", "claim_info", "address",
+    "claim_statement", "has_signed_up", "has_paid", "created_at", "updated_at",
+]
+DEFAULT_EXPORT_COLUMNS = [c for c in EXPORTABLE_COLUMNS if c != "claim_statement"]
+
+def resolve_columns(columns: Optional[str]) -> List[str]:
+    """Parse a comma-separated column projection, rejecting unknown columns"""
+    if not columns:
+        return list(DEFAULT_EXPORT_COLUMNS)
+    selected = [c.strip() for c in columns.split(",") if c.strip()]
+    unknown = [c for c in selected if c not in EXPORTABLE_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown export columns: {', '.join(unknown)}")
+    return selected
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def _serialize(rows: List[dict], fmt: str, columns: List[str]) -> bytes:
+    if fmt == "ndjson":
+        return "".join(json.dumps(row) + "\n" for row in rows).encode()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(
+            json.dumps(row[c]) if isinstance(row[c], (dict, list)) else row[c]
+            for c in columns
+        )
+    return buffer.getvalue().encode()
+
+async def export_profiles(fmt: str, columns: List[str], include_ssn: bool = False) -> AsyncIterator[bytes]:
+    """Stream profiles through a server-side cursor, one serialized chunk per fetched batch"""
+    output_columns = columns + (["ssn"] if include_ssn else [])
+    selected = [getattr(VeteranProfile, c) for c in columns]
+    if include_ssn:
+        # Ciphertexts are bound to the row id, which is needed to decrypt them
+        selected.extend([VeteranProfile.ssn_encrypted, VeteranProfile.id])
+
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(output_columns)
+        yield buffer.getvalue().encode()
+
+    loop = asyncio.get_running_loop()
+    exported = 0
+    async with ReadSessionLocal() as db:
+        result = await db.stream(
+            select(*selected)
+            .order_by(VeteranProfile.email)
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        async for partition in result.partitions():
+            rows = [{c: _plain(value) for c, value in zip(columns, row)} for row in partition]
+            if include_ssn:
+                ssns = await loop.run_in_executor(None, encryption_service.decrypt_ssns, [(row[-2], row[-1]) for row in partition])
+                for row, ssn in zip(rows, ssns):
+                    row["ssn"] = ssn
+            exported += len(rows)
+            yield _serialize(rows, fmt, output_columns)
+
+    logger.info(f"Exported {exported} veteran profiles ({fmt}, ssn={'included' if include_ssn else 'excluded'})")
+
+async def _buffered_export(fmt: str, columns: List[str]) -> AsyncIterator[bytes]:
+    """The naive export streaming replaces: every row is loaded before the first chunk is sent"""
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(columns)
+        yield buffer.getvalue().encode()
+    async with ReadSessionLocal() as db:
+        rows = (await db.execute(
+            select(*[getattr(VeteranProfile, c) for c in columns]).order_by(VeteranProfile.email)
+        )).all()
+    for start in range(0, len(rows), EXPORT_BATCH_SIZE):
+        yield _serialize([{c: _plain(value) for c, value in zip(columns, row)} for row in rows[start:start + EXPORT_BATCH_SIZE]], fmt, columns)
+
+async def measure_export(fmt: str = "ndjson", buffered: bool = False) -> Dict[str, float]:
+    """Throughput and peak RSS growth of one full export of the default columns in this process"""
+    export = _buffered_export if buffered else export_profiles
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    rows = size = 0
+    async for chunk in export(fmt, list(DEFAULT_EXPORT_COLUMNS)):
+        size += len(chunk)
+        rows += chunk.count(b"\n")
+    elapsed = time.perf_counter() - started
+    if fmt == "csv":
+        rows -= 1
+    return {
+        "rows": rows,
+        "rows_per_second": round(rows / elapsed),
+        "mb_per_second": round(size / elapsed / 1e6, 1),
+        "peak_rss_growth_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_kb) / 1024, 1),
+    }
+
+def benchmark(fmt: str = "ndjson") -> Dict[str, Dict[str, float]]:
+    """measure_export for the streaming and buffered exports, each in a fresh process so peak RSS is its own"""
+    import subprocess
+    results = {}
+    for name, buffered in (("streaming", False), ("buffered", True)):
+        code = (
+            "import asyncio, json, bulk_export; "
+            f"print(json.dumps(asyncio.run(bulk_export.measure_export({fmt!r}, {buffered}))))"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True, capture_output=True, text=True
+        ).stdout
+        results[name] = json.loads(output.splitlines()[-1])
+    return results
+
+if __name__ == "__main__":
+    if len(sys.argv) in (2, 3) and sys.argv[1] == "benchmark":
+        for name, result in benchmark(*sys.argv[2:]).items():
+            print(
+                f"{name}: {result['rows']} rows, {result['rows_per_second']} rows/s, "
+                f"{result['mb_per_second']} MB/s, peak RSS +{result['peak_rss_growth_mb']} MB"
+            )
+    else:
+        print("Usage: python bulk_export.py benchmark [ndjson|csv]")
+        sys.exit(1)
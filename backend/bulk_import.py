@@ -0,0 +1,319 @@
+import os
+import sys
+import csv
+import codecs
+import json
+import uuid
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Type, Union
+from dotenv import load_dotenv
+from pydantic import BaseModel, ValidationError
+from database import async_engine
+from utils.encryption import encryption_service
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_MAX_REPORTED_ERRORS = int(os.getenv("IMPORT_MAX_REPORTED_ERRORS", "1000"))
+# Bounds on one line or CSV record, so a missing newline or an unbalanced quote can't make the parser buffer the rest of the file
+IMPORT_MAX_RECORD_LINES = int(os.getenv("IMPORT_MAX_RECORD_LINES", "1000"))
+IMPORT_MAX_RECORD_BYTES = int(os.getenv("IMPORT_MAX_RECORD_BYTES", str(1 << 20)))
+
+STAGING_TABLE = "veteran_profiles_import"
+
+# Columns loaded through COPY; import_row orders duplicates within a batch
+IMPORT_COLUMNS = [
+    "id", "email", "first_name", "middle_initial", "last_name", "ssn_encrypted", "ssn_blind_index", "ssn_last4", "phone",
+    "date_of_birth", "file_number", "veterans_service_number", "military_service",
+    "claim_info", "address", "claim_statement", "import_row",
+]
+JSON_FIELDS = ("military_service", "claim_info", "address")
+# Imported cohorts must not reset signup/payment state, and blank cells must not wipe data
+MERGE_COLUMNS = [c for c in IMPORT_COLUMNS if c not in ("id", "email", "import_row")]
+# Bound to the row id; only taken when the staged id matches (it won't if a row appeared concurrently)
+ID_BOUND_COLUMNS = ("ssn_encrypted", "ssn_blind_index", "ssn_last4")
+
+def _merge_assignment(column: str) -> str:
+    merged = f"COALESCE(EXCLUDED.{column}, veteran_profiles.{column})"
+    if column in ID_BOUND_COLUMNS:
+        return f"{column} = CASE WHEN veteran_profiles.id = EXCLUDED.id THEN {merged} ELSE veteran_profiles.{column} END"
+    return f"{column} = {merged}"
+
+CREATE_STAGING_SQL = f"""
+CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE}
+    (LIKE veteran_profiles INCLUDING DEFAULTS, import_row integer)
+    ON COMMIT DELETE ROWS
+"""
+
+MERGE_SQL = f"""
+INSERT INTO veteran_profiles ({", ".join(IMPORT_COLUMNS[:-1])})
+SELECT DISTINCT ON (email) {", ".join(IMPORT_COLUMNS[:-1])}
+FROM {STAGING_TABLE}
+ORDER BY email, import_row DESC
+ON CONFLICT (email) DO UPDATE SET
+    {", ".join(_merge_assignment(c) for c in MERGE_COLUMNS)},
+    updated_at = now()
+"""
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    imported: int = 0
+    failed: int = 0
+    batches: int = 0
+    errors: List[Dict[str, Any]] = field(default_factory=list)
+    started: float = field(default_factory=time.monotonic)
+
+    def add_error(self, row: int, error: Any):
+        self.failed += 1
+        # Keep memory constant for arbitrarily bad files
+        if len(self.errors) < IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "error": error})
+
+    def to_dict(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            "rows": self.rows,
+            "imported": self.imported,
+            "failed": self.failed,
+            "batches": self.batches,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+            "duration_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.rows / elapsed, 1) if elapsed else None,
+        }
+
+def _decode_line(line: bytes) -> Union[str, ValueError]:
+    try:
+        return line.rstrip(b"\r").decode("utf-8")
+    except UnicodeDecodeError as e:
+        return ValueError(f"Invalid UTF-8 at byte {e.start}")
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Union[str, ValueError]]:
+    """Split a byte stream into decoded lines without buffering the whole body.
+
+    Undecodable lines, and lines over IMPORT_MAX_RECORD_BYTES (the rest of which is skipped
+    up to the next newline), come back as a ValueError in their place.
+    """
+    pending = b""
+    at_start = True
+    skipping = False
+    too_long = ValueError(f"Line longer than {IMPORT_MAX_RECORD_BYTES} bytes; skipped")
+    async for chunk in chunks:
+        if skipping:
+            newline = chunk.find(b"\n")
+            if newline < 0:
+                continue
+            chunk, skipping = chunk[newline + 1:], False
+        pending += chunk
+        if at_start and len(pending) >= len(codecs.BOM_UTF8):
+            # Only the start of the stream can carry a byte order mark
+            pending, at_start = pending.removeprefix(codecs.BOM_UTF8), False
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield too_long if len(line) > IMPORT_MAX_RECORD_BYTES else _decode_line(line)
+        if len(pending) > IMPORT_MAX_RECORD_BYTES:
+            yield too_long
+            pending, skipping = b"", True
+    if at_start:
+        pending = pending.removeprefix(codecs.BOM_UTF8)
+    if pending.strip():
+        yield _decode_line(pending)
+
+async def iter_csv_records(lines: AsyncIterator[Union[str, ValueError]]) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    """Yield (row_number, record) from CSV lines, joining quoted fields that span lines"""
+    header: Optional[List[str]] = None
+    buffered: List[str] = []
+    buffered_bytes = quotes = 0
+    line_number = started_at = row_number = 0
+    async for line in lines:
+        line_number += 1
+        if isinstance(line, ValueError):
+            if header is None:
+                raise ValueError(f"Unreadable CSV header: {line}")
+            # A bad line fails the record it belongs to, multi-line or not
+            row_number += 1
+            yield row_number, ValueError(f"Record starting at line {started_at if buffered else line_number}: {line}")
+            buffered, buffered_bytes, quotes = [], 0, 0
+            continue
+        if not buffered:
+            started_at = line_number
+        buffered.append(line)
+        buffered_bytes += len(line)
+        quotes += line.count('"')
+        # An odd number of quotes means we're inside a quoted multi-line field
+        if quotes % 2:
+            if len(buffered) < IMPORT_MAX_RECORD_LINES and buffered_bytes < IMPORT_MAX_RECORD_BYTES:
+                continue
+            row_number += 1
+            yield row_number, ValueError(
+                f"Unterminated quoted field starting at line {started_at}; skipped {len(buffered)} lines"
+            )
+            buffered, buffered_bytes, quotes = [], 0, 0
+            continue
+        values = next(csv.reader(["\n".join(buffered)]), [])
+        buffered, buffered_bytes, quotes = [], 0, 0
+        if header is None:
+            header = [h.strip() for h in values]
+            continue
+        if not any(v.strip() for v in values):
+            continue
+        row_number += 1
+        if len(values) != len(header):
+            yield row_number, ValueError(f"Expected {len(header)} cells, got {len(values)}")
+            continue
+        try:
+            yield row_number, _nest(dict(zip(header, values)))
+        except ValueError as e:
+            yield row_number, e
+    if buffered:
+        row_number += 1
+        yield row_number, ValueError(
+            f"Unterminated quoted field starting at line {started_at}; {len(buffered)} lines left at end of input"
+        )
+
+async def iter_ndjson_records(lines: AsyncIterator[Union[str, ValueError]]) -> AsyncIterator[Tuple[int, Any]]:
+    row_number = 0
+    async for line in lines:
+        if isinstance(line, str) and not line.strip():
+            continue
+        row_number += 1
+        if isinstance(line, ValueError):
+            yield row_number, line
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_number, e
+            continue
+        if not isinstance(record, dict):
+            yield row_number, ValueError(f"Expected a JSON object, got {type(record).__name__}")
+            continue
+        yield row_number, record
+
+def _nest(record: Dict[str, str]) -> Dict[str, Any]:
+    """Turn flat CSV cells into request fields: blanks to None, dotted or JSON cells to objects"""
+    result: Dict[str, Any] = {}
+    for key, value in record.items():
+        value = value.strip() if isinstance(value, str) else value
+        if value == "":
+            continue
+        if "." in key:
+            parent, child = key.split(".", 1)
+            nested = result.setdefault(parent, {})
+            if not isinstance(nested, dict):
+                raise ValueError(f"Column {key} conflicts with column {parent}")
+            nested[child] = value
+        elif key in JSON_FIELDS and value.startswith("{"):
+            result[key] = json.loads(value)
+        else:
+            result[key] = value
+    return result
+
+def _encrypt_batch(items: List[Tuple[Optional[str], uuid.UUID]]) -> List[Any]:
+    """Encrypt and blind-index (ssn, row_id) pairs off the event loop; invalid values come back as the exception"""
+    present = [(ssn, row_id) for ssn, row_id in items if ssn]
+    protected = iter(encryption_service.protect_ssns(present))
+    return [next(protected) if ssn else {"ssn_encrypted": None, "ssn_blind_index": None, "ssn_last4": None} for ssn, _ in items]
+
+async def _load_batch(connection, batch: List[Tuple[int, BaseModel]], report: ImportReport):
+    loop = asyncio.get_running_loop()
+    # Ciphertexts are bound to the row id, so reuse the ids of profiles that already exist
+    existing = dict(await connection.fetch(
+        "SELECT email, id FROM veteran_profiles WHERE email = ANY($1::text[])",
+        list({row.email for _, row in batch})
+    ))
+    row_ids = [existing.get(row.email) or uuid.uuid4() for _, row in batch]
+    encrypted = await loop.run_in_executor(None, _encrypt_batch, [(row.ssn, row_id) for (_, row), row_id in zip(batch, row_ids)])
+
+    records = []
+    for (row_number, row), row_id, ssn_columns in zip(batch, row_ids, encrypted):
+        if isinstance(ssn_columns, Exception):
+            report.add_error(row_number, "Invalid SSN format")
+            continue
+        records.append((
+            row_id, row.email, row.first_name, row.middle_initial, row.last_name,
+            ssn_columns["ssn_encrypted"], ssn_columns["ssn_blind_index"], ssn_columns["ssn_last4"], row.phone, row.date_of_birth, row.file_number,
+            row.veterans_service_number,
+            json.dumps(row.military_service) if row.military_service else None,
+            json.dumps(row.claim_info) if row.claim_info else None,
+            json.dumps(row.address) if row.address else None,
+            row.claim_statement, row_number,
+        ))
+
+    if not records:
+        return
+    async with connection.transaction():
+        await connection.copy_records_to_table(STAGING_TABLE, records=records, columns=IMPORT_COLUMNS)
+        await connection.execute(MERGE_SQL)
+    report.imported += len(records)
+    report.batches += 1
+    logger.info(f"Imported batch {report.batches}: {len(records)} profiles ({report.rows} rows read)")
+
+async def import_profiles(
+    chunks: AsyncIterator[bytes],
+    fmt: str,
+    model: Type[BaseModel],
+    batch_size: int = IMPORT_BATCH_SIZE
+) -> ImportReport:
+    """Validate, encrypt and COPY-load a CSV/NDJSON stream of profiles in constant memory"""
+    if fmt not in ("csv", "ndjson"):
+        raise ValueError("format must be 'csv' or 'ndjson'")
+
+    report = ImportReport()
+    lines = iter_lines(chunks)
+    records = iter_csv_records(lines) if fmt == "csv" else iter_ndjson_records(lines)
+
+    async with async_engine.connect() as sa_connection:
+        raw = await sa_connection.get_raw_connection()
+        connection = raw.driver_connection
+        await connection.execute(CREATE_STAGING_SQL)
+
+        batch: List[Tuple[int, BaseModel]] = []
+        async for row_number, record in records:
+            report.rows += 1
+            if isinstance(record, Exception):
+                report.add_error(row_number, f"Invalid {'JSON' if fmt == 'ndjson' else 'record'}: {record}")
+                continue
+            try:
+                batch.append((row_number, model(**record)))
+            except ValidationError as e:
+                # Report field and message only; input values may contain PHI
+                report.add_error(row_number, [
+                    {"field": ".".join(str(part) for part in err["loc"]), "message": err["msg"]}
+                    for err in e.errors()
+                ])
+                continue
+            if len(batch) >= batch_size:
+                await _load_batch(connection, batch, report)
+                batch = []
+        if batch:
+            await _load_batch(connection, batch, report)
+
+    return report
+
+async def _file_chunks(path: str, chunk_size: int = 1 << 16) -> AsyncIterator[bytes]:
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+async def _cli(path: str, fmt: Optional[str]):
+    # Imported lazily: the request model lives with the API
+    from main import VeteranProfileRequest
+    fmt = fmt or ("ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv")
+    report = await import_profiles(_file_chunks(path), fmt, VeteranProfileRequest)
+    print(json.dumps(report.to_dict(), indent=2))
+    await async_engine.dispose()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2:
+        print("Usage: python bulk_import.py <file.csv|file.ndjson> [csv|ndjson]")
+        sys.exit(1)
+    asyncio.run(_cli(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None))
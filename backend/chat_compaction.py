@@ -0,0 +1,146 @@
+import os
+import math
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CHAT_TOKEN_BUDGET = int(os.getenv("CHAT_TOKEN_BUDGET", "3000"))
+CHAT_KEEP_RECENT_MESSAGES = int(os.getenv("CHAT_KEEP_RECENT_MESSAGES", "6"))
+CHAT_SUMMARY_CACHE_SIZE = int(os.getenv("CHAT_SUMMARY_CACHE_SIZE", "1024"))
+
+SUMMARY_PREFIX = "Summary of the earlier conversation with the veteran:\n"
+
+# Per-message framing overhead (role, separators) in chat-completion prompts
+MESSAGE_OVERHEAD_TOKENS = 4
+
+Summarizer = Callable[[Optional[str], List[dict]], Awaitable[str]]
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return math.ceil(len(text) / 4) if text else 0
+
+def message_tokens(message: dict) -> int:
+    return estimate_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+def extractive_summary(previous_summary: Optional[str], messages: List[dict], max_chars: int = 240) -> str:
+    """Fallback summary that keeps the first part of each evicted turn"""
+    lines = [previous_summary] if previous_summary else []
+    for message in messages:
+        content = " ".join(message.get("content", "").split())
+        if len(content) > max_chars:
+            content = content[:max_chars].rstrip() + "..."
+        lines.append(f"{message.get('role', 'user')}: {content}")
+    return "\n".join(lines)
+
+@dataclass
+class CompactionResult:
+    messages: List[dict]
+    original_tokens: int
+    compacted_tokens: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.original_tokens - self.compacted_tokens)
+
+class ConversationCompactor:
+    """Fits a chat history into a token budget, summarizing older turns incrementally"""
+
+    def __init__(
+        self,
+        summarize: Summarizer,
+        token_budget: int = CHAT_TOKEN_BUDGET,
+        keep_recent: int = CHAT_KEEP_RECENT_MESSAGES,
+        cache_size: int = CHAT_SUMMARY_CACHE_SIZE,
+    ):
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.cache_size = cache_size
+        # Prefix-chain hash -> summary of every conversation message up to that prefix
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+
+    async def compact(self, messages: List[dict]) -> CompactionResult:
+        original_tokens = sum(message_tokens(m) for m in messages)
+        if original_tokens <= self.token_budget:
+            return CompactionResult(messages, original_tokens, original_tokens)
+
+        system_messages = [m for m in messages if m.get("role") == "system"]
+        conversation = [m for m in messages if m.get("role") != "system"]
+        available = self.token_budget - sum(message_tokens(m) for m in system_messages)
+
+        # Keep the most recent turns verbatim, always including the latest one
+        recent: List[dict] = []
+        used = 0
+        for message in reversed(conversation):
+            tokens = message_tokens(message)
+            if recent and (len(recent) >= self.keep_recent or used + tokens > available):
+                break
+            recent.insert(0, message)
+            used += tokens
+
+        older = conversation[:len(conversation) - len(recent)]
+        if not older:
+            return CompactionResult(messages, original_tokens, original_tokens)
+
+        summary = await self._summary_for(older)
+        summary_message = {"role": "system", "content": SUMMARY_PREFIX + summary}
+        compacted = system_messages + [summary_message] + recent
+        compacted_tokens = sum(message_tokens(m) for m in compacted)
+        return CompactionResult(compacted, original_tokens, compacted_tokens)
+
+    async def _summary_for(self, older: List[dict]) -> str:
+        prefix_hashes = self._prefix_hashes(older)
+
+        # Resume from the longest prefix that has already been summarized
+        covered, previous_summary = 0, None
+        for index in range(len(older), 0, -1):
+            cached = self._summaries.get(prefix_hashes[index - 1])
+            if cached is not None:
+                self._summaries.move_to_end(prefix_hashes[index - 1])
+                covered, previous_summary = index, cached
+                break
+
+        if covered == len(older):
+            return previous_summary
+
+        delta = older[covered:]
+        try:
+            summary = await self.summarize(previous_summary, delta)
+        except Exception as e:
+            logger.warning(f"Conversation summarization failed, using extractive summary: {str(e)}")
+            return extractive_summary(previous_summary, delta)
+
+        self._remember(prefix_hashes[-1], summary)
+        return summary
+
+    def _remember(self, key: str, summary: str):
+        self._summaries[key] = summary
+        self._summaries.move_to_end(key)
+        while len(self._summaries) > self.cache_size:
+            self._summaries.popitem(last=False)
+
+    @staticmethod
+    def _prefix_hashes(messages: List[dict]) -> List[str]:
+        """Hash chain where entry i identifies the exact sequence messages[:i + 1]"""
+        hashes = []
+        digest = b""
+        for message in messages:
+            encoded = json.dumps(
+                {"role": message.get("role"), "content": message.get("content")},
+                sort_keys=True,
+            ).encode()
+            digest = hashlib.sha256(digest + encoded).digest()
+            hashes.append(digest.hex())
+        return hashes
+
+    def stats(self) -> Dict[str, int]:
+        return {"cached_summaries": len(self._summaries), "token_budget": self.token_budget}
@@ -1,29 +1,165 @@
 import os
+import ast
+import sys
+import time
+import asyncio
+import logging
+from typing import Dict, Optional
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, event, MetaData, text
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.engine import make_url, URL
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from fastapi import Request
+from metrics import metrics
+from sql_instrumentation import instrument_engine
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Database configuration
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is required")
 
+# Optional streaming replica for read-only endpoints
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+
+# Pool sizing is per engine per worker: size it as max_connections / (workers * engines)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# After a write, reads of the same key stay on the primary until the replica has caught up
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
+# Apply pending migrations at startup instead of refusing to start
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "false").lower() in ("1", "true", "yes")
+ALEMBIC_DIR = os.path.dirname(os.path.abspath(__file__))
+# pg_advisory_lock key so only one worker runs migrations at a time
+MIGRATION_LOCK_KEY = 4_173_201
+MIGRATION_LOCK_POLL_SECONDS = float(os.getenv("MIGRATION_LOCK_POLL_SECONDS", "1"))
+
+def timed_pool(base, name: str):
+    """Pool class that records how long callers wait for a connection"""
+    class TimedPool(base):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                metrics.observe(f"db.{name}.checkout_wait", time.perf_counter() - started)
+    TimedPool.__name__ = f"Timed{base.__name__}"
+    return TimedPool
+
+def pool_options(base, name: str) -> dict:
+    return {
+        "poolclass": timed_pool(base, name),
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+def instrument_pool(sync_engine, name: str):
+    """Count connects and invalidations (failed pre-pings and dropped connections)"""
+    @event.listens_for(sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        metrics.incr(f"db.{name}.connects")
+
+    @event.listens_for(sync_engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.incr(f"db.{name}.invalidated")
+        logger.warning(f"Invalidated {name} database connection: {str(exception)}")
+
 # Create engine with connection pooling
 engine = create_engine(
     DATABASE_URL,
-    pool_size=10,
-    max_overflow=20,
-    pool_pre_ping=True,
-    echo=False  # Set to True for SQL debugging
+    echo=False,  # Set to True for SQL debugging
+    **pool_options(QueuePool, "sync")
 )
+instrument_pool(engine, "sync")
+instrument_engine(engine, "sync")
 
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def to_async_url(url: str) -> URL:
+    """Convert a psycopg2-style DATABASE_URL to its asyncpg equivalent"""
+    parsed = make_url(url)
+    query = dict(parsed.query)
+    # asyncpg takes "ssl" rather than libpq's "sslmode"
+    sslmode = query.pop("sslmode", None)
+    if sslmode:
+        query["ssl"] = sslmode
+    return parsed.set(drivername="postgresql+asyncpg", query=query)
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+# Async engine used by request handlers so SQL round-trips don't block the event loop
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    echo=False,
+    **pool_options(AsyncAdaptedQueuePool, "primary")
+)
+instrument_pool(async_engine.sync_engine, "primary")
+instrument_engine(async_engine.sync_engine, "primary")
+
+replica_engine = None
+if DATABASE_REPLICA_URL:
+    replica_engine = create_async_engine(
+        to_async_url(DATABASE_REPLICA_URL),
+        echo=False,
+        **pool_options(AsyncAdaptedQueuePool, "replica")
+    )
+    instrument_pool(replica_engine.sync_engine, "replica")
+    instrument_engine(replica_engine.sync_engine, "replica")
+
+def asyncpg_dsn() -> str:
+    """Plain DSN for direct asyncpg connections (LISTEN/NOTIFY, COPY)"""
+    return make_url(str(ASYNC_DATABASE_URL)).set(drivername="postgresql").render_as_string(hide_password=False)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+# Falls back to the primary when no replica is configured
+ReadSessionLocal = async_sessionmaker(replica_engine or async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+class ReadRouter:
+    """Tracks recently written keys so their reads go to the primary (read-your-writes)"""
+
+    def __init__(self, window: float = READ_YOUR_WRITES_SECONDS):
+        self.window = window
+        self._written: Dict[str, float] = {}
+        self._all_written_until = 0.0
+        # Cleared when writes made by other workers can no longer be seen (no invalidation channel)
+        self.replica_available = True
+
+    def mark_written(self, key: str):
+        now = time.monotonic()
+        self._written[key] = now + self.window
+        # Prune lazily so the map stays bounded by the write rate
+        if len(self._written) > 10000:
+            self._written = {k: until for k, until in self._written.items() if until > now}
+
+    def mark_all_written(self):
+        self._all_written_until = time.monotonic() + self.window
+
+    def use_primary(self, key: Optional[str]) -> bool:
+        if replica_engine is None or not self.replica_available:
+            return True
+        now = time.monotonic()
+        if now < self._all_written_until:
+            return True
+        return key is not None and self._written.get(key, 0.0) > now
+
+# Create a global instance
+read_router = ReadRouter()
+
 # Create declarative base
 Base = declarative_base()
 metadata = MetaData()
@@ -36,6 +172,213 @@ def get_db():
     finally:
         db.close()
 
-# Create tables
-def create_tables():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+# Dependency to get an async database session
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Dependency for read-only endpoints: replica unless the profile was just written
+async def get_read_db(request: Request):
+    key = request.path_params.get("email")
+    if read_router.use_primary(key):
+        metrics.incr("db.reads.primary")
+        session_factory = AsyncSessionLocal
+    else:
+        metrics.incr("db.reads.replica")
+        session_factory = ReadSessionLocal
+    async with session_factory() as db:
+        yield db
+
+def pool_stats() -> dict:
+    """Point-in-time occupancy of each connection pool"""
+    engines = {"sync": engine, "primary": async_engine.sync_engine}
+    if replica_engine is not None:
+        engines["replica"] = replica_engine.sync_engine
+    stats = {}
+    for name, sync_engine in engines.items():
+        pool = sync_engine.pool
+        stats[name] = {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": DB_MAX_OVERFLOW,
+        }
+    return stats
+
+# Close pooled async connections
+async def dispose_engines():
+    await async_engine.dispose()
+    if replica_engine is not None:
+        await replica_engine.dispose()
+
+def alembic_config():
+    from alembic.config import Config
+    config = Config(os.path.join(ALEMBIC_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(ALEMBIC_DIR, "migrations"))
+    return config
+
+def schema_head() -> str:
+    """Latest migration revision shipped with this build (read from files, no DB access).
+
+    The revision graph is read with ast so a worker's startup check doesn't import alembic
+    (~100 ms); anything but a single linear head is left to alembic to resolve or reject.
+    """
+    revisions, parents = set(), set()
+    versions_dir = os.path.join(ALEMBIC_DIR, "migrations", "versions")
+    for name in os.listdir(versions_dir):
+        if not name.endswith(".py"):
+            continue
+        with open(os.path.join(versions_dir, name)) as f:
+            module = ast.parse(f.read())
+        values = {
+            node.targets[0].id: ast.literal_eval(node.value)
+            for node in module.body
+            if isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name)
+            and node.targets[0].id in ("revision", "down_revision")
+        }
+        revisions.add(values.get("revision"))
+        parents.add(values.get("down_revision"))
+    heads = revisions - parents
+    if len(heads) == 1 and all(isinstance(parent, (str, type(None))) for parent in parents):
+        return heads.pop()
+    from alembic.script import ScriptDirectory
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+async def current_schema_revision() -> Optional[str]:
+    async with async_engine.connect() as connection:
+        try:
+            return await connection.scalar(text("SELECT version_num FROM alembic_version"))
+        except ProgrammingError:
+            return None
+
+def upgrade_schema():
+    """Run alembic upgrade head, serialized across workers with an advisory lock.
+
+    Waiting workers poll pg_try_advisory_lock on an autocommit connection rather than blocking
+    in pg_advisory_lock: a blocked worker sits in an open transaction, and CREATE INDEX
+    CONCURRENTLY in the lock holder waits for every older transaction to finish.
+    """
+    from alembic import command
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_connection:
+        while not lock_connection.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY}):
+            time.sleep(MIGRATION_LOCK_POLL_SECONDS)
+        try:
+            # Migrations run on their own connection so the lock session never holds a snapshot
+            with engine.connect() as connection:
+                config = alembic_config()
+                config.attributes["connection"] = connection
+                command.upgrade(config, "head")
+        finally:
+            lock_connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+async def check_schema():
+    """Single-query startup check that the database is at the migration head"""
+    head = schema_head()
+    current = await current_schema_revision()
+    if current == head:
+        logger.info(f"Database schema at revision {head}")
+        return
+    if AUTO_MIGRATE:
+        logger.info(f"Migrating database schema from {current or 'unversioned'} to {head}")
+        await asyncio.to_thread(upgrade_schema)
+        return
+    raise RuntimeError(
+        f"Database schema is at {current or 'unversioned'}, expected {head}; "
+        "run `alembic upgrade head` (or set AUTO_MIGRATE=true)"
+    )
+
+# Each runs in a fresh interpreter after `import database`, and prints its own duration in ms
+STARTUP_STEPS = {
+    "create_all": "import models; models.Base.metadata.create_all(database.engine)",
+    "check_schema": "asyncio.run(database.check_schema())",
+}
+
+def benchmark_startup(iterations: int = 10) -> Dict[str, float]:
+    """Median per-worker startup schema step in ms: create_all (before) vs check_schema (after).
+
+    Every sample is a new process, so the step pays for its own imports and first connection
+    as a freshly booted worker does. Expects a database already at the migration head.
+    """
+    import subprocess
+    result = {}
+    for name, step in STARTUP_STEPS.items():
+        code = (
+            "import asyncio, time, database; started = time.perf_counter(); "
+            f"{step}; print((time.perf_counter() - started) * 1000)"
+        )
+        samples = sorted(
+            float(subprocess.run(
+                [sys.executable, "-c", code], cwd=ALEMBIC_DIR, check=True, capture_output=True, text=True
+            ).stdout.split()[-1])
+            for _ in range(iterations)
+        )
+        result[f"{name}_ms"] = round(samples[len(samples) // 2], 2)
+    return result
+
+async def benchmark_event_loop(requests: int = 2000, concurrency: int = 20, query_ms: float = 2) -> Dict[str, Dict[str, float]]:
+    """Event-loop lag and throughput of concurrent handlers on a sync Session (before) vs an AsyncSession (after).
+
+    Each handler runs one `SELECT pg_sleep(query_ms)` the way the endpoints did; a ticker asking
+    for 1 ms sleeps records how late the loop wakes it.
+    """
+    query = text("SELECT pg_sleep(:seconds)").bindparams(seconds=query_ms / 1000)
+
+    async def sync_handler():
+        with SessionLocal() as db:
+            db.execute(query)
+
+    async def async_handler():
+        async with AsyncSessionLocal() as db:
+            await db.execute(query)
+
+    async def run(handler) -> Dict[str, float]:
+        remaining = requests
+        lags = []
+        done = asyncio.Event()
+
+        async def client():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                await handler()
+                # The server yields between requests (socket reads) even when a handler doesn't
+                await asyncio.sleep(0)
+
+        async def ticker():
+            while not done.is_set():
+                started = time.perf_counter()
+                await asyncio.sleep(0.001)
+                lags.append((time.perf_counter() - started) * 1000 - 1)
+
+        # Warm the pool so connection setup isn't measured
+        await asyncio.gather(*(handler() for _ in range(concurrency)))
+        monitor = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await monitor
+        lags.sort()
+        return {
+            "requests_per_second": round(requests / elapsed),
+            "p99_lag_ms": round(lags[int(len(lags) * 0.99)], 2),
+            "max_lag_ms": round(lags[-1], 2),
+        }
+
+    try:
+        return {"sync": await run(sync_handler), "async": await run(async_handler)}
+    finally:
+        engine.dispose()
+        await async_engine.dispose()
+
+if __name__ == "__main__":
+    if len(sys.argv) in (2, 3) and sys.argv[1] == "benchmark-startup":
+        result = benchmark_startup(*map(int, sys.argv[2:]))
+        print(f"create_all {result['create_all_ms']} ms, check_schema {result['check_schema_ms']} ms (median per worker start)")
+    elif len(sys.argv) in (2, 3, 4) and sys.argv[1] == "benchmark-loop":
+        for name, result in asyncio.run(benchmark_event_loop(*map(int, sys.argv[2:]))).items():
+            print(f"{name}: {result['requests_per_second']} req/s, loop lag p99 {result['p99_lag_ms']} ms, max {result['max_lag_ms']} ms")
+    else:
+        print("Usage: python database.py benchmark-startup [iterations] | benchmark-loop [requests] [concurrency]")
+        sys.exit(1)
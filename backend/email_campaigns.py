@@ -0,0 +1,93 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+import logging
+from typing import AsyncIterator
+from dotenv import load_dotenv
+from sqlalchemy import func, select
+from database import ReadSessionLocal, dispose_engines
+from models import VeteranProfile
+from email_service import email_service, campaign_address, BatchRecipient, CampaignReport, EMAIL_BATCH_SIZE
+from http_clients import http_clients
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EMAIL_CAMPAIGN_PAGE_SIZE = int(os.getenv("EMAIL_CAMPAIGN_PAGE_SIZE", "1000"))
+EMAIL_CAMPAIGN_APP_URL = os.getenv("EMAIL_CAMPAIGN_APP_URL", "https://vets4claims.com")
+
+# Matches campaign_address and ix_veteran_profiles_email_lower
+RECIPIENT_ORDER = func.lower(func.btrim(VeteranProfile.email))
+
+async def unpaid_recipients(page_size: int = EMAIL_CAMPAIGN_PAGE_SIZE) -> AsyncIterator[BatchRecipient]:
+    """Profiles that haven't paid, keyset-paginated by normalized address so no connection is
+    held between pages and spellings of one address arrive together (send_campaign drops repeats).
+    A page boundary inside such a group skips the rest of it, which are repeats anyway."""
+    after = ""
+    while True:
+        async with ReadSessionLocal() as db:
+            rows = (await db.execute(
+                select(VeteranProfile.email, VeteranProfile.first_name, RECIPIENT_ORDER.label("address"))
+                .where(VeteranProfile.has_paid.isnot(True), RECIPIENT_ORDER > after)
+                .order_by(RECIPIENT_ORDER)
+                .limit(page_size)
+            )).all()
+        if not rows:
+            return
+        for row in rows:
+            # Only what the template needs is passed to Mailgun
+            yield BatchRecipient(email=row.email, variables={"first_name": row.first_name})
+        after = rows[-1].address
+
+async def payment_reminder(batch_size: int = EMAIL_BATCH_SIZE, page_size: int = EMAIL_CAMPAIGN_PAGE_SIZE) -> CampaignReport:
+    """Remind every profile with has_paid unset to finish their claim"""
+    return await email_service.send_campaign(
+        unpaid_recipients(page_size),
+        subject="🇺🇸 Finish Your VA Disability Claim",
+        html_content=email_service.create_payment_reminder_email(EMAIL_CAMPAIGN_APP_URL),
+        batch_size=batch_size,
+        tag="payment-reminder"
+    )
+
+CAMPAIGNS = {
+    "payment-reminder": (payment_reminder, unpaid_recipients),
+}
+
+async def _cli(args):
+    campaign, recipients = CAMPAIGNS[args.command]
+    try:
+        if args.dry_run:
+            count, previous = 0, None
+            async for recipient in recipients(args.page_size):
+                # Same dedupe as send_campaign, so the count is what would be sent
+                address = campaign_address(recipient.email)
+                if address != previous:
+                    count += 1
+                previous = address
+            print(json.dumps({"recipients": count, "batches": -(-count // args.batch_size)}, indent=2))
+            return
+        await http_clients.start()
+        report = await campaign(batch_size=args.batch_size, page_size=args.page_size)
+        print(json.dumps(report.to_dict(), indent=2))
+    finally:
+        await http_clients.close()
+        await dispose_engines()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Bulk notification emails sent through Mailgun batch sending")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    for command, help_text in (
+        ("payment-reminder", "Email every veteran profile that hasn't paid"),
+    ):
+        job = subcommands.add_parser(command, help=help_text)
+        job.add_argument("--batch-size", type=int, default=EMAIL_BATCH_SIZE, help="Recipients per Mailgun request (max 1000)")
+        job.add_argument("--page-size", type=int, default=EMAIL_CAMPAIGN_PAGE_SIZE, help="Recipients read from the database per query")
+        job.add_argument("--dry-run", action="store_true", help="Only count recipients and batches")
+
+    asyncio.run(_cli(parser.parse_args(sys.argv[1:])))
@@ -0,0 +1,251 @@
+import os
+import time
+import uuid
+import random
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+from database import AsyncSessionLocal
+from models import EmailOutbox
+from email_service import email_service, EmailRequest, EmailDeliveryError
+from metrics import metrics
+from utils.encryption import encryption_service, field_aad
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EMAIL_OUTBOX_WORKERS = int(os.getenv("EMAIL_OUTBOX_WORKERS", "4"))
+EMAIL_OUTBOX_POLL_SECONDS = float(os.getenv("EMAIL_OUTBOX_POLL_SECONDS", "5"))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "8"))
+EMAIL_OUTBOX_BASE_BACKOFF_SECONDS = float(os.getenv("EMAIL_OUTBOX_BASE_BACKOFF_SECONDS", "5"))
+EMAIL_OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("EMAIL_OUTBOX_MAX_BACKOFF_SECONDS", "900"))
+# A claimed message not finished within the lease (e.g. the worker died) is picked up again.
+# Keep it well above one send's worst case (Mailgun timeout x MAILGUN_MAX_ATTEMPTS).
+EMAIL_OUTBOX_LEASE_SECONDS = float(os.getenv("EMAIL_OUTBOX_LEASE_SECONDS", "120"))
+EMAIL_OUTBOX_METRICS_SECONDS = float(os.getenv("EMAIL_OUTBOX_METRICS_SECONDS", "15"))
+EMAIL_OUTBOX_RETENTION_DAYS = int(os.getenv("EMAIL_OUTBOX_RETENTION_DAYS", "7"))
+
+PAYLOAD_FIELD = "email_outbox.payload"
+
+# Due messages plus sends whose lease ran out; SKIP LOCKED lets workers (and replicas) claim disjoint rows.
+# One row per claim, so the lease only has to cover a single send.
+CLAIM_SQL = text("""
+UPDATE email_outbox AS o
+SET status = 'sending', attempts = o.attempts + 1,
+    next_attempt_at = now() + make_interval(secs => :lease)
+FROM (
+    SELECT id FROM email_outbox
+    WHERE status IN ('pending', 'sending') AND next_attempt_at <= now()
+    ORDER BY next_attempt_at
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+) AS due
+WHERE o.id = due.id
+RETURNING o.id, o.idempotency_key, o.payload_encrypted, o.attempts, o.expires_at
+""")
+
+# Payloads are dropped once a message is settled so PHI isn't kept longer than needed.
+# Settling only applies to our own claim: if the lease ran out and another worker reclaimed the
+# row, attempts has moved on and the update matches nothing.
+MARK_SENT_SQL = text("""
+UPDATE email_outbox
+SET status = 'sent', sent_at = now(), provider_message_id = :provider_message_id,
+    payload_encrypted = NULL, last_error = NULL
+WHERE id = :id AND status = 'sending' AND attempts = :attempts
+""")
+
+MARK_RETRY_SQL = text("""
+UPDATE email_outbox
+SET status = 'pending', next_attempt_at = now() + make_interval(secs => :delay), last_error = :error
+WHERE id = :id AND status = 'sending' AND attempts = :attempts
+""")
+
+MARK_FINAL_SQL = text("""
+UPDATE email_outbox
+SET status = :status, payload_encrypted = NULL, last_error = :error
+WHERE id = :id AND status = 'sending' AND attempts = :attempts
+""")
+
+QUEUE_STATS_SQL = text("""
+SELECT count(*) FILTER (WHERE status IN ('pending', 'sending')) AS depth,
+       count(*) FILTER (WHERE status = 'sending') AS in_flight,
+       count(*) FILTER (WHERE status IN ('failed', 'expired')) AS dead,
+       EXTRACT(EPOCH FROM now() - min(created_at) FILTER (WHERE status IN ('pending', 'sending'))) AS oldest_age
+FROM email_outbox
+WHERE status <> 'sent'
+""")
+
+PURGE_SQL = text("""
+DELETE FROM email_outbox
+WHERE status IN ('sent', 'failed', 'expired') AND created_at < now() - make_interval(days => :days)
+""")
+
+def backoff_seconds(attempts: int) -> float:
+    """Jittered exponential delay before retry number `attempts` + 1"""
+    delay = min(EMAIL_OUTBOX_MAX_BACKOFF_SECONDS, EMAIL_OUTBOX_BASE_BACKOFF_SECONDS * (2 ** (attempts - 1)))
+    # Equal jitter: never retry immediately, but spread retries after a Mailgun outage
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class EmailOutboxWorker:
+    """Durable outgoing email queue in Postgres, drained by a bounded pool of async workers"""
+
+    def __init__(self, workers: int = EMAIL_OUTBOX_WORKERS):
+        self.workers = workers
+        self._tasks: List[asyncio.Task] = []
+        self._wake = asyncio.Event()
+        self._queue_stats = {"depth": 0, "in_flight": 0, "dead": 0, "oldest_age_seconds": 0.0}
+
+    async def enqueue(
+        self,
+        email_request: EmailRequest,
+        idempotency_key: Optional[str] = None,
+        expires_in: Optional[float] = None
+    ) -> Tuple[uuid.UUID, bool]:
+        """Persist a message for delivery; returns (outbox id, False if the key was already queued)"""
+        outbox_id = uuid.uuid4()
+        payload = encryption_service.encrypt_text(email_request.json(), aad=field_aad(PAYLOAD_FIELD, outbox_id))
+        values = {
+            "id": outbox_id,
+            "idempotency_key": idempotency_key or str(outbox_id),
+            "payload_encrypted": payload,
+            "status": "pending",
+            "attempts": 0,
+        }
+        if expires_in is not None:
+            values["expires_at"] = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+
+        async with AsyncSessionLocal() as db:
+            inserted = (await db.execute(
+                insert(EmailOutbox).values(**values)
+                .on_conflict_do_nothing(index_elements=["idempotency_key"])
+                .returning(EmailOutbox.id)
+            )).scalar_one_or_none()
+            if inserted is None:
+                existing = (await db.execute(
+                    select(EmailOutbox.id).where(EmailOutbox.idempotency_key == values["idempotency_key"])
+                )).scalar_one()
+            await db.commit()
+
+        if inserted is None:
+            metrics.incr("email_outbox.duplicates")
+            return existing, False
+        metrics.incr("email_outbox.enqueued")
+        self._wake.set()
+        return inserted, True
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._work(n)) for n in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._monitor()))
+        logger.info(f"Email outbox started with {self.workers} workers")
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        # Messages being sent at shutdown keep status sending and are reclaimed after their lease
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self, worker: int):
+        while True:
+            # Cleared before claiming so an enqueue that lands mid-claim still wakes us
+            self._wake.clear()
+            try:
+                row = await self._claim()
+                if row is not None:
+                    await self._deliver(row)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # An unsettled claim keeps status sending and is retried once its lease expires
+                logger.error(f"Email outbox worker {worker} failed: {str(e)}")
+                row = None
+
+            if row is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=EMAIL_OUTBOX_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _claim(self):
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(CLAIM_SQL, {"lease": EMAIL_OUTBOX_LEASE_SECONDS})).first()
+            await db.commit()
+        return row
+
+    async def _settle(self, statement, row, **params):
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(statement, {"id": row.id, "attempts": row.attempts, **params})
+            await db.commit()
+        if result.rowcount == 0:
+            metrics.incr("email_outbox.lease_lost")
+            logger.warning(f"Email {row.id} attempt {row.attempts} finished after its lease expired; left to the new owner")
+
+    async def _deliver(self, row):
+        if row.expires_at is not None and row.expires_at <= datetime.now(timezone.utc):
+            metrics.incr("email_outbox.expired")
+            logger.warning(f"Email {row.id} expired after {row.attempts - 1} attempts without being sent")
+            await self._settle(MARK_FINAL_SQL, row, status="expired", error="Expired before it could be sent")
+            return
+
+        started = time.monotonic()
+        try:
+            email_request = EmailRequest.parse_raw(
+                encryption_service.decrypt_text(row.payload_encrypted, aad=field_aad(PAYLOAD_FIELD, row.id))
+            )
+            result = await email_service.deliver(email_request, idempotency_key=row.idempotency_key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            retryable = e.retryable if isinstance(e, EmailDeliveryError) else False
+            error = f"{type(e).__name__}: {str(e)}"[:1000]
+            if retryable and row.attempts < EMAIL_OUTBOX_MAX_ATTEMPTS:
+                delay = backoff_seconds(row.attempts)
+                metrics.incr("email_outbox.retries")
+                logger.warning(f"Email {row.id} attempt {row.attempts} failed, retrying in {delay:.0f}s: {error}")
+                await self._settle(MARK_RETRY_SQL, row, delay=delay, error=error)
+            else:
+                metrics.incr("email_outbox.failed")
+                logger.error(f"Email {row.id} failed permanently after {row.attempts} attempts: {error}")
+                await self._settle(MARK_FINAL_SQL, row, status="failed", error=error)
+            return
+        finally:
+            metrics.observe("email_outbox.delivery", time.monotonic() - started)
+
+        metrics.incr("email_outbox.sent")
+        await self._settle(MARK_SENT_SQL, row, provider_message_id=result.get("email_id"))
+
+    async def _monitor(self):
+        """Refresh queue depth/age gauges and purge settled messages past retention"""
+        while True:
+            try:
+                async with AsyncSessionLocal() as db:
+                    row = (await db.execute(QUEUE_STATS_SQL)).one()
+                    await db.execute(PURGE_SQL, {"days": EMAIL_OUTBOX_RETENTION_DAYS})
+                    await db.commit()
+                self._queue_stats = {
+                    "depth": row.depth,
+                    "in_flight": row.in_flight,
+                    "dead": row.dead,
+                    "oldest_age_seconds": round(float(row.oldest_age or 0.0), 1),
+                }
+                metrics.set_gauge("email_outbox.depth", row.depth)
+                metrics.set_gauge("email_outbox.oldest_age_seconds", self._queue_stats["oldest_age_seconds"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Could not refresh email outbox stats: {str(e)}")
+            await asyncio.sleep(EMAIL_OUTBOX_METRICS_SECONDS)
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "running": bool(self._tasks), **self._queue_stats}
+
+# Create a global instance
+email_outbox = EmailOutboxWorker()
@@ -1,15 +1,30 @@
 import os
+import json
+import time
+import random
+import asyncio
 from dotenv import load_dotenv
-import httpx
 import logging
-from typing import Optional
+from dataclasses import dataclass, field, asdict
+from typing import Any, AsyncIterable, Dict, List, Optional
 from pydantic import BaseModel
+import httpx
+from http_clients import http_clients
+from resilience import upstreams, CircuitOpenError, SAFE_TO_RETRY_ERRORS
 
 # Load environment variables
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Statuses where Mailgun did not accept the message, so sending it again cannot duplicate it
+MAILGUN_RETRYABLE_STATUS_CODES = {429, 503}
+
+# Mailgun accepts at most 1000 recipients per batch-sending request
+MAILGUN_MAX_BATCH_RECIPIENTS = 1000
+EMAIL_BATCH_SIZE = min(int(os.getenv("EMAIL_BATCH_SIZE", "1000")), MAILGUN_MAX_BATCH_RECIPIENTS)
+EMAIL_BATCH_MAX_ATTEMPTS = int(os.getenv("EMAIL_BATCH_MAX_ATTEMPTS", "3"))
+
 class EmailRequest(BaseModel):
     to_email: str
     to_name: str
@@ -18,6 +33,48 @@ class EmailRequest(BaseModel):
     from_email: Optional[str] = None
     from_name: Optional[str] = None
 
+class BatchRecipient(BaseModel):
+    email: str
+    # Substituted for %recipient.<name>% in the subject and body
+    variables: Dict[str, Any] = {}
+
+def campaign_address(email: str) -> str:
+    """Address as campaigns compare it; SQL sources order by the same lower(btrim(email))"""
+    return email.strip().lower()
+
+@dataclass
+class BatchResult:
+    batch: int
+    recipients: int
+    attempts: int
+    seconds: float
+    recipients_per_second: float
+    email_id: Optional[str] = None
+    error: Optional[str] = None
+
+@dataclass
+class CampaignReport:
+    sent: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+    batches: List[BatchResult] = field(default_factory=list)
+    # One {"email", "error"} entry per recipient Mailgun did not accept
+    failures: List[dict] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+class EmailDeliveryError(Exception):
+    """Raised when a message was not confirmed as accepted by Mailgun.
+
+    retryable means Mailgun certainly did not accept it; otherwise it may or may not have
+    been sent (e.g. a read timeout) and must not be resent automatically.
+    """
+    def __init__(self, message: str, retryable: bool, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.status_code = status_code
+
 class EmailService:
     def __init__(self):
         self.mailgun_api_key = os.getenv("MAILGUN_API_KEY")
@@ -31,76 +88,217 @@ class EmailService:
         else:
             logger.info(f"Mailgun configured with domain: {self.mailgun_domain}, region: {self.mailgun_region}")
 
-    async def send_email(self, email_request: EmailRequest) -> dict:
-        """Send email using Mailgun API"""
-        try:
-            if not self.mailgun_api_key or not self.mailgun_domain:
-                logger.warning(f"Mailgun not configured - simulating email send to {email_request.to_email}")
-                logger.info(f"Email content would be: {email_request.subject}")
-                return {
-                    "success": True,
-                    "message": "Email simulated - Mailgun not configured",
-                    "email_id": "simulated"
-                }
-
-            # Determine the correct Mailgun API endpoint based on region
-            if self.mailgun_region.upper() == "EU":
-                mailgun_url = f"https://api.eu.mailgun.net/v3/{self.mailgun_domain}/messages"
-            else:
-                mailgun_url = f"https://api.mailgun.net/v3/{self.mailgun_domain}/messages"
-
-            # Prepare form data for Mailgun
-            form_data = {
-                "from": f"{email_request.from_name or self.mailgun_from_name} <{email_request.from_email or self.mailgun_from_email}>",
-                "to": email_request.to_email,
-                "subject": email_request.subject,
-                "html": email_request.html_content
+    @property
+    def configured(self) -> bool:
+        return bool(self.mailgun_api_key and self.mailgun_domain)
+
+    def messages_url(self) -> str:
+        """Mailgun messages endpoint for the configured region"""
+        if self.mailgun_region.upper() == "EU":
+            return f"https://api.eu.mailgun.net/v3/{self.mailgun_domain}/messages"
+        return f"https://api.mailgun.net/v3/{self.mailgun_domain}/messages"
+
+    async def deliver(self, email_request: EmailRequest, idempotency_key: Optional[str] = None) -> dict:
+        """Send email using Mailgun API, raising EmailDeliveryError if Mailgun does not accept it"""
+        if not self.configured:
+            logger.warning(f"Mailgun not configured - simulating email send to {email_request.to_email}")
+            logger.info(f"Email content would be: {email_request.subject}")
+            return {
+                "success": True,
+                "message": "Email simulated - Mailgun not configured",
+                "email_id": "simulated"
             }
 
-            # Send email via Mailgun
-            async with httpx.AsyncClient() as client:
-                logger.info(f"Attempting to send email via Mailgun - Domain: {self.mailgun_domain}, Region: {self.mailgun_region}, To: {email_request.to_email}")
-                response = await client.post(
-                    mailgun_url,
+        # Prepare form data for Mailgun
+        form_data = {
+            "from": f"{email_request.from_name or self.mailgun_from_name} <{email_request.from_email or self.mailgun_from_email}>",
+            "to": email_request.to_email,
+            "subject": email_request.subject,
+            "html": email_request.html_content
+        }
+        if idempotency_key:
+            # A stable Message-Id lets receiving mail systems collapse a redelivered duplicate
+            form_data["h:Message-Id"] = f"<{idempotency_key}@{self.mailgun_domain}>"
+            form_data["v:idempotency_key"] = idempotency_key
+
+        # Send email via Mailgun
+        logger.info(f"Attempting to send email via Mailgun - Domain: {self.mailgun_domain}, Region: {self.mailgun_region}, To: {email_request.to_email}")
+        result = await self._post_message(form_data)
+        logger.info(f"Email sent successfully to {email_request.to_email}")
+        return {
+            "success": True,
+            "message": "Email sent successfully",
+            "email_id": result.get("id", "mailgun-sent")
+        }
+
+    async def _post_message(self, form_data: dict) -> dict:
+        """POST to the Mailgun messages API, raising EmailDeliveryError if it isn't accepted"""
+        client = http_clients.get("mailgun")
+        try:
+            # Sending is not idempotent: only retried when the request never reached Mailgun
+            response = await upstreams["mailgun"].call(
+                lambda: client.post(
+                    self.messages_url(),
                     auth=("api", self.mailgun_api_key),
-                    data=form_data,
-                    timeout=30.0
+                    data=form_data
                 )
+            )
+        except CircuitOpenError as e:
+            raise EmailDeliveryError(f"Mailgun request not sent: {e}", retryable=True)
+        except SAFE_TO_RETRY_ERRORS as e:
+            raise EmailDeliveryError(f"Mailgun request not sent: {type(e).__name__}: {e}", retryable=True)
+        except httpx.HTTPError as e:
+            # The request may have reached Mailgun (e.g. a read timeout): the outcome is unknown
+            raise EmailDeliveryError(f"Mailgun outcome unknown: {type(e).__name__}: {e}", retryable=False)
 
-                if response.is_success:
-                    result = response.json()
-                    logger.info(f"Email sent successfully to {email_request.to_email}")
-                    return {
-                        "success": True,
-                        "message": "Email sent successfully",
-                        "email_id": result.get("id", "mailgun-sent")
-                    }
-                else:
-                    error_text = response.text
-                    logger.error(f"Mailgun API error: {response.status_code} - {error_text}")
-                    
-                    # If it's an auth error, fall back to simulation
-                    if response.status_code == 401:
-                        logger.warning(f"Mailgun authentication failed - falling back to simulation for {email_request.to_email}")
-                        return {
-                            "success": True,
-                            "message": "Email simulated - Mailgun authentication failed",
-                            "email_id": "simulated-auth-error"
-                        }
-                    
-                    raise Exception(f"Failed to send email: {error_text}")
-
-        except Exception as e:
-            logger.error(f"Error sending email: {str(e)}")
-            
-            # Fall back to simulation mode on any error
-            logger.warning(f"Email sending failed - falling back to simulation for {email_request.to_email}")
+        if not response.is_success:
+            logger.error(f"Mailgun API error: {response.status_code} - {response.text}")
+            raise EmailDeliveryError(
+                f"Mailgun API error: {response.status_code} - {response.text[:500]}",
+                retryable=response.status_code in MAILGUN_RETRYABLE_STATUS_CODES,
+                status_code=response.status_code
+            )
+        return response.json()
+
+    async def send_batch(
+        self,
+        recipients: List[BatchRecipient],
+        subject: str,
+        html_content: str,
+        from_email: Optional[str] = None,
+        from_name: Optional[str] = None,
+        tag: Optional[str] = None
+    ) -> dict:
+        """Send one personalized message per recipient in a single Mailgun request"""
+        if not recipients:
+            raise ValueError("At least one recipient is required")
+        if len(recipients) > MAILGUN_MAX_BATCH_RECIPIENTS:
+            raise ValueError(f"Mailgun accepts at most {MAILGUN_MAX_BATCH_RECIPIENTS} recipients per request")
+
+        if not self.configured:
+            logger.warning(f"Mailgun not configured - simulating batch send to {len(recipients)} recipients")
             return {
                 "success": True,
-                "message": "Email simulated - sending failed",
-                "email_id": "simulated-error"
+                "message": "Batch simulated - Mailgun not configured",
+                "email_id": "simulated"
             }
 
+        form_data = {
+            "from": f"{from_name or self.mailgun_from_name} <{from_email or self.mailgun_from_email}>",
+            "to": [r.email for r in recipients],
+            "subject": subject,
+            "html": html_content,
+            # Also makes Mailgun send each recipient a separate message, so addresses aren't shared
+            "recipient-variables": json.dumps({r.email: r.variables for r in recipients})
+        }
+        if tag:
+            form_data["o:tag"] = tag
+
+        result = await self._post_message(form_data)
+        return {
+            "success": True,
+            "message": f"Batch of {len(recipients)} accepted",
+            "email_id": result.get("id", "mailgun-sent")
+        }
+
+    async def send_campaign(
+        self,
+        recipients: AsyncIterable[BatchRecipient],
+        subject: str,
+        html_content: str,
+        batch_size: int = EMAIL_BATCH_SIZE,
+        from_email: Optional[str] = None,
+        from_name: Optional[str] = None,
+        tag: Optional[str] = None
+    ) -> CampaignReport:
+        """Send to a stream of recipients in Mailgun-sized batches, reporting each batch.
+
+        Recipients must arrive ordered by campaign_address: a repeated address is only dropped
+        when it directly follows itself, which keeps memory flat however large the campaign.
+        """
+        batch_size = max(1, min(batch_size, MAILGUN_MAX_BATCH_RECIPIENTS))
+        report = CampaignReport()
+        started = time.monotonic()
+        previous = None
+        batch: List[BatchRecipient] = []
+
+        async def flush():
+            result = await self._send_campaign_batch(
+                len(report.batches) + 1, batch, subject, html_content, from_email, from_name, tag
+            )
+            report.batches.append(result)
+            if result.error:
+                report.failed += result.recipients
+                report.failures.extend({"email": r.email, "error": result.error} for r in batch)
+            else:
+                report.sent += result.recipients
+
+        async for recipient in recipients:
+            address = campaign_address(recipient.email)
+            if "@" not in address:
+                report.failed += 1
+                report.failures.append({"email": recipient.email, "error": "Invalid email address"})
+                continue
+            # recipient-variables are keyed by address, so each address may appear once
+            if address == previous:
+                continue
+            previous = address
+            batch.append(recipient)
+            if len(batch) >= batch_size:
+                await flush()
+                batch = []
+        if batch:
+            await flush()
+
+        report.seconds = round(time.monotonic() - started, 3)
+        logger.info(
+            f"Campaign {tag or subject!r}: {report.sent} sent, {report.failed} failed "
+            f"in {len(report.batches)} batches over {report.seconds:.1f}s"
+        )
+        return report
+
+    async def _send_campaign_batch(
+        self,
+        number: int,
+        recipients: List[BatchRecipient],
+        subject: str,
+        html_content: str,
+        from_email: Optional[str],
+        from_name: Optional[str],
+        tag: Optional[str]
+    ) -> BatchResult:
+        started = time.monotonic()
+        attempt = 1
+        while True:
+            try:
+                result = await self.send_batch(recipients, subject, html_content, from_email, from_name, tag)
+                email_id, error = result.get("email_id"), None
+            except EmailDeliveryError as e:
+                if e.retryable and attempt < EMAIL_BATCH_MAX_ATTEMPTS:
+                    logger.warning(f"Batch {number} attempt {attempt} failed, retrying: {str(e)}")
+                    # Full jitter, as for other upstream retries
+                    await asyncio.sleep(random.uniform(0, min(30.0, 2.0 * (2 ** (attempt - 1)))))
+                    attempt += 1
+                    continue
+                email_id, error = None, str(e)
+            break
+
+        seconds = time.monotonic() - started
+        rate = len(recipients) / seconds if seconds > 0 else 0.0
+        logger.info(
+            f"Batch {number}: {len(recipients)} recipients {'failed' if error else 'accepted'} "
+            f"after {attempt} attempt(s) in {seconds:.2f}s ({rate:.0f} recipients/s)"
+        )
+        return BatchResult(
+            batch=number,
+            recipients=len(recipients),
+            attempts=attempt,
+            seconds=round(seconds, 3),
+            recipients_per_second=round(rate, 1),
+            email_id=email_id,
+            error=error
+        )
+
     def create_claim_statement_email(self, name: str, claim_statement: str) -> str:
         """Create HTML content for claim statement email"""
         return f"""
@@ -349,5 +547,63 @@ class EmailService:
         </html>
         """
 
+    def create_payment_reminder_email(self, app_url: str) -> str:
+        """Create HTML content for the unpaid-profile reminder (batch send; uses %recipient.first_name%)"""
+        return f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+          <meta charset="utf-8">
+          <title>🇺🇸 Finish Your VA Disability Claim</title>
+          <style>
+            body {{ 
+              font-family: Arial, sans-serif; 
+              line-height: 1.6; 
+              color: #333; 
+              max-width: 800px; 
+              margin: 0 auto; 
+              padding: 20px;
+            }}
+            .header {{ 
+              background: linear-gradient(135deg, #1e3a8a, #dc2626); 
+              color: white; 
+              padding: 30px; 
+              text-align: center; 
+              border-radius: 10px;
+            }}
+            .content {{ 
+              background: #f8fafc; 
+              padding: 30px; 
+              border-radius: 10px; 
+              margin: 20px 0;
+            }}
+            .footer {{ 
+              text-align: center; 
+              padding: 20px; 
+              color: #666; 
+            }}
+          </style>
+        </head>
+        <body>
+          <div class="header">
+            <h1>🇺🇸 Vets4Claims Assistant</h1>
+            <p>Your Claim Is Waiting</p>
+          </div>
+          
+          <div class="content">
+            <h2>Dear %recipient.first_name%,</h2>
+            
+            <p>You've started your VA disability claim statement with Vets4Claims, but haven't finished yet.</p>
+            <p>Pick up where you left off: <a href="{app_url}" target="_blank">{app_url}</a></p>
+          </div>
+          
+          <div class="footer">
+            <p>This email was sent by Vets4Claims Assistant</p>
+            <p>If you have already completed your claim, please ignore this email.</p>
+          </div>
+        </body>
+        </html>
+        """
+
 # Create a global instance
 email_service = EmailService()
\ No newline at end of file
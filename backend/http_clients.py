@@ -0,0 +1,166 @@
+import os
+import importlib.util
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional
+from dotenv import load_dotenv
+import httpx
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 needs the optional h2 package (installed via httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+@dataclass
+class UpstreamConfig:
+    """Connection pool and timeout settings for one upstream API"""
+    name: str
+    base_url: str = ""
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    write_timeout: float = 10.0
+    pool_timeout: float = 5.0
+    http2: bool = True
+
+    @classmethod
+    def from_env(cls, name: str, **defaults) -> "UpstreamConfig":
+        """Build a config whose defaults can be overridden with <NAME>_HTTP_* env vars"""
+        prefix = f"{name.upper()}_HTTP_"
+        config = cls(name=name, **defaults)
+        for field_name, caster in (
+            ("max_connections", int),
+            ("max_keepalive_connections", int),
+            ("keepalive_expiry", float),
+            ("connect_timeout", float),
+            ("read_timeout", float),
+            ("write_timeout", float),
+            ("pool_timeout", float),
+        ):
+            value = os.getenv(prefix + field_name.upper())
+            if value:
+                setattr(config, field_name, caster(value))
+        http2 = os.getenv(prefix + "HTTP2")
+        if http2:
+            config.http2 = http2.lower() in ("1", "true", "yes")
+        return config
+
+class _PoolCounters:
+    """Request and connection counters used to compute the reuse ratio"""
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+
+class HTTPClientRegistry:
+    """App-lifetime registry of pooled httpx clients, one per upstream"""
+
+    def __init__(self):
+        self._configs: Dict[str, UpstreamConfig] = {}
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._counters: Dict[str, _PoolCounters] = {}
+
+    def register(self, config: UpstreamConfig):
+        """Register an upstream; its client is created on start()"""
+        self._configs[config.name] = config
+        self._counters[config.name] = _PoolCounters()
+
+    async def start(self):
+        """Create one pooled client per registered upstream"""
+        for name, config in self._configs.items():
+            if name not in self._clients:
+                self._clients[name] = self._build_client(config)
+        logger.info(f"HTTP client pools started: {', '.join(self._clients)} (http2={'on' if HTTP2_AVAILABLE else 'unavailable'})")
+
+    async def close(self):
+        """Close every pooled client and release its connections"""
+        for name, client in list(self._clients.items()):
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"Error closing HTTP client for {name}: {str(e)}")
+        self._clients.clear()
+        logger.info("HTTP client pools closed")
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """Return the pooled client for an upstream, creating it lazily outside the app lifecycle"""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            if name not in self._configs:
+                raise KeyError(f"Unknown upstream: {name}")
+            client = self._build_client(self._configs[name])
+            self._clients[name] = client
+        return client
+
+    def _build_client(self, config: UpstreamConfig) -> httpx.AsyncClient:
+        counters = self._counters[config.name]
+
+        async def trace(event_name: str, info: dict):
+            if event_name == "connection.connect_tcp.complete":
+                counters.new_connections += 1
+
+        async def on_request(request: httpx.Request):
+            counters.requests += 1
+            request.extensions["trace"] = trace
+
+        return httpx.AsyncClient(
+            base_url=config.base_url,
+            http2=config.http2 and HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(
+                connect=config.connect_timeout,
+                read=config.read_timeout,
+                write=config.write_timeout,
+                pool=config.pool_timeout,
+            ),
+            event_hooks={"request": [on_request]},
+        )
+
+    def stats(self) -> dict:
+        """Per-upstream pool statistics: open/idle connections, waiters and reuse ratio"""
+        result = {}
+        for name, config in self._configs.items():
+            counters = self._counters[name]
+            client = self._clients.get(name)
+            open_connections = idle_connections = waiters = 0
+            if client is not None and not client.is_closed:
+                pool = getattr(client._transport, "_pool", None)
+                for connection in getattr(pool, "connections", []):
+                    open_connections += 1
+                    if connection.is_idle():
+                        idle_connections += 1
+                waiters = sum(1 for r in getattr(pool, "_requests", []) if getattr(r, "connection", None) is None)
+
+            reuse_ratio: Optional[float] = None
+            if counters.requests:
+                reuse_ratio = round(max(0.0, 1 - counters.new_connections / counters.requests), 4)
+
+            result[name] = {
+                "open_connections": open_connections,
+                "idle_connections": idle_connections,
+                "waiters": waiters,
+                "max_connections": config.max_connections,
+                "requests": counters.requests,
+                "new_connections": counters.new_connections,
+                "reuse_ratio": reuse_ratio,
+                "http2": config.http2 and HTTP2_AVAILABLE,
+            }
+        return result
+
+# Create a global instance
+http_clients = HTTPClientRegistry()
+
+SUPABASE_BASE_URL = os.getenv("SUPABASE_URL", "").replace("/rest/v1", "")
+
+http_clients.register(UpstreamConfig.from_env("bastion", base_url="https://api.bastiongpt.com", read_timeout=30.0))
+http_clients.register(UpstreamConfig.from_env("supabase", base_url=SUPABASE_BASE_URL, read_timeout=10.0))
+http_clients.register(UpstreamConfig.from_env("docuseal", base_url="https://api.docuseal.com", read_timeout=30.0))
+http_clients.register(UpstreamConfig.from_env("mailgun", read_timeout=30.0))
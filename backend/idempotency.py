@@ -0,0 +1,48 @@
+import os
+import logging
+from typing import Any, Optional, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+
+PURGE_SQL = text("DELETE FROM idempotency_keys WHERE created_at < now() - make_interval(secs => :ttl)")
+
+# Inserts the key, or takes over one that has expired; returns nothing while a live row exists.
+# A concurrent holder's uncommitted row blocks this until that transaction ends.
+CLAIM_SQL = text("""
+INSERT INTO idempotency_keys (key, fingerprint) VALUES (:key, :fingerprint)
+ON CONFLICT (key) DO UPDATE
+    SET fingerprint = EXCLUDED.fingerprint, response = NULL, created_at = now()
+    WHERE idempotency_keys.created_at < now() - make_interval(secs => :ttl)
+RETURNING key
+""")
+
+STORED_SQL = text("SELECT fingerprint, response FROM idempotency_keys WHERE key = :key")
+
+SAVE_SQL = text("UPDATE idempotency_keys SET response = :response WHERE key = :key").bindparams(
+    bindparam("response", type_=JSONB)
+)
+
+async def claim(db: AsyncSession, key: str, fingerprint: str, ttl: float = IDEMPOTENCY_TTL_SECONDS) -> Optional[Tuple[str, Any]]:
+    """Reserve an idempotency key in the caller's transaction.
+
+    Returns None when the key is now held by this transaction: do the work, save() the response
+    and commit all of it together (a rollback releases the key). Otherwise returns the stored
+    (fingerprint, response) of the request that already used the key.
+    """
+    await db.execute(PURGE_SQL, {"ttl": ttl})
+    if (await db.execute(CLAIM_SQL, {"key": key, "fingerprint": fingerprint, "ttl": ttl})).first():
+        return None
+    return tuple((await db.execute(STORED_SQL, {"key": key})).one())
+
+async def save(db: AsyncSession, key: str, response: Any):
+    """Record the response for a claimed key; the caller commits"""
+    await db.execute(SAVE_SQL, {"key": key, "response": response})
@@ -1,25 +1,46 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from fastapi import Request, Response
 from pydantic import BaseModel, EmailStr
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer_group
 from sqlalchemy.exc import IntegrityError
 import httpx
 import os
+import asyncio
 import logging
 import time
 import math
 import hmac
 import hashlib
-from typing import Optional, Dict, Any
+import json
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, List
 from dotenv import load_dotenv
 
 # Import our modules
-from database import get_db, create_tables
-from models import VeteranProfile
+from database import get_async_db, get_read_db, pool_stats, check_schema, dispose_engines, asyncpg_dsn
+from models import VeteranProfile, DETAILS_GROUP
+from profile_store import upsert_profile, profile_etag, last_modified, etag_matches, expected_version, current_version, update_status_flags, batch_update_status, find_profiles_by_ssn_index
+from profile_cache import profile_cache, CachedProfile
+from bulk_import import import_profiles
+from bulk_export import export_profiles, resolve_columns
 from utils.encryption import encryption_service
 from email_service import email_service, EmailRequest
+from email_outbox import email_outbox
+import idempotency
 from drive_helpers import create_client_shared_drive
+from http_clients import http_clients
+from metrics import metrics
+from chat_compaction import ConversationCompactor, CompactionResult
+from utils.cache import TTLCache, SingleFlight
+from admission import bastion_admission, AdmissionRejected
+from resilience import upstreams, upstream_health, CircuitOpenError, CircuitBreaker
+from sql_instrumentation import begin_request, finish_request
+from auth import authenticate, get_current_user_id, require_service_role, jwt_verifier
 
 # Load environment variables
 load_dotenv()
@@ -37,12 +58,22 @@ DOCUSEAL_API_KEY = os.getenv("DOCUSEAL_API_KEY")
 DOCUSEAL_TEMPLATE_ID = os.getenv("DOCUSEAL_TEMPLATE_ID")
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
+CHAT_CACHE_TTL_SECONDS = float(os.getenv("CHAT_CACHE_TTL_SECONDS", "300"))
+CHAT_CACHE_MAX_BYTES = int(os.getenv("CHAT_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+CHAT_CACHE_MAX_TEMPERATURE = float(os.getenv("CHAT_CACHE_MAX_TEMPERATURE", "0.2"))
+CHAT_CACHEABLE_FUNCTIONS = {f.strip() for f in os.getenv("CHAT_CACHEABLE_FUNCTIONS", "").split(",") if f.strip()}
+STATUS_BATCH_MAX_UPDATES = int(os.getenv("STATUS_BATCH_MAX_UPDATES", "5000"))
 
 # Initialize Stripe
 if STRIPE_SECRET_KEY:
     stripe.api_key = STRIPE_SECRET_KEY
 
-app = FastAPI(title="Vets4Claims Backend API", version="1.0.0")
+# Every request has its bearer token (if any) verified locally
+app = FastAPI(
+    title="Vets4Claims Backend API",
+    version="1.0.0",
+    dependencies=[Depends(authenticate)]
+)
 
 # CORS middleware
 app.add_middleware(
@@ -51,13 +82,39 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
-# Create database tables on startup
+# Attribute SQL issued while handling a request to its route
+@app.middleware("http")
+async def sql_timing_middleware(request: Request, call_next):
+    stats = begin_request()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    finish_request(stats, route.path if route is not None else "unmatched")
+    if stats.queries:
+        response.headers.append("Server-Timing", stats.server_timing())
+    return response
+
+# Verify the schema version (migrations are applied with alembic) on startup
 @app.on_event("startup")
 async def startup_event():
-    create_tables()
-    logger.info("Database tables created/verified")
+    await check_schema()
+    kdf_seconds = await asyncio.to_thread(encryption_service.warm_up)
+    metrics.observe("startup.encryption_kdf", kdf_seconds)
+    await http_clients.start()
+    await jwt_verifier.start()
+    await profile_cache.start(asyncpg_dsn())
+    await email_outbox.start()
+
+# Release pooled upstream connections on shutdown
+@app.on_event("shutdown")
+async def shutdown_event():
+    await email_outbox.close()
+    await jwt_verifier.close()
+    await profile_cache.close()
+    await http_clients.close()
+    await dispose_engines()
 
 # Pydantic models
 class Message(BaseModel):
@@ -142,6 +199,12 @@ class UpdateStatusRequest(BaseModel):
     has_signed_up: Optional[bool] = None
     has_paid: Optional[bool] = None
 
+class SSNLookupRequest(BaseModel):
+    ssn: str
+
+class BatchStatusUpdateRequest(BaseModel):
+    updates: List[UpdateStatusRequest]
+
 # Utility functions for dev auth
 def generate_time_based_password() -> str:
     """Generate password based on current 10-minute window"""
@@ -155,40 +218,266 @@ def is_password_valid(password: str) -> bool:
     current_password = generate_time_based_password()
     return current_password == password
 
+# Conversation compaction for BastionGPT requests
+SUMMARY_PROMPT = (
+    "Summarize the following part of a conversation between a veteran and a VA claims assistant. "
+    "Preserve every fact the veteran provided (names, dates, service history, conditions, symptoms, "
+    "treatment, impact) and any open questions. Be concise and factual."
+)
+SUMMARY_ADMISSION_KEY = "chat.summaries"
+SUMMARY_MAX_WAIT_SECONDS = float(os.getenv("CHAT_SUMMARY_MAX_WAIT_SECONDS", "2"))
+
+async def summarize_with_bastion(previous_summary: Optional[str], messages: list[dict]) -> str:
+    """Fold older conversation turns into the running summary using BastionGPT"""
+    if not BASTION_API_KEY:
+        raise RuntimeError("BastionGPT API key not configured")
+    
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    if previous_summary:
+        transcript = f"Existing summary:\n{previous_summary}\n\nNew turns:\n{transcript}"
+    
+    payload = {
+        "messages": [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript}
+        ],
+        "max_tokens": 300,
+        "temperature": 0,
+        "function": "veterans_claims_assistant"
+    }
+    
+    client = http_clients.get("bastion")
+    # Summaries share the BastionGPT breaker and admission limit. When either refuses, the
+    # compactor falls back to an extractive summary rather than holding up the chat request.
+    async with bastion_admission.slot(SUMMARY_ADMISSION_KEY, max_wait=SUMMARY_MAX_WAIT_SECONDS):
+        response = await upstreams["bastion"].call(
+            lambda: client.post(BASTION_URL, json=payload, headers={"Content-Type": "application/json", "key": BASTION_API_KEY}),
+            idempotent=True
+        )
+        response.raise_for_status()
+    return response.json()["choices"][0]["message"]["content"]
+
+conversation_compactor = ConversationCompactor(summarize_with_bastion)
+
+async def build_bastion_payload(chat_request: ChatRequest) -> tuple[dict, CompactionResult]:
+    """Build the upstream payload, compacting the history to fit the token budget"""
+    compaction = await conversation_compactor.compact([msg.dict() for msg in chat_request.messages])
+    if compaction.tokens_saved:
+        metrics.incr("chat.compaction.requests_compacted")
+        metrics.incr("chat.compaction.tokens_saved", compaction.tokens_saved)
+        logger.info(f"Compacted chat history: {compaction.original_tokens} -> {compaction.compacted_tokens} tokens")
+    
+    payload = {
+        "messages": compaction.messages,
+        "max_tokens": chat_request.max_tokens,
+        "temperature": chat_request.temperature,
+        "function": chat_request.function
+    }
+    return payload, compaction
+
+# Conditional request helpers for veteran profiles
+def version_headers(etag: str, modified: Optional[str]) -> Dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if modified:
+        headers["Last-Modified"] = modified
+    return headers
+
+def is_not_modified(request: Request, etag: str, updated_at) -> bool:
+    """Evaluate If-None-Match (preferred) or If-Modified-Since against a profile version"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and updated_at is not None:
+        try:
+            return updated_at.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+# Opt-in response fields; by default profiles carry only the masked SSN (no decryption)
+SELECTABLE_FIELDS = {"ssn"}
+
+def requested_fields(fields: Optional[str]) -> set:
+    selected = {f.strip() for f in (fields or "").split(",") if f.strip()}
+    unknown = selected - SELECTABLE_FIELDS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return selected
+
+def with_full_ssn(response_data: Dict[str, Any], profile: VeteranProfile) -> Dict[str, Any]:
+    """Add the decrypted SSN to a profile response (only when fields=ssn was requested)"""
+    response_data["ssn"] = None
+    if profile.ssn_encrypted:
+        try:
+            response_data["ssn"] = encryption_service.decrypt_ssn(profile.ssn_encrypted, profile.id)
+            metrics.incr("profiles.ssn_decrypted")
+        except Exception as e:
+            logger.error(f"Error decrypting SSN: {str(e)}")
+    return response_data
+
+def precondition_failed() -> HTTPException:
+    return HTTPException(status_code=412, detail="Profile was modified by another request; reload and try again")
+
+async def apply_status_update(
+    db: AsyncSession,
+    response: Response,
+    email: str,
+    flags: Dict[str, bool],
+    if_match: Optional[str],
+    compact: bool
+) -> Dict[str, Any]:
+    """Write status flags with a single UPDATE ... RETURNING and return the profile payload"""
+    updated = await update_status_flags(db, email, flags, expected_version(if_match), full=not compact)
+    if updated is None:
+        await db.rollback()
+        if if_match and await current_version(db, email) is not None:
+            raise precondition_failed()
+        raise HTTPException(status_code=404, detail="Veteran profile not found")
+    await db.commit()
+    
+    if compact:
+        payload = {key: str(value) if key == "id" else value for key, value in updated.items()}
+        payload["updated_at"] = updated["updated_at"].isoformat() if updated["updated_at"] else None
+        updated_at = updated["updated_at"]
+    else:
+        payload = updated.to_dict()
+        updated_at = updated.updated_at
+    
+    if flags:
+        profile_cache.invalidate(email)
+    response.headers.update(version_headers(profile_etag(updated_at), last_modified(updated_at)))
+    for key, value in flags.items():
+        logger.info(f"Updated {key} to {value} for {email}")
+    return payload
+
 # API Endpoints
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "vets4claims-backend"}
+    upstream_states = upstream_health()
+    degraded = any(u["state"] != CircuitBreaker.CLOSED for u in upstream_states.values())
+    return {
+        "status": "degraded" if degraded else "healthy",
+        "service": "vets4claims-backend",
+        "upstreams": upstream_states
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Runtime metrics for upstream and database pools, chat caching and request latencies"""
+    return {
+        "http_clients": http_clients.stats(),
+        "database": pool_stats(),
+        "chat_compaction": conversation_compactor.stats(),
+        "chat_cache": chat_response_cache.stats(),
+        "chat_singleflight": chat_singleflight.stats(),
+        "auth": jwt_verifier.stats(),
+        "profile_cache": profile_cache.stats(),
+        "email_outbox": email_outbox.stats(),
+        "bastion_admission": bastion_admission.stats(),
+        **metrics.snapshot()
+    }
+
+def chat_request_key(chat_request: ChatRequest) -> str:
+    """Stable hash of a normalized chat request, used for coalescing and caching"""
+    normalized = {
+        "messages": [{"role": m.role, "content": m.content.strip()} for m in chat_request.messages],
+        "max_tokens": chat_request.max_tokens,
+        "temperature": round(chat_request.temperature, 3),
+        "function": chat_request.function
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+def is_chat_cacheable(chat_request: ChatRequest) -> bool:
+    """Only near-deterministic completions are safe to serve from cache"""
+    if CHAT_CACHE_MAX_BYTES <= 0:
+        return False
+    return chat_request.temperature <= CHAT_CACHE_MAX_TEMPERATURE or chat_request.function in CHAT_CACHEABLE_FUNCTIONS
+
+chat_response_cache = TTLCache(max_entries=4096, ttl=CHAT_CACHE_TTL_SECONDS, max_bytes=CHAT_CACHE_MAX_BYTES)
+chat_singleflight = SingleFlight()
+
+
+def admission_key(request: Request) -> str:
+    """Fair-queuing key: the caller's Supabase user id, falling back to client IP"""
+    user_id = get_current_user_id(request)
+    if user_id:
+        return "user:" + user_id
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+def upstream_unavailable(e: CircuitOpenError) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=str(e),
+        headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+    )
+
+def admission_rejected(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=f"BastionGPT is busy: {e.reason}",
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+async def call_bastion(chat_request: ChatRequest, user_key: str) -> tuple[dict, int]:
+    """Send one chat completion to BastionGPT, returning the response and tokens saved by compaction"""
+    payload, compaction = await build_bastion_payload(chat_request)
+    
+    headers = {
+        "Content-Type": "application/json",
+        "key": BASTION_API_KEY
+    }
+    
+    client = http_clients.get("bastion")
+    async with bastion_admission.slot(user_key):
+        # Completions have no side effects, so transient failures may be retried
+        upstream = await upstreams["bastion"].call(
+            lambda: client.post(BASTION_URL, json=payload, headers=headers),
+            idempotent=True
+        )
+        
+        # Raised inside the slot so upstream errors shrink the adaptive limit
+        if not upstream.is_success:
+            logger.error(f"BastionGPT API error: {upstream.status_code} - {upstream.text}")
+            raise HTTPException(status_code=upstream.status_code, detail=f"BastionGPT API error: {upstream.text}")
+    
+    return upstream.json(), compaction.tokens_saved
 
 @app.post("/chat")
-async def chat_with_bastion(request: ChatRequest):
+async def chat_with_bastion(request: ChatRequest, http_request: Request, response: Response):
     """Proxy requests to BastionGPT API"""
     try:
         if not BASTION_API_KEY:
             raise HTTPException(status_code=500, detail="BastionGPT API key not configured")
         
-        payload = {
-            "messages": [msg.dict() for msg in request.messages],
-            "max_tokens": request.max_tokens,
-            "temperature": request.temperature,
-            "function": request.function
-        }
+        key = chat_request_key(request)
+        cacheable = is_chat_cacheable(request)
         
-        headers = {
-            "Content-Type": "application/json",
-            "key": BASTION_API_KEY
-        }
+        if cacheable:
+            cached = chat_response_cache.get(key)
+            if cached is not None:
+                response.headers["X-Cache"] = "HIT"
+                return json.loads(cached)
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(BASTION_URL, json=payload, headers=headers, timeout=30.0)
-            
-            if not response.is_success:
-                logger.error(f"BastionGPT API error: {response.status_code} - {response.text}")
-                raise HTTPException(status_code=response.status_code, detail=f"BastionGPT API error: {response.text}")
-            
-            return response.json()
+        # Identical concurrent requests share a single upstream call
+        user_key = admission_key(http_request)
+        result, tokens_saved = await chat_singleflight.do(key, lambda: call_bastion(request, user_key))
+        response.headers["X-Chat-Tokens-Saved"] = str(tokens_saved)
+        
+        if cacheable:
+            serialized = json.dumps(result)
+            chat_response_cache.set(key, serialized, size=len(serialized))
+            response.headers["X-Cache"] = "MISS"
+        
+        return result
             
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise admission_rejected(e)
+    except CircuitOpenError as e:
+        raise upstream_unavailable(e)
     except httpx.TimeoutException:
         logger.error("BastionGPT API timeout")
         raise HTTPException(status_code=504, detail="BastionGPT API timeout")
@@ -196,46 +485,140 @@ async def chat_with_bastion(request: ChatRequest):
         logger.error(f"Error calling BastionGPT API: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to process chat request: {str(e)}")
 
+@app.post("/chat/stream")
+async def chat_with_bastion_stream(chat_request: ChatRequest, request: Request):
+    """Proxy requests to BastionGPT API, relaying the completion as server-sent events"""
+    if not BASTION_API_KEY:
+        raise HTTPException(status_code=500, detail="BastionGPT API key not configured")
+    
+    payload, compaction = await build_bastion_payload(chat_request)
+    payload["stream"] = True
+    
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream",
+        "key": BASTION_API_KEY
+    }
+    
+    try:
+        await bastion_admission.acquire(admission_key(request))
+    except AdmissionRejected as e:
+        raise admission_rejected(e)
+    
+    started = time.perf_counter()
+    client = http_clients.get("bastion")
+    try:
+        upstream = await upstreams["bastion"].call(
+            lambda: client.send(
+                client.build_request("POST", BASTION_URL, json=payload, headers=headers),
+                stream=True
+            )
+        )
+    except CircuitOpenError as e:
+        bastion_admission.release(None, success=False)
+        raise upstream_unavailable(e)
+    except httpx.TimeoutException:
+        bastion_admission.release(time.perf_counter() - started, success=False)
+        logger.error("BastionGPT API timeout")
+        metrics.incr("chat_stream.upstream_errors")
+        raise HTTPException(status_code=504, detail="BastionGPT API timeout")
+    except Exception as e:
+        bastion_admission.release(time.perf_counter() - started, success=False)
+        logger.error(f"Error calling BastionGPT API: {str(e)}")
+        metrics.incr("chat_stream.upstream_errors")
+        raise HTTPException(status_code=500, detail=f"Failed to process chat request: {str(e)}")
+    
+    # Time to response headers is the latency signal for adaptive concurrency
+    header_latency = time.perf_counter() - started
+    slot_released = False
+    
+    def release_slot(success: bool):
+        nonlocal slot_released
+        if not slot_released:
+            slot_released = True
+            bastion_admission.release(header_latency, success=success)
+    
+    if not upstream.is_success:
+        error_text = (await upstream.aread()).decode(errors="replace")
+        await upstream.aclose()
+        release_slot(success=False)
+        logger.error(f"BastionGPT API error: {upstream.status_code} - {error_text}")
+        metrics.incr("chat_stream.upstream_errors")
+        raise HTTPException(status_code=upstream.status_code, detail=f"BastionGPT API error: {error_text}")
+    
+    # Pass SSE through untouched; wrap any other body as one event per chunk
+    passthrough = upstream.headers.get("content-type", "").startswith("text/event-stream")
+    
+    async def relay():
+        first_chunk = True
+        completed = False
+        failed = False
+        # Non-SSE bodies are re-framed per line; aiter_lines decodes incrementally, so lines and
+        # multibyte characters split across network chunks arrive whole
+        chunks = upstream.aiter_bytes() if passthrough else upstream.aiter_lines()
+        try:
+            async for chunk in chunks:
+                if await request.is_disconnected():
+                    logger.info("Chat stream client disconnected - closing upstream request")
+                    metrics.incr("chat_stream.client_disconnects")
+                    break
+                if first_chunk:
+                    metrics.observe("chat_stream.ttfb", time.perf_counter() - started)
+                    first_chunk = False
+                if passthrough:
+                    yield chunk
+                else:
+                    yield f"data: {chunk}\n\n".encode()
+            else:
+                completed = True
+                if not passthrough:
+                    yield b"data: [DONE]\n\n"
+        except httpx.TimeoutException:
+            failed = True
+            logger.error("BastionGPT API timeout while streaming")
+            metrics.incr("chat_stream.upstream_errors")
+            yield b"event: error\ndata: BastionGPT API timeout\n\n"
+        except httpx.HTTPError as e:
+            failed = True
+            logger.error(f"BastionGPT stream failed: {type(e).__name__}: {str(e)}")
+            metrics.incr("chat_stream.upstream_errors")
+            yield b"event: error\ndata: BastionGPT stream failed\n\n"
+        finally:
+            await upstream.aclose()
+            release_slot(success=not failed)
+            metrics.observe("chat_stream.duration", time.perf_counter() - started)
+            metrics.incr("chat_stream.completed" if completed else "chat_stream.aborted")
+    
+    async def cleanup():
+        # Runs even if the client went away before the stream started
+        await upstream.aclose()
+        release_slot(success=True)
+    
+    return StreamingResponse(
+        relay(),
+        media_type="text/event-stream",
+        background=BackgroundTask(cleanup),
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Chat-Tokens-Saved": str(compaction.tokens_saved)
+        }
+    )
+
 @app.post("/veteran-profiles")
 async def create_or_update_veteran_profile(
     profile_request: VeteranProfileRequest,
-    request: Request,
-    db: Session = Depends(get_db)
+    response: Response,
+    user_id: Optional[str] = Depends(get_current_user_id),
+    fields: Optional[str] = None,
+    if_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create or update a veteran profile with encrypted PHI"""
+    include = requested_fields(fields)
     try:
         logger.info(f"Creating/updating veteran profile for: {profile_request.email}")
         
-        # Get user ID from Supabase auth token
-        auth_header = request.headers.get("authorization")
-        user_id = None
-        
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.replace("Bearer ", "")
-            try:
-                # Verify token with Supabase
-                async with httpx.AsyncClient() as client:
-                    supabase_response = await client.get(
-                        f"{SUPABASE_EDGE_URL.replace('/functions/v1', '')}/auth/v1/user",
-                        headers={"Authorization": f"Bearer {token}"}
-                    )
-                    if supabase_response.is_success:
-                        user_data = supabase_response.json()
-                        user_id = user_data.get("id")
-                        logger.info(f"Authenticated user ID: {user_id}")
-            except Exception as e:
-                logger.warning(f"Could not verify auth token: {str(e)}")
-        
-        # Check if profile already exists
-        if user_id:
-            # If we have a user ID, look up by user ID first, then by email
-            existing_profile = db.query(VeteranProfile).filter(VeteranProfile.id == user_id).first()
-            if not existing_profile:
-                existing_profile = db.query(VeteranProfile).filter(VeteranProfile.email == profile_request.email).first()
-        else:
-            # Fallback to email lookup for unauthenticated requests
-            existing_profile = db.query(VeteranProfile).filter(VeteranProfile.email == profile_request.email).first()
-        
         # Prepare data for database
         profile_data = {
             "email": profile_request.email,
@@ -254,100 +637,162 @@ async def create_or_update_veteran_profile(
             "has_paid": profile_request.has_paid
         }
         
-        # Encrypt SSN if provided
+        # Validate SSN if provided; it is encrypted for the profile's row id during the upsert
         if profile_request.ssn:
             try:
-                encrypted_ssn = encryption_service.encrypt_ssn(profile_request.ssn)
-                profile_data["ssn_encrypted"] = encrypted_ssn
-            except Exception as e:
+                encryption_service.normalize_ssn(profile_request.ssn)
+            except ValueError as e:
                 logger.error(f"Error encrypting SSN: {str(e)}")
                 raise HTTPException(status_code=400, detail="Invalid SSN format")
         
-        if existing_profile:
-            # Update existing profile
-            # If we have a user_id and the existing profile doesn't have the right ID, update it
-            if user_id and str(existing_profile.id) != user_id:
-                logger.info(f"Updating existing profile ID from {existing_profile.id} to {user_id}")
-                existing_profile.id = user_id
-                # Also update has_signed_up to true since they now have an account
-                existing_profile.has_signed_up = True
-                logger.info(f"Updated profile ID to match auth user and marked as signed up: {user_id}")
-            
-            for key, value in profile_data.items():
-                # Skip updating the ID if we already set it above
-                if key == 'id' and user_id and str(existing_profile.id) == user_id:
-                    continue
-                setattr(existing_profile, key, value)
-            db.commit()
-            db.refresh(existing_profile)
-            result = existing_profile
-            logger.info(f"Updated veteran profile for: {profile_request.email}")
-        else:
-            # Create new profile
-            if user_id:
-                profile_data["id"] = user_id
-                logger.info(f"Creating new profile with auth user ID: {user_id}")
-            
-            new_profile = VeteranProfile(**profile_data)
-            db.add(new_profile)
-            db.commit()
-            db.refresh(new_profile)
-            result = new_profile
-            logger.info(f"Created new veteran profile for: {profile_request.email}")
-        
-        # Return profile data (without encrypted SSN)
-        response_data = result.to_dict()
+        result = await upsert_profile(db, profile_data, user_id, expected_version(if_match), ssn=profile_request.ssn or None)
+        if result is None:
+            await db.rollback()
+            raise precondition_failed()
+        await db.commit()
+        profile_cache.invalidate(result.email)
+        response.headers.update(version_headers(profile_etag(result.updated_at), last_modified(result.updated_at)))
+        logger.info(f"Saved veteran profile for: {profile_request.email}")
         
-        # Include decrypted SSN if it exists (for frontend use)
-        if result.ssn_encrypted:
-            try:
-                decrypted_ssn = encryption_service.decrypt_ssn(result.ssn_encrypted)
-                response_data["ssn"] = decrypted_ssn
-            except Exception as e:
-                logger.error(f"Error decrypting SSN for response: {str(e)}")
-                response_data["ssn"] = None
+        # Return profile data (masked SSN unless fields=ssn)
+        response_data = result.to_dict()
+        if "ssn" in include:
+            with_full_ssn(response_data, result)
         
         return {
             "success": True,
             "profile": response_data
         }
         
+    except HTTPException:
+        raise
     except IntegrityError as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Database integrity error: {str(e)}")
         raise HTTPException(status_code=400, detail="Profile with this email already exists")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error creating/updating veteran profile: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to save veteran profile: {str(e)}")
 
+@app.post("/veteran-profiles/import", dependencies=[Depends(require_service_role)])
+async def import_veteran_profiles(request: Request, format: Optional[str] = None):
+    """Bulk import veteran profiles from a streamed CSV or NDJSON request body"""
+    content_type = request.headers.get("content-type", "")
+    fmt = format or ("ndjson" if "ndjson" in content_type or "jsonl" in content_type else "csv")
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'csv' or 'ndjson'")
+    
+    try:
+        logger.info(f"Starting bulk profile import ({fmt})")
+        report = await import_profiles(request.stream(), fmt, VeteranProfileRequest)
+        profile_cache.invalidate_all()
+        logger.info(f"Bulk import finished: {report.imported} imported, {report.failed} failed")
+        return {"success": report.failed == 0, **report.to_dict()}
+        
+    except ValueError as e:
+        # Raised before any batch is loaded, e.g. for an unreadable CSV header
+        logger.error(f"Rejected veteran profile import: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error importing veteran profiles: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to import veteran profiles: {str(e)}")
+
+# POST so the SSN travels in the body rather than the URL (and access logs)
+@app.post("/veteran-profiles/lookup-by-ssn", dependencies=[Depends(require_service_role)])
+async def lookup_veteran_profiles_by_ssn(lookup: SSNLookupRequest, db: AsyncSession = Depends(get_async_db)):
+    """Find profiles with a given SSN through the blind index, without decrypting any rows"""
+    try:
+        blind_index = encryption_service.ssn_blind_index(lookup.ssn)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid SSN format")
+    
+    try:
+        matches = await find_profiles_by_ssn_index(db, blind_index)
+        logger.info(f"SSN lookup matched {len(matches)} profile(s)")
+        return {"matches": matches}
+        
+    except Exception as e:
+        logger.error(f"Error looking up profiles by SSN: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to look up profiles")
+
+# Registered before /veteran-profiles/{email} so "export" isn't treated as an email
+@app.get("/veteran-profiles/export", dependencies=[Depends(require_service_role)])
+async def export_veteran_profiles(format: str = "ndjson", columns: Optional[str] = None, include_ssn: bool = False):
+    """Stream veteran profiles as NDJSON or CSV for reporting"""
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    try:
+        selected = resolve_columns(columns)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    logger.info(f"Starting veteran profile export ({format}, columns={','.join(selected)}, include_ssn={include_ssn})")
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    return StreamingResponse(
+        export_profiles(format, selected, include_ssn),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="veteran_profiles.{format}"'}
+    )
+
 @app.get("/veteran-profiles/{email}")
-async def get_veteran_profile(email: str, db: Session = Depends(get_db)):
-    """Get veteran profile by email with decrypted PHI"""
+async def get_veteran_profile(
+    email: str,
+    request: Request,
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Get veteran profile by email; the full SSN is only decrypted when fields=ssn"""
+    include = requested_fields(fields)
     try:
         logger.info(f"Fetching veteran profile for: {email}")
         
-        profile = db.query(VeteranProfile).filter(VeteranProfile.email == email).first()
+        # Only the masked variant is cached, so decrypted SSNs never sit in memory
+        cached = profile_cache.get(email) if not include else None
+        if cached is not None:
+            headers = version_headers(cached.etag, cached.last_modified)
+            if is_not_modified(request, cached.etag, cached.updated_at):
+                return Response(status_code=304, headers=headers)
+            return Response(content=cached.body, media_type="application/json", headers=headers)
+        
+        generation = profile_cache.generation()
+        
+        # Revalidation only needs updated_at: answer 304 without loading, decrypting or serializing
+        if request.headers.get("if-none-match") or request.headers.get("if-modified-since"):
+            updated_at = await current_version(db, email)
+            if updated_at is None:
+                raise HTTPException(status_code=404, detail="Veteran profile not found")
+            etag = profile_etag(updated_at)
+            if is_not_modified(request, etag, updated_at):
+                metrics.incr("profiles.not_modified")
+                return Response(status_code=304, headers=version_headers(etag, last_modified(updated_at)))
+        
+        profile = await db.scalar(
+            select(VeteranProfile)
+            .where(VeteranProfile.email == email)
+            .options(undefer_group(DETAILS_GROUP))
+        )
         
         if not profile:
             raise HTTPException(status_code=404, detail="Veteran profile not found")
         
-        # Convert to dict
+        # Convert to dict (masked SSN unless fields=ssn)
         response_data = profile.to_dict()
+        if "ssn" in include:
+            with_full_ssn(response_data, profile)
         
-        # Include decrypted SSN if it exists
-        if profile.ssn_encrypted:
-            try:
-                decrypted_ssn = encryption_service.decrypt_ssn(profile.ssn_encrypted)
-                response_data["ssn"] = decrypted_ssn
-            except Exception as e:
-                logger.error(f"Error decrypting SSN: {str(e)}")
-                response_data["ssn"] = None
-        
-        return {
-            "success": True,
-            "profile": response_data
-        }
+        entry = CachedProfile(
+            body=json.dumps({
+                "success": True,
+                "profile": response_data
+            }).encode(),
+            etag=profile_etag(profile.updated_at),
+            last_modified=last_modified(profile.updated_at),
+            updated_at=profile.updated_at
+        )
+        if not include:
+            profile_cache.set(email, entry, generation)
+        return Response(content=entry.body, media_type="application/json", headers=version_headers(entry.etag, entry.last_modified))
         
     except HTTPException:
         raise
@@ -355,25 +800,43 @@ async def get_veteran_profile(email: str, db: Session = Depends(get_db)):
         logger.error(f"Error fetching veteran profile: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch veteran profile: {str(e)}")
 
-@app.post("/send-email")
-async def send_email(email_request: EmailRequest):
-    """Send email using Mailgun API"""
+def outbox_key(endpoint: str, recipient: str, idempotency_key: Optional[str]) -> Optional[str]:
+    """Scope a caller's Idempotency-Key to one endpoint and recipient, so keys can't collide across them"""
+    if not idempotency_key:
+        return None
+    return f"{endpoint}:{recipient.lower()}:{idempotency_key}"
+
+def queued_response(outbox_id, queued: bool) -> dict:
+    """Response for an enqueued email; email_id is the outbox id"""
+    return {
+        "success": True,
+        "message": "Email queued for delivery" if queued else "Email already queued",
+        "email_id": str(outbox_id),
+        "status": "queued"
+    }
+
+@app.post("/send-email", status_code=202)
+async def send_email(email_request: EmailRequest, idempotency_key: Optional[str] = Header(None)):
+    """Queue an email for delivery via Mailgun"""
     try:
-        logger.info(f"Sending email to: {email_request.to_email}")
+        logger.info(f"Queueing email to: {email_request.to_email}")
         
-        result = await email_service.send_email(email_request)
+        outbox_id, queued = await email_outbox.enqueue(
+            email_request,
+            idempotency_key=outbox_key("send-email", email_request.to_email, idempotency_key)
+        )
         
-        return result
+        return queued_response(outbox_id, queued)
         
     except Exception as e:
         logger.error(f"Error sending email: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to send email: {str(e)}")
 
-@app.post("/send-claim-email")
-async def send_claim_email(request: ClaimEmailRequest):
-    """Send claim statement email to veteran"""
+@app.post("/send-claim-email", status_code=202)
+async def send_claim_email(request: ClaimEmailRequest, idempotency_key: Optional[str] = Header(None)):
+    """Queue claim statement email to veteran"""
     try:
-        logger.info(f"Sending claim statement email to: {request.email}")
+        logger.info(f"Queueing claim statement email to: {request.email}")
         
         # Validate input data
         if not request.email or not request.name or not request.claim_statement:
@@ -388,20 +851,18 @@ async def send_claim_email(request: ClaimEmailRequest):
             html_content=html_content
         )
         
-        result = await email_service.send_email(email_request)
+        outbox_id, queued = await email_outbox.enqueue(
+            email_request,
+            idempotency_key=outbox_key("send-claim-email", request.email, idempotency_key)
+        )
         
-        logger.info(f"Email service result: {result}")
-        return result
+        logger.info(f"Claim statement email {outbox_id} queued for {request.email}")
+        return queued_response(outbox_id, queued)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error sending claim email: {str(e)}")
-        # Return a more user-friendly error but still indicate success for the simulation case
-        if "simulated" in str(e).lower() or "authentication failed" in str(e).lower():
-            return {
-                "success": True,
-                "message": "Email functionality is currently in development mode",
-                "email_id": "simulated"
-            }
         raise HTTPException(status_code=500, detail=f"Failed to send claim email: {str(e)}")
 
 @app.post("/dev-auth-email")
@@ -436,7 +897,8 @@ async def send_dev_auth_email(request: DevAuthRequest):
                 from_name="Vets4Claims Dev"
             )
             
-            result = await email_service.send_email(email_request)
+            # The code stops working when its 10-minute window ends, so don't retry past that
+            await email_outbox.enqueue(email_request, expires_in=10 * 60 - time.time() % (10 * 60))
             
             return {
                 "success": True,
@@ -469,7 +931,8 @@ async def create_intake(client: ClientRequest):
             html_content=html_content
         )
         
-        await email_service.send_email(email_request)
+        # One upload-link email per drive, even if the request is retried
+        await email_outbox.enqueue(email_request, idempotency_key=f"intake:{drive_data['drive_id']}")
         
         logger.info(f"Successfully created intake for {client.email}")
         return {
@@ -553,44 +1016,48 @@ async def create_docuseal_submission(request: DocuSealSubmissionRequest):
             }],
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
+        client = http_clients.get("docuseal")
+        # Creating a submission sends an email, so only retry if the request never went out
+        response = await upstreams["docuseal"].call(
+            lambda: client.post(
                 "https://api.docuseal.com/submissions",
                 headers={
                     "X-Auth-Token": DOCUSEAL_API_KEY,
                     "Content-Type": "application/json",
                     "Accept": "application/json",
                 },
-                json=payload,
-                timeout=30.0
+                json=payload
             )
+        )
 
-            if not response.is_success:
-                error_text = response.text
-                logger.error(f"DocuSeal API error: {response.status_code} - {error_text}")
-                raise HTTPException(status_code=response.status_code, detail=f"DocuSeal API error: {error_text}")
+        if not response.is_success:
+            error_text = response.text
+            logger.error(f"DocuSeal API error: {response.status_code} - {error_text}")
+            raise HTTPException(status_code=response.status_code, detail=f"DocuSeal API error: {error_text}")
 
-            # DocuSeal returns an ARRAY of submitters
-            submitters = response.json()
-            
-            if not isinstance(submitters, list) or len(submitters) == 0:
-                raise HTTPException(status_code=500, detail="No submitters returned from DocuSeal")
-            
-            # Get the first submitter (should be our veteran)
-            submitter = submitters[0]
+        # DocuSeal returns an ARRAY of submitters
+        submitters = response.json()
+        
+        if not isinstance(submitters, list) or len(submitters) == 0:
+            raise HTTPException(status_code=500, detail="No submitters returned from DocuSeal")
+        
+        # Get the first submitter (should be our veteran)
+        submitter = submitters[0]
 
-            logger.info(f"DocuSeal submission created successfully for: {request.FullEmail}")
-            
-            return {
-                "success": True,
-                "submissionSlug": submitter["slug"],
-                "claimId": submitter["submission_id"],
-                "submissionId": submitter["id"],
-                "embedSrc": submitter.get("embed_src", f"https://docuseal.com/s/{submitter['slug']}")
-            }
-            
+        logger.info(f"DocuSeal submission created successfully for: {request.FullEmail}")
+        
+        return {
+            "success": True,
+            "submissionSlug": submitter["slug"],
+            "claimId": submitter["submission_id"],
+            "submissionId": submitter["id"],
+            "embedSrc": submitter.get("embed_src", f"https://docuseal.com/s/{submitter['slug']}")
+        }
+        
     except HTTPException:
         raise
+    except CircuitOpenError as e:
+        raise upstream_unavailable(e)
     except Exception as e:
         logger.error(f"Error creating DocuSeal submission: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to create DocuSeal submission: {str(e)}")
@@ -599,79 +1066,116 @@ async def create_docuseal_submission(request: DocuSealSubmissionRequest):
 @app.post("/update-signup-status")
 async def update_signup_status(
     request: UpdateStatusRequest,
-    db: Session = Depends(get_db)
+    response: Response,
+    compact: bool = False,
+    if_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update has_signed_up status for veteran profile"""
     try:
         logger.info(f"Updating signup status for: {request.email}")
         
-        # Find the veteran profile by email
-        profile = db.query(VeteranProfile).filter(VeteranProfile.email == request.email).first()
-        
-        if not profile:
-            raise HTTPException(status_code=404, detail="Veteran profile not found")
-        
-        # Update the status fields
+        flags = {}
         if request.has_signed_up is not None:
-            profile.has_signed_up = request.has_signed_up
-            logger.info(f"Updated has_signed_up to {request.has_signed_up} for {request.email}")
-        
+            flags["has_signed_up"] = request.has_signed_up
         if request.has_paid is not None:
-            profile.has_paid = request.has_paid
-            logger.info(f"Updated has_paid to {request.has_paid} for {request.email}")
+            flags["has_paid"] = request.has_paid
         
-        db.commit()
-        db.refresh(profile)
+        profile = await apply_status_update(db, response, request.email, flags, if_match, compact)
         
         return {
             "success": True,
             "message": "Status updated successfully",
-            "profile": profile.to_dict()
+            "profile": profile
         }
         
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error updating signup status: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to update status: {str(e)}")
 
 @app.post("/update-payment-status")
 async def update_payment_status(
     request: UpdateStatusRequest,
-    db: Session = Depends(get_db)
+    response: Response,
+    compact: bool = False,
+    if_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update has_paid status for veteran profile"""
     try:
         logger.info(f"Updating payment status for: {request.email}")
         
-        # Find the veteran profile by email
-        profile = db.query(VeteranProfile).filter(VeteranProfile.email == request.email).first()
-        
-        if not profile:
-            raise HTTPException(status_code=404, detail="Veteran profile not found")
-        
-        # Update the payment status
+        flags = {}
         if request.has_paid is not None:
-            profile.has_paid = request.has_paid
-            logger.info(f"Updated has_paid to {request.has_paid} for {request.email}")
+            flags["has_paid"] = request.has_paid
         
-        db.commit()
-        db.refresh(profile)
+        profile = await apply_status_update(db, response, request.email, flags, if_match, compact)
         
         return {
             "success": True,
             "message": "Payment status updated successfully",
-            "profile": profile.to_dict()
+            "profile": profile
         }
         
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error updating payment status: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to update payment status: {str(e)}")
 
+@app.post("/update-status-batch", dependencies=[Depends(require_service_role)])
+async def update_status_batch(
+    request: BatchStatusUpdateRequest,
+    idempotency_key: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Apply signup/payment status updates for many veterans in one statement.
+
+    An Idempotency-Key is recorded in Postgres with the response, in the same transaction as the
+    updates, so a retry reaching any worker replays the result (concurrent ones wait for it).
+    """
+    if len(request.updates) > STATUS_BATCH_MAX_UPDATES:
+        raise HTTPException(status_code=400, detail=f"At most {STATUS_BATCH_MAX_UPDATES} updates per batch")
+    
+    updates = [u.dict() for u in request.updates]
+    fingerprint = hashlib.sha256(json.dumps(updates, sort_keys=True).encode()).hexdigest()
+    key = f"update-status-batch:{idempotency_key}" if idempotency_key else None
+    
+    try:
+        if key:
+            replay = await idempotency.claim(db, key, fingerprint)
+            if replay is not None:
+                await db.rollback()
+                if replay[0] != fingerprint:
+                    raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+                metrics.incr("status_batch.replayed")
+                return replay[1]
+        
+        logger.info(f"Applying batch status update for {len(updates)} profiles")
+        results = await batch_update_status(db, updates)
+        counts = {status: 0 for status in ("updated", "unchanged", "not_found")}
+        for status in results.values():
+            counts[status] += 1
+        result = {"success": True, **counts, "results": results}
+        if key:
+            await idempotency.save(db, key, result)
+        await db.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Error applying batch status update: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to update statuses: {str(e)}")
+    
+    for email, status in results.items():
+        if status == "updated":
+            profile_cache.invalidate(email)
+    logger.info(f"Batch status update: {counts['updated']} updated, {counts['unchanged']} unchanged, {counts['not_found']} not found")
+    return result
 
 if __name__ == "__main__":
     import uvicorn
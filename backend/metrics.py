@@ -0,0 +1,72 @@
+import math
+import threading
+from collections import deque
+from typing import Dict
+
+class LatencyStats:
+    """Rolling latency window with count, mean and percentile summaries"""
+
+    def __init__(self, window: int = 1024):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, pct: float) -> float:
+        """Percentile (0-100) of the rolling window, in seconds"""
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 2),
+            "p95_ms": round(self.percentile(95) * 1000, 2),
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+class MetricsRegistry:
+    """Process-local counters, gauges and latency windows for the /metrics endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+        self._gauges: Dict[str, float] = {}
+        self._latencies: Dict[str, LatencyStats] = {}
+
+    def incr(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        self._gauges[name] = value
+
+    def latency(self, name: str) -> LatencyStats:
+        stats = self._latencies.get(name)
+        if stats is None:
+            with self._lock:
+                stats = self._latencies.setdefault(name, LatencyStats())
+        return stats
+
+    def observe(self, name: str, seconds: float):
+        self.latency(name).observe(seconds)
+
+    def snapshot(self) -> dict:
+        return {
+            "counters": dict(self._counters),
+            "gauges": dict(self._gauges),
+            "latencies": {name: stats.snapshot() for name, stats in self._latencies.items()},
+        }
+
+# Create a global instance
+metrics = MetricsRegistry()
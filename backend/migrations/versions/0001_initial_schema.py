@@ -0,0 +1,47 @@
+"""Initial veteran_profiles schema
+
+Matches what create_all produced before migrations were introduced. Databases created
+that way should be marked with `alembic stamp 0001` rather than upgraded.
+
+Revision ID: 0001
+Revises:
+Create Date: 2025-08-20 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "veteran_profiles",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("first_name", sa.String(), nullable=False),
+        sa.Column("middle_initial", sa.String(), nullable=True),
+        sa.Column("last_name", sa.String(), nullable=False),
+        sa.Column("ssn_encrypted", sa.LargeBinary(), nullable=True),
+        sa.Column("phone", sa.String(), nullable=True),
+        sa.Column("date_of_birth", sa.String(), nullable=True),
+        sa.Column("file_number", sa.String(), nullable=True),
+        sa.Column("veterans_service_number", sa.String(), nullable=True),
+        sa.Column("military_service", sa.JSON(), nullable=True),
+        sa.Column("claim_info", sa.JSON(), nullable=True),
+        sa.Column("address", sa.JSON(), nullable=True),
+        sa.Column("claim_statement", sa.Text(), nullable=True),
+        sa.Column("has_signed_up", sa.Boolean(), nullable=True),
+        sa.Column("has_paid", sa.Boolean(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_veteran_profiles_email", "veteran_profiles", ["email"], unique=True)
+
+
+def downgrade():
+    op.drop_index("ix_veteran_profiles_email", table_name="veteran_profiles")
+    op.drop_table("veteran_profiles")
@@ -0,0 +1,31 @@
+"""Add the performance indexes from the Supabase schema
+
+idx_veteran_profiles_payment backs payment-status queries and reconciliation. It is built
+CONCURRENTLY so upgrading a live database doesn't block writes.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-08-20 00:00:01
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+INVALID_INDEX_SQL = "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        # An interrupted concurrent build leaves an INVALID index that IF NOT EXISTS would keep
+        if not op.get_context().as_sql and op.get_bind().scalar(sa.text(INVALID_INDEX_SQL), {"name": "idx_veteran_profiles_payment"}):
+            op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_veteran_profiles_payment")
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_veteran_profiles_payment ON veteran_profiles (has_paid)")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_veteran_profiles_payment")
@@ -0,0 +1,35 @@
+"""Add ssn_blind_index for SSN lookups without decryption
+
+Existing rows are filled in by `python phi_maintenance.py backfill-blind-index`.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-08-27 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+INVALID_INDEX_SQL = "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"
+
+
+def upgrade():
+    op.add_column("veteran_profiles", sa.Column("ssn_blind_index", sa.LargeBinary(), nullable=True))
+    with op.get_context().autocommit_block():
+        # An interrupted concurrent build leaves an INVALID index that IF NOT EXISTS would keep
+        if not op.get_context().as_sql and op.get_bind().scalar(sa.text(INVALID_INDEX_SQL), {"name": "ix_veteran_profiles_ssn_blind_index"}):
+            op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_veteran_profiles_ssn_blind_index")
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_veteran_profiles_ssn_blind_index "
+            "ON veteran_profiles (ssn_blind_index)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_veteran_profiles_ssn_blind_index")
+    op.drop_column("veteran_profiles", "ssn_blind_index")
@@ -0,0 +1,23 @@
+"""Add ssn_last4 for masked SSN responses
+
+Existing rows are filled in by `python phi_maintenance.py backfill-ssn-last4`.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-08-28 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("veteran_profiles", sa.Column("ssn_last4", sa.String(4), nullable=True))
+
+
+def downgrade():
+    op.drop_column("veteran_profiles", "ssn_last4")
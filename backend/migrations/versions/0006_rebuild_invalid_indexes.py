@@ -0,0 +1,37 @@
+"""Rebuild concurrently built indexes left INVALID by an interrupted upgrade
+
+0002 and 0003 used CREATE INDEX CONCURRENTLY IF NOT EXISTS, which keeps an invalid index
+from a failed build; databases that went on to a later revision still have it.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2025-09-02 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    "idx_veteran_profiles_payment": "veteran_profiles (has_paid)",
+    "ix_veteran_profiles_ssn_blind_index": "veteran_profiles (ssn_blind_index)",
+}
+
+INVALID_INDEX_SQL = "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"
+
+
+def upgrade():
+    if op.get_context().as_sql:
+        return
+    with op.get_context().autocommit_block():
+        for name, definition in INDEXES.items():
+            if op.get_bind().scalar(sa.text(INVALID_INDEX_SQL), {"name": name}):
+                op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+                op.execute(f"CREATE INDEX CONCURRENTLY {name} ON {definition}")
+
+
+def downgrade():
+    pass
@@ -0,0 +1,31 @@
+"""Index lower(btrim(email)) for campaign recipients read in normalized-address order
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2025-09-03 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+INVALID_INDEX_SQL = "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        # An interrupted concurrent build leaves an INVALID index that IF NOT EXISTS would keep
+        if not op.get_context().as_sql and op.get_bind().scalar(sa.text(INVALID_INDEX_SQL), {"name": "ix_veteran_profiles_email_lower"}):
+            op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_veteran_profiles_email_lower")
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_veteran_profiles_email_lower "
+            "ON veteran_profiles (lower(btrim(email)))"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_veteran_profiles_email_lower")
@@ -1,25 +1,38 @@
-from sqlalchemy import Column, String, Text, Boolean, DateTime, JSON, LargeBinary
-from sqlalchemy.dialects.postgresql import UUID
+import uuid
+from sqlalchemy import Column, String, Text, Boolean, Integer, DateTime, JSON, LargeBinary, Index, text
+from sqlalchemy.dialects.postgresql import JSONB, UUID
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 from database import Base
 
+# Large columns only loaded when a full profile is needed (see undefer_group)
+DETAILS_GROUP = "details"
+
 class VeteranProfile(Base):
     __tablename__ = "veteran_profiles"
+    # Keep in sync with migrations/versions
+    __table_args__ = (
+        Index("idx_veteran_profiles_payment", "has_paid"),
+        # Campaign recipients are paged in normalized-address order (email_campaigns.py)
+        Index("ix_veteran_profiles_email_lower", text("lower(btrim(email))")),
+    )
 
-    id = Column(UUID(as_uuid=True), primary_key=True)  # Will be set to Supabase auth user ID
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)  # Will be set to Supabase auth user ID
     email = Column(String, unique=True, nullable=False, index=True)
     first_name = Column(String, nullable=False)
     middle_initial = Column(String, nullable=True)
     last_name = Column(String, nullable=False)
     ssn_encrypted = Column(LargeBinary, nullable=True)  # Store encrypted SSN as binary
+    ssn_blind_index = Column(LargeBinary, nullable=True, index=True)  # HMAC of the SSN for lookups
+    ssn_last4 = Column(String(4), nullable=True)  # Served masked by default, so reads needn't decrypt
     phone = Column(String, nullable=True)
     date_of_birth = Column(String, nullable=True)  # Store as string in MM/DD/YYYY format
     file_number = Column(String, nullable=True)
     veterans_service_number = Column(String, nullable=True)
-    military_service = Column(JSON, nullable=True, default={})
-    claim_info = Column(JSON, nullable=True, default={})
-    address = Column(JSON, nullable=True, default={})
-    claim_statement = Column(Text, nullable=True)
+    military_service = deferred(Column(JSON, nullable=True, default={}), group=DETAILS_GROUP)
+    claim_info = deferred(Column(JSON, nullable=True, default={}), group=DETAILS_GROUP)
+    address = deferred(Column(JSON, nullable=True, default={}), group=DETAILS_GROUP)
+    claim_statement = deferred(Column(Text, nullable=True), group=DETAILS_GROUP)
     has_signed_up = Column(Boolean, nullable=True, default=False)
     has_paid = Column(Boolean, nullable=True, default=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -33,6 +46,7 @@ class VeteranProfile(Base):
             "first_name": self.first_name,
             "middle_initial": self.middle_initial,
             "last_name": self.last_name,
+            "ssn_masked": f"***-**-{self.ssn_last4}" if self.ssn_last4 else None,
             "phone": self.phone,
             "date_of_birth": self.date_of_birth,
             "file_number": self.file_number,
@@ -45,4 +59,37 @@ class VeteranProfile(Base):
             "has_paid": self.has_paid,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None
-        }
\ No newline at end of file
+        }
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+    # Keep in sync with migrations/versions
+    __table_args__ = (
+        Index("idx_email_outbox_due", "status", "next_attempt_at"),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    idempotency_key = Column(String, unique=True, nullable=False)
+    # Encrypted EmailRequest JSON (bodies can carry claim statements); cleared once sent
+    payload_encrypted = Column(LargeBinary, nullable=True)
+    status = Column(String, nullable=False, default="pending")  # pending, sending, sent, failed, expired
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=True)  # Give up (status expired) after this
+    last_error = Column(Text, nullable=True)
+    provider_message_id = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+
+class IdempotencyKey(Base):
+    """Response recorded for an Idempotency-Key, shared by every worker (see idempotency.py)"""
+    __tablename__ = "idempotency_keys"
+    # Keep in sync with migrations/versions
+    __table_args__ = (
+        Index("idx_idempotency_keys_created_at", "created_at"),
+    )
+
+    key = Column(String, primary_key=True)  # "<endpoint>:<Idempotency-Key header>"
+    fingerprint = Column(String, nullable=False)  # sha256 of the request body
+    response = Column(JSONB, nullable=True)  # Set in the same transaction as the request's writes
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
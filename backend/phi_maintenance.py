@@ -0,0 +1,265 @@
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, List, Optional, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import text
+from database import AsyncSessionLocal, async_engine
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", "500"))
+# Upper bound on rows processed per second, so live traffic keeps its share of the database
+MAINTENANCE_MAX_ROWS_PER_SECOND = float(os.getenv("MAINTENANCE_MAX_ROWS_PER_SECOND", "2000"))
+
+SELECT_SSN_PAGE_SQL = text("""
+SELECT id, ssn_encrypted FROM veteran_profiles
+WHERE id > :after AND ssn_encrypted IS NOT NULL
+ORDER BY id
+LIMIT :limit
+""")
+
+SELECT_UNINDEXED_SSN_PAGE_SQL = text("""
+SELECT id, ssn_encrypted FROM veteran_profiles
+WHERE id > :after AND ssn_encrypted IS NOT NULL AND ssn_blind_index IS NULL
+ORDER BY id
+LIMIT :limit
+""")
+
+SELECT_NO_LAST4_PAGE_SQL = text("""
+SELECT id, ssn_encrypted FROM veteran_profiles
+WHERE id > :after AND ssn_encrypted IS NOT NULL AND ssn_last4 IS NULL
+ORDER BY id
+LIMIT :limit
+""")
+
+# Only rows whose ciphertext is unchanged since we read them are rewritten; a concurrent
+# profile save already wrote fresh values. updated_at is left alone because the plaintext
+# (and so the ETag) doesn't change.
+UPDATE_SSN_SQL = text("""
+UPDATE veteran_profiles AS p
+SET ssn_encrypted = v.new_value
+FROM unnest(CAST(:ids AS uuid[]), CAST(:new_values AS bytea[]), CAST(:old_values AS bytea[]))
+    AS v(id, new_value, old_value)
+WHERE p.id = v.id AND p.ssn_encrypted = v.old_value
+""")
+
+UPDATE_BLIND_INDEX_SQL = text("""
+UPDATE veteran_profiles AS p
+SET ssn_blind_index = v.new_value
+FROM unnest(CAST(:ids AS uuid[]), CAST(:new_values AS bytea[]), CAST(:old_values AS bytea[]))
+    AS v(id, new_value, old_value)
+WHERE p.id = v.id AND p.ssn_encrypted = v.old_value
+""")
+
+UPDATE_LAST4_SQL = text("""
+UPDATE veteran_profiles AS p
+SET ssn_last4 = v.new_value
+FROM unnest(CAST(:ids AS uuid[]), CAST(:new_values AS text[]), CAST(:old_values AS bytea[]))
+    AS v(id, new_value, old_value)
+WHERE p.id = v.id AND p.ssn_encrypted = v.old_value
+""")
+
+@dataclass
+class Checkpoint:
+    last_id: str = str(uuid.UUID(int=0))
+    scanned: int = 0
+    updated: int = 0
+    skipped: int = 0
+    failed: int = 0
+    finished: bool = False
+
+    @classmethod
+    def load(cls, path: str) -> "Checkpoint":
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            return cls(**json.load(f))
+
+    def save(self, path: str):
+        # Write-then-rename so an interrupted job never leaves a torn checkpoint
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(asdict(self), f)
+        os.replace(tmp_path, path)
+
+def _init_worker():
+    from utils.encryption import encryption_service
+    encryption_service.warm_up()
+
+def _rotate_batch(items: List[Tuple[uuid.UUID, bytes]]) -> List[Any]:
+    from utils.encryption import encryption_service
+    return encryption_service.rotate_batch(items)
+
+def _blind_index_batch(items: List[Tuple[uuid.UUID, bytes]]) -> List[Any]:
+    from utils.encryption import encryption_service
+    return encryption_service.blind_index_batch(items)
+
+def _last4_batch(items: List[Tuple[uuid.UUID, bytes]]) -> List[Any]:
+    from utils.encryption import encryption_service
+    return encryption_service.last4_batch(items)
+
+class Throttle:
+    """Sleeps between batches to hold a maximum average rows-per-second rate"""
+
+    def __init__(self, max_rows_per_second: float):
+        self.max_rows_per_second = max_rows_per_second
+        self.started = time.monotonic()
+        self.rows = 0
+
+    async def wait(self, rows: int):
+        self.rows += rows
+        if self.max_rows_per_second <= 0:
+            return
+        ahead = self.rows / self.max_rows_per_second - (time.monotonic() - self.started)
+        if ahead > 0:
+            await asyncio.sleep(ahead)
+
+async def run_ssn_job(
+    name: str,
+    select_sql,
+    transform: Callable[[List[Tuple[uuid.UUID, bytes]]], List[Any]],
+    update_sql,
+    checkpoint_path: str,
+    batch_size: int = MAINTENANCE_BATCH_SIZE,
+    workers: Optional[int] = None,
+    max_rows_per_second: float = MAINTENANCE_MAX_ROWS_PER_SECOND,
+    restart: bool = False
+) -> Checkpoint:
+    """Keyset-paginate (id, ssn_encrypted) pairs through transform on a process pool, resumably.
+
+    transform returns, per value, the new value to write, None to skip, or an exception.
+    """
+    checkpoint = Checkpoint() if restart else Checkpoint.load(checkpoint_path)
+    if checkpoint.finished:
+        logger.info(f"{name} already finished; pass --restart to run it again")
+        return checkpoint
+
+    loop = asyncio.get_running_loop()
+    workers = workers or os.cpu_count() or 1
+    throttle = Throttle(max_rows_per_second)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        while True:
+            async with AsyncSessionLocal() as db:
+                rows = (await db.execute(
+                    select_sql,
+                    {"after": uuid.UUID(checkpoint.last_id), "limit": batch_size}
+                )).all()
+            if not rows:
+                break
+
+            # Split the page across the pool so all workers decrypt in parallel
+            chunk = max(1, -(-len(rows) // workers))
+            chunks = [rows[i:i + chunk] for i in range(0, len(rows), chunk)]
+            results = await asyncio.gather(*(
+                loop.run_in_executor(pool, transform, [(row.id, row.ssn_encrypted) for row in part])
+                for part in chunks
+            ))
+
+            ids, new_values, old_values = [], [], []
+            for part, rotated in zip(chunks, results):
+                for row, value in zip(part, rotated):
+                    if isinstance(value, Exception):
+                        checkpoint.failed += 1
+                        logger.error(f"Could not decrypt ssn_encrypted for profile {row.id} with any configured key")
+                    elif value is None:
+                        checkpoint.skipped += 1
+                    else:
+                        ids.append(row.id)
+                        new_values.append(value)
+                        old_values.append(row.ssn_encrypted)
+
+            if ids:
+                async with AsyncSessionLocal() as db:
+                    result = await db.execute(update_sql, {"ids": ids, "new_values": new_values, "old_values": old_values})
+                    await db.commit()
+                checkpoint.updated += result.rowcount
+                checkpoint.skipped += len(ids) - result.rowcount
+
+            checkpoint.scanned += len(rows)
+            checkpoint.last_id = str(rows[-1].id)
+            checkpoint.save(checkpoint_path)
+            logger.info(
+                f"{name} through {checkpoint.last_id}: {checkpoint.scanned} scanned, "
+                f"{checkpoint.updated} updated, {checkpoint.skipped} skipped, {checkpoint.failed} failed"
+            )
+            await throttle.wait(len(rows))
+
+    checkpoint.finished = True
+    checkpoint.save(checkpoint_path)
+    return checkpoint
+
+async def rotate_keys(checkpoint_path: str, **options) -> Checkpoint:
+    """Re-encrypt every ssn_encrypted value under the current key in the AES-GCM format"""
+    return await run_ssn_job("Key rotation", SELECT_SSN_PAGE_SQL, _rotate_batch, UPDATE_SSN_SQL, checkpoint_path, **options)
+
+async def backfill_blind_index(checkpoint_path: str, **options) -> Checkpoint:
+    """Fill ssn_blind_index for rows written before the column existed"""
+    return await run_ssn_job(
+        "Blind index backfill", SELECT_UNINDEXED_SSN_PAGE_SQL, _blind_index_batch, UPDATE_BLIND_INDEX_SQL,
+        checkpoint_path, **options
+    )
+
+async def rebuild_blind_index(checkpoint_path: str, **options) -> Checkpoint:
+    """Recompute every ssn_blind_index, e.g. after ENCRYPTION_BLIND_INDEX_KEY was first set or changed"""
+    return await run_ssn_job(
+        "Blind index rebuild", SELECT_SSN_PAGE_SQL, _blind_index_batch, UPDATE_BLIND_INDEX_SQL,
+        checkpoint_path, **options
+    )
+
+async def backfill_ssn_last4(checkpoint_path: str, **options) -> Checkpoint:
+    """Fill ssn_last4 (the masked SSN served by default) for rows written before the column existed"""
+    return await run_ssn_job(
+        "SSN last4 backfill", SELECT_NO_LAST4_PAGE_SQL, _last4_batch, UPDATE_LAST4_SQL,
+        checkpoint_path, **options
+    )
+
+JOBS = {
+    "rotate-keys": rotate_keys,
+    "backfill-blind-index": backfill_blind_index,
+    "rebuild-blind-index": rebuild_blind_index,
+    "backfill-ssn-last4": backfill_ssn_last4,
+}
+
+async def _cli(args):
+    try:
+        checkpoint = await JOBS[args.command](
+            args.checkpoint or f"{args.command}.checkpoint.json",
+            batch_size=args.batch_size,
+            workers=args.workers,
+            max_rows_per_second=args.max_rows_per_second,
+            restart=args.restart
+        )
+        print(json.dumps(asdict(checkpoint), indent=2))
+    finally:
+        await async_engine.dispose()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Maintenance jobs for encrypted PHI columns")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    for command, help_text in (
+        ("rotate-keys", "Re-encrypt SSNs (including legacy Fernet values) under the current key"),
+        ("backfill-blind-index", "Compute ssn_blind_index for rows that lack it"),
+        ("rebuild-blind-index", "Recompute ssn_blind_index for every row under the current blind index key"),
+        ("backfill-ssn-last4", "Compute ssn_last4 for rows that lack it"),
+    ):
+        job = subcommands.add_parser(command, help=help_text)
+        job.add_argument("--checkpoint", default=None, help="Progress file used to resume (default: <command>.checkpoint.json)")
+        job.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint")
+        job.add_argument("--batch-size", type=int, default=MAINTENANCE_BATCH_SIZE)
+        job.add_argument("--workers", type=int, default=None, help="Decryption processes (default: CPU count)")
+        job.add_argument("--max-rows-per-second", type=float, default=MAINTENANCE_MAX_ROWS_PER_SECOND, help="0 disables throttling")
+
+    asyncio.run(_cli(parser.parse_args(sys.argv[1:])))
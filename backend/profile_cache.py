@@ -0,0 +1,122 @@
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import NamedTuple, Optional
+from dotenv import load_dotenv
+from utils.cache import TTLCache
+from database import read_router, DATABASE_REPLICA_URL
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Entries contain decrypted PHI, so they only live in process memory and expire quickly
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "30"))
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "2000"))
+PROFILE_CACHE_MAX_BYTES = int(os.getenv("PROFILE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Broadcast invalidations to other workers over Postgres LISTEN/NOTIFY. Always on with a replica:
+# read-your-writes for a write handled by another worker depends on these notifications.
+PROFILE_CACHE_NOTIFY = bool(DATABASE_REPLICA_URL) or os.getenv("PROFILE_CACHE_NOTIFY", "false").lower() in ("1", "true", "yes")
+NOTIFY_CHANNEL = "veteran_profile_invalidate"
+INVALIDATE_ALL = "*"
+
+class CachedProfile(NamedTuple):
+    body: bytes
+    etag: str
+    last_modified: Optional[str]
+    updated_at: Optional[datetime]
+
+class ProfileCache:
+    """Read-through cache of serialized GET /veteran-profiles/{email} responses"""
+
+    def __init__(self):
+        self._cache = TTLCache(
+            max_entries=PROFILE_CACHE_MAX_ENTRIES,
+            ttl=PROFILE_CACHE_TTL_SECONDS,
+            max_bytes=PROFILE_CACHE_MAX_BYTES
+        )
+        # Bumped on every invalidation so a read that raced a write doesn't store stale data
+        self._generation = 0
+        self._listener = None
+
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, email: str) -> Optional[CachedProfile]:
+        return self._cache.get(email)
+
+    def set(self, email: str, entry: CachedProfile, generation: int):
+        """Store a serialized response unless an invalidation happened since the read began"""
+        if generation == self._generation:
+            self._cache.set(email, entry, size=len(entry.body))
+
+    def invalidate(self, email: str, broadcast: bool = True):
+        self._generation += 1
+        # Every profile write invalidates, locally or via NOTIFY: pin its reads to the primary too
+        read_router.mark_written(email)
+        self._cache.pop(email)
+        if broadcast and self._listener is not None:
+            asyncio.ensure_future(self._publish(email))
+
+    def invalidate_all(self, broadcast: bool = True):
+        """Drop every entry, e.g. after a bulk import touched many profiles"""
+        self._generation += 1
+        read_router.mark_all_written()
+        self._cache.clear()
+        if broadcast and self._listener is not None:
+            asyncio.ensure_future(self._publish(INVALIDATE_ALL))
+
+    async def start(self, dsn: str):
+        """Listen for invalidations from other workers when PROFILE_CACHE_NOTIFY is enabled"""
+        if not PROFILE_CACHE_NOTIFY:
+            return
+        try:
+            import asyncpg
+            self._listener = await asyncpg.connect(dsn)
+            await self._listener.add_listener(NOTIFY_CHANNEL, self._on_notify)
+            self._listener.add_termination_listener(self._on_listener_lost)
+            logger.info("Profile cache listening for cross-worker invalidations")
+        except Exception as e:
+            self._listener = None
+            logger.warning(f"Profile cache invalidation channel unavailable: {str(e)}")
+            self._pin_reads_to_primary()
+
+    def _on_listener_lost(self, connection):
+        self._listener = None
+        logger.warning("Profile cache invalidation channel closed")
+        self._pin_reads_to_primary()
+
+    def _pin_reads_to_primary(self):
+        # Another worker's writes would go unnoticed, so the replica could serve them stale
+        if DATABASE_REPLICA_URL and read_router.replica_available:
+            read_router.replica_available = False
+            logger.error("Cross-worker invalidations unavailable - routing all reads to the primary until restart")
+
+    async def close(self):
+        if self._listener is not None:
+            listener, self._listener = self._listener, None
+            listener.remove_termination_listener(self._on_listener_lost)
+            await listener.close()
+
+    def _on_notify(self, connection, pid, channel, payload):
+        # Our own notifications come back too; the local entry is already gone
+        if pid == connection.get_server_pid():
+            return
+        if payload == INVALIDATE_ALL:
+            self.invalidate_all(broadcast=False)
+        else:
+            self.invalidate(payload, broadcast=False)
+
+    async def _publish(self, email: str):
+        try:
+            await self._listener.execute("SELECT pg_notify($1, $2)", NOTIFY_CHANNEL, email)
+        except Exception as e:
+            logger.warning(f"Could not broadcast profile cache invalidation: {str(e)}")
+
+    def stats(self) -> dict:
+        return {**self._cache.stats(), "cross_worker": self._listener is not None}
+
+# Create a global instance
+profile_cache = ProfileCache()
@@ -0,0 +1,267 @@
+import uuid
+import logging
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy import bindparam, case, func, select, text, update
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer_group
+from models import VeteranProfile, DETAILS_GROUP
+from utils.encryption import encryption_service
+
+logger = logging.getLogger(__name__)
+
+# Sentinel for "If-Match: *" (any current version)
+ANY_VERSION = object()
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Columns returned by the lightweight signup/payment status path
+STATUS_COLUMNS = (
+    VeteranProfile.id,
+    VeteranProfile.email,
+    VeteranProfile.has_signed_up,
+    VeteranProfile.has_paid,
+    VeteranProfile.updated_at,
+)
+
+def profile_etag(updated_at: Optional[datetime]) -> str:
+    """Strong ETag derived from updated_at (microseconds since epoch, hex)"""
+    if updated_at is None:
+        return '"0"'
+    return f'"{(updated_at - EPOCH) // timedelta(microseconds=1):x}"'
+
+def last_modified(updated_at: Optional[datetime]) -> Optional[str]:
+    if updated_at is None:
+        return None
+    return format_datetime(updated_at.astimezone(timezone.utc), usegmt=True)
+
+def parse_etags(header: Optional[str]) -> List[str]:
+    """Split an If-Match / If-None-Match header into opaque tags (weak prefixes dropped)"""
+    if not header:
+        return []
+    return [tag.strip().removeprefix("W/") for tag in header.split(",") if tag.strip()]
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    tags = parse_etags(header)
+    return "*" in tags or etag in tags
+
+def expected_version(if_match: Optional[str]):
+    """updated_at value an If-Match header requires, ANY_VERSION for "*", or None without the header"""
+    tags = parse_etags(if_match)
+    if not tags:
+        return None
+    if "*" in tags:
+        return ANY_VERSION
+    # A client normally holds a single version; honour the first one that parses
+    for tag in tags:
+        try:
+            micros = int(tag.strip('"'), 16)
+        except ValueError:
+            continue
+        return EPOCH + timedelta(microseconds=micros)
+    return EPOCH
+
+async def current_version(db: AsyncSession, email: str) -> Optional[datetime]:
+    """Fetch only updated_at for a profile; None if it doesn't exist"""
+    return await db.scalar(select(VeteranProfile.updated_at).where(VeteranProfile.email == email))
+
+def _returning_profile(stmt):
+    """Wrap an INSERT/UPDATE so RETURNING loads a full VeteranProfile, deferred groups included"""
+    return (
+        select(VeteranProfile)
+        .from_statement(stmt.returning(*VeteranProfile.__table__.c))
+        .options(undefer_group(DETAILS_GROUP))
+        .execution_options(populate_existing=True)
+    )
+
+async def find_profiles_by_ssn_index(db: AsyncSession, blind_index: bytes) -> List[Dict[str, Any]]:
+    """Profiles whose ssn_blind_index matches, in one indexed query (no decryption)"""
+    rows = await db.execute(
+        select(*STATUS_COLUMNS, VeteranProfile.first_name, VeteranProfile.last_name)
+        .where(VeteranProfile.ssn_blind_index == blind_index)
+        .order_by(VeteranProfile.created_at)
+    )
+    return [
+        {
+            **row._mapping,
+            "id": str(row.id),
+            "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+        }
+        for row in rows
+    ]
+
+async def upsert_profile(
+    db: AsyncSession,
+    profile_data: Dict[str, Any],
+    user_id: Optional[str] = None,
+    expected_updated_at=None,
+    ssn: Optional[str] = None
+) -> Optional[VeteranProfile]:
+    """Create or update a profile keyed on email with INSERT ... ON CONFLICT ... RETURNING.
+
+    When the caller is authenticated, a pre-signup (email-only) profile is re-keyed to the
+    Supabase user id and marked as signed up in the same statement. Must be the first
+    statement in the session's transaction; the caller commits.
+
+    With expected_updated_at (from If-Match) only an existing row at that version is
+    updated, and None is returned when the precondition fails.
+    """
+    profile_data = dict(profile_data)
+    profile_id = await _resolve_profile_id(db, profile_data, user_id, ssn)
+    if expected_updated_at is not None:
+        return await _conditional_update(db, profile_data, profile_id if user_id else None, expected_updated_at)
+
+    stmt = insert(VeteranProfile).values(id=profile_id, **profile_data)
+    excluded = stmt.excluded
+
+    set_ = {key: excluded[key] for key in profile_data if key != "email"}
+    set_["updated_at"] = func.now()
+    if user_id:
+        rekeyed = VeteranProfile.id != excluded.id
+        set_["id"] = excluded.id
+        set_["has_signed_up"] = case((rekeyed, True), else_=excluded.has_signed_up)
+        if "ssn_encrypted" not in profile_data:
+            # A row our lookup didn't see (written without the email lock) keeps an SSN bound to its
+            # old id, which can't be decrypted once the id changes; drop it rather than keep it
+            for column in ("ssn_encrypted", "ssn_blind_index", "ssn_last4"):
+                set_[column] = case((rekeyed, None), else_=getattr(VeteranProfile, column))
+    elif "ssn_encrypted" in profile_data:
+        # A row inserted concurrently keeps its own id; our ciphertext is bound to another one
+        for column in ("ssn_encrypted", "ssn_blind_index", "ssn_last4"):
+            set_[column] = case((VeteranProfile.id == excluded.id, excluded[column]), else_=getattr(VeteranProfile, column))
+
+    stmt = stmt.on_conflict_do_update(index_elements=[VeteranProfile.email], set_=set_)
+
+    try:
+        profile = await db.scalar(_returning_profile(stmt))
+    except IntegrityError as e:
+        # The user's row exists under a different email (email change): update it by id instead
+        if not user_id or "pkey" not in str(e.orig):
+            raise
+        await db.rollback()
+        logger.info(f"Profile {user_id} changed email, updating by id")
+        profile = await db.scalar(_returning_profile(
+            update(VeteranProfile)
+            .where(VeteranProfile.id == profile_id)
+            .values(**profile_data, updated_at=func.now())
+        ))
+    return profile
+
+async def _resolve_profile_id(db: AsyncSession, profile_data: Dict[str, Any], user_id: Optional[str], ssn: Optional[str]) -> uuid.UUID:
+    """Pick the row id the profile will have and encrypt the SSN columns for it.
+
+    SSN ciphertexts are bound to the row id, so an SSN write or a re-key needs the final id
+    before the upsert: one indexed lookup that also locks the existing row. A row lock can't
+    cover a row that doesn't exist yet, so these saves first take a transaction-scoped advisory
+    lock on the email; otherwise a concurrent first save could insert the row under its own id
+    between our lookup and our upsert. Anonymous saves without an SSN skip both.
+    """
+    prior = None
+    if ssn is not None or user_id:
+        await db.execute(select(func.pg_advisory_xact_lock(func.hashtext(profile_data["email"]))))
+        prior = (await db.execute(
+            select(VeteranProfile.id, VeteranProfile.ssn_encrypted)
+            .where(VeteranProfile.email == profile_data["email"])
+            .with_for_update()
+        )).first()
+
+    if user_id:
+        profile_id = uuid.UUID(user_id)
+    elif prior is not None:
+        profile_id = prior.id
+    else:
+        profile_id = uuid.uuid4()
+
+    if ssn is not None:
+        profile_data.update(encryption_service.protect_ssn(ssn, profile_id))
+    elif prior is not None and prior.id != profile_id and prior.ssn_encrypted:
+        # Claimed at signup: the row id changes, so rebind the stored SSN to the new id
+        profile_data["ssn_encrypted"] = encryption_service.rebind_ssn(prior.ssn_encrypted, prior.id, profile_id)
+    return profile_id
+
+async def _conditional_update(db: AsyncSession, profile_data: Dict[str, Any], user_id: Optional[uuid.UUID], expected_updated_at) -> Optional[VeteranProfile]:
+    values = {key: value for key, value in profile_data.items() if key != "email"}
+    values["updated_at"] = func.now()
+    if user_id:
+        values["id"] = user_id
+        values["has_signed_up"] = case((VeteranProfile.id != user_id, True), else_=profile_data.get("has_signed_up"))
+
+    stmt = update(VeteranProfile).where(VeteranProfile.email == profile_data["email"])
+    if expected_updated_at is not ANY_VERSION:
+        stmt = stmt.where(VeteranProfile.updated_at == expected_updated_at)
+    return await db.scalar(_returning_profile(stmt.values(**values)))
+
+async def update_status_flags(
+    db: AsyncSession,
+    email: str,
+    flags: Dict[str, bool],
+    expected_updated_at=None,
+    full: bool = False
+):
+    """Set signup/payment flags in one UPDATE ... RETURNING without loading the profile first.
+
+    Returns the updated VeteranProfile when full is set, otherwise a mapping of the status
+    columns only. Returns None when no row matched (missing profile or failed If-Match);
+    the caller tells the two apart with current_version. The caller commits.
+    With no flags nothing is written, so updated_at (and the ETag) stay as they are.
+    """
+    conditions = [VeteranProfile.email == email]
+    if expected_updated_at is not None and expected_updated_at is not ANY_VERSION:
+        conditions.append(VeteranProfile.updated_at == expected_updated_at)
+
+    if not flags:
+        if full:
+            return await db.scalar(select(VeteranProfile).where(*conditions).options(undefer_group(DETAILS_GROUP)))
+        row = (await db.execute(select(*STATUS_COLUMNS).where(*conditions))).first()
+        return dict(row._mapping) if row else None
+
+    stmt = update(VeteranProfile).where(*conditions).values(**flags, updated_at=func.now())
+
+    if full:
+        return await db.scalar(_returning_profile(stmt))
+    row = (await db.execute(
+        stmt.returning(*STATUS_COLUMNS),
+        execution_options={"synchronize_session": False}
+    )).first()
+    return dict(row._mapping) if row else None
+
+BATCH_STATUS_SQL = text("""
+WITH input AS (
+    SELECT * FROM jsonb_to_recordset(:updates) AS t(email text, has_signed_up boolean, has_paid boolean)
+),
+updated AS (
+    UPDATE veteran_profiles AS p
+    SET has_signed_up = COALESCE(i.has_signed_up, p.has_signed_up),
+        has_paid = COALESCE(i.has_paid, p.has_paid),
+        updated_at = now()
+    FROM input AS i
+    WHERE p.email = i.email
+      AND (p.has_signed_up IS DISTINCT FROM COALESCE(i.has_signed_up, p.has_signed_up)
+           OR p.has_paid IS DISTINCT FROM COALESCE(i.has_paid, p.has_paid))
+    RETURNING p.email
+)
+SELECT i.email,
+       CASE WHEN u.email IS NOT NULL THEN 'updated'
+            WHEN p.email IS NOT NULL THEN 'unchanged'
+            ELSE 'not_found' END AS status
+FROM input AS i
+LEFT JOIN updated AS u ON u.email = i.email
+LEFT JOIN veteran_profiles AS p ON p.email = i.email
+""").bindparams(bindparam("updates", type_=JSONB))
+
+async def batch_update_status(db: AsyncSession, updates: List[Dict[str, Any]]) -> Dict[str, str]:
+    """Apply many signup/payment flag updates in one set-based statement.
+
+    Returns email -> "updated" | "unchanged" | "not_found". Rows whose flags already match
+    are left untouched so replays don't bump updated_at. The caller commits.
+    """
+    # Last update for an email wins; UPDATE ... FROM would otherwise pick one arbitrarily
+    deduped = {item["email"]: item for item in updates}
+    if not deduped:
+        return {}
+    result = await db.execute(BATCH_STATUS_SQL, {"updates": list(deduped.values())})
+    return {email: status for email, status in result.all()}
@@ -0,0 +1,249 @@
+import os
+import asyncio
+import random
+import time
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+from dotenv import load_dotenv
+import httpx
+from metrics import metrics
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Upstream statuses that mean "try again later" rather than "bad request"
+RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+
+# Failures where the request never reached the upstream, so even non-idempotent calls can retry
+SAFE_TO_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+class CircuitOpenError(Exception):
+    """Raised when a call is short-circuited because its upstream breaker is open"""
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"{upstream} is temporarily unavailable (circuit open)")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with half-open probing"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.half_open_since = 0.0
+        self._half_open_calls = 0
+
+    def before_call(self):
+        """Raise CircuitOpenError unless the call may proceed"""
+        if self.state == self.OPEN:
+            elapsed = time.monotonic() - self.opened_at
+            if elapsed < self.reset_timeout:
+                metrics.incr(f"upstream.{self.name}.short_circuited")
+                raise CircuitOpenError(self.name, self.reset_timeout - elapsed)
+            self._transition(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self._half_open_calls >= self.half_open_max_calls and time.monotonic() - self.half_open_since >= 2 * self.reset_timeout:
+                # The previous probe never reported back; allow another one
+                self._half_open_calls = 0
+                self.half_open_since = time.monotonic()
+            if self._half_open_calls >= self.half_open_max_calls:
+                metrics.incr(f"upstream.{self.name}.short_circuited")
+                raise CircuitOpenError(self.name, 1.0)
+            self._half_open_calls += 1
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        if self.state != self.CLOSED:
+            self._transition(self.CLOSED)
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._transition(self.OPEN)
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        logger.warning(f"Circuit breaker for {self.name}: {self.state} -> {state}")
+        self.state = state
+        self._half_open_calls = 0
+        if state == self.OPEN:
+            self.opened_at = time.monotonic()
+            metrics.incr(f"upstream.{self.name}.breaker_opened")
+        elif state == self.HALF_OPEN:
+            self.half_open_since = time.monotonic()
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.consecutive_failures}
+
+class RetryBudget:
+    """Token bucket that caps retries to a fraction of recent request volume"""
+
+    def __init__(self, ratio: float = 0.2, min_tokens: float = 3.0, max_tokens: float = 20.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = min_tokens
+
+    def record_request(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+class UpstreamPolicy:
+    """Circuit breaker, budgeted jittered retries and optional hedging for one upstream"""
+
+    def __init__(
+        self,
+        name: str,
+        max_attempts: int = 2,
+        base_backoff: float = 0.2,
+        max_backoff: float = 2.0,
+        hedge_percentile: float = 95.0,
+        hedge_min_samples: int = 20,
+        breaker: Optional[CircuitBreaker] = None,
+        retry_budget: Optional[RetryBudget] = None,
+    ):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker(name)
+        self.retry_budget = retry_budget or RetryBudget()
+        self.latency = metrics.latency(f"upstream.{name}")
+
+    async def call(
+        self,
+        send: Callable[[], Awaitable[httpx.Response]],
+        idempotent: bool = False,
+        hedge: bool = False,
+    ) -> httpx.Response:
+        """Run send() under the breaker, retrying transient failures within the budget"""
+        self.breaker.before_call()
+        self.retry_budget.record_request()
+
+        attempt = 1
+        while True:
+            try:
+                if hedge and idempotent:
+                    response = await self._hedged(send)
+                else:
+                    response = await self._timed(send)
+            except httpx.HTTPError as e:
+                self.breaker.record_failure()
+                retryable = idempotent or isinstance(e, SAFE_TO_RETRY_ERRORS)
+                if not retryable or not self._may_retry(attempt):
+                    raise
+                logger.warning(f"{self.name} call failed ({type(e).__name__}), retrying")
+            else:
+                if response.status_code < 500 and response.status_code not in RETRYABLE_STATUS_CODES:
+                    # 4xx responses mean the upstream is healthy, just unhappy with the request
+                    self.breaker.record_success()
+                    return response
+                # Every 5xx counts towards opening the breaker, but only transient statuses are retried
+                self.breaker.record_failure()
+                if response.status_code not in RETRYABLE_STATUS_CODES or not idempotent or not self._may_retry(attempt):
+                    return response
+                await response.aclose()
+                logger.warning(f"{self.name} returned {response.status_code}, retrying")
+
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+            self.breaker.before_call()
+
+    def _may_retry(self, attempt: int) -> bool:
+        if attempt >= self.max_attempts:
+            return False
+        if not self.retry_budget.try_spend():
+            metrics.incr(f"upstream.{self.name}.retry_budget_exhausted")
+            return False
+        metrics.incr(f"upstream.{self.name}.retries")
+        return True
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter keeps synchronized clients from retrying in lockstep
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** (attempt - 1))))
+
+    async def _timed(self, send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        started = time.monotonic()
+        try:
+            return await send()
+        finally:
+            self.latency.observe(time.monotonic() - started)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Latency after which a hedge request is sent, once enough samples exist"""
+        if self.latency.count < self.hedge_min_samples:
+            return None
+        return self.latency.percentile(self.hedge_percentile)
+
+    async def _hedged(self, send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._timed(send)
+
+        first = asyncio.ensure_future(self._timed(send))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        metrics.incr(f"upstream.{self.name}.hedged")
+        pending = {first, asyncio.ensure_future(self._timed(send))}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def snapshot(self) -> dict:
+        return {
+            **self.breaker.snapshot(),
+            "retry_tokens": round(self.retry_budget.tokens, 2),
+            "hedge_after_ms": round(self.hedge_delay() * 1000, 2) if self.hedge_delay() is not None else None,
+        }
+
+def _policy(name: str, **defaults) -> UpstreamPolicy:
+    prefix = name.upper()
+    return UpstreamPolicy(
+        name,
+        max_attempts=int(os.getenv(f"{prefix}_MAX_ATTEMPTS", str(defaults.get("max_attempts", 2)))),
+        breaker=CircuitBreaker(
+            name,
+            failure_threshold=int(os.getenv(f"{prefix}_BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.getenv(f"{prefix}_BREAKER_RESET_SECONDS", "30")),
+        ),
+    )
+
+upstreams: Dict[str, UpstreamPolicy] = {
+    "bastion": _policy("bastion", max_attempts=2),
+    "supabase": _policy("supabase", max_attempts=3),
+    "docuseal": _policy("docuseal", max_attempts=2),
+    "mailgun": _policy("mailgun", max_attempts=2),
+}
+
+def upstream_health() -> dict:
+    """Breaker state per upstream for the /health endpoint"""
+    return {name: policy.snapshot() for name, policy in upstreams.items()}
@@ -30,10 +30,18 @@ if [ -z "$SUPABASE_SERVICE_ROLE_KEY" ]; then
     echo "⚠️  Warning: SUPABASE_SERVICE_ROLE_KEY not set"
 fi
 
+if [ -z "$ENCRYPTION_BLIND_INDEX_KEY" ]; then
+    echo "⚠️  Warning: ENCRYPTION_BLIND_INDEX_KEY not set (SSN saves and lookups will fail)"
+fi
+
 if [ -z "$BASTION_API_KEY" ]; then
     echo "⚠️  Warning: BASTION_API_KEY not set"
 fi
 
+# Apply database migrations
+echo "Applying database migrations..."
+alembic upgrade head
+
 # Start the server
 echo "🚀 Starting FastAPI server on port 8000..."
 uvicorn main:app --host 0.0.0.0 --port 8998 --reload
\ No newline at end of file
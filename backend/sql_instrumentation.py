@@ -0,0 +1,97 @@
+import os
+import re
+import time
+import random
+import logging
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Optional
+from dotenv import load_dotenv
+from sqlalchemy import event
+from metrics import metrics
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "200"))
+SQL_SLOW_QUERY_SAMPLE_RATE = float(os.getenv("SQL_SLOW_QUERY_SAMPLE_RATE", "1.0"))
+# Identical statements per request before we suspect an N+1 pattern
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "5"))
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+@dataclass
+class QueryStats:
+    queries: int = 0
+    seconds: float = 0.0
+    rows: int = 0
+    statements: Counter = field(default_factory=Counter)
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.seconds * 1000:.1f};desc="{self.queries} queries, {self.rows} rows"'
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar("sql_query_stats", default=None)
+
+def begin_request() -> QueryStats:
+    """Start attributing queries issued by the current request to a fresh QueryStats"""
+    stats = QueryStats()
+    _current.set(stats)
+    return stats
+
+def redact(statement: str) -> str:
+    """Statements use bind parameters, but strip any inline string literals before logging"""
+    return STRING_LITERAL.sub("'?'", " ".join(statement.split()))
+
+def describe_parameters(parameters) -> str:
+    """Parameter names and types only; values may be PHI"""
+    if isinstance(parameters, dict):
+        return ", ".join(f"{key}=<{type(value).__name__}>" for key, value in parameters.items())
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return f"<{len(parameters)} parameter sets>"
+        return ", ".join(f"<{type(value).__name__}>" for value in parameters)
+    return ""
+
+def instrument_engine(sync_engine, name: str):
+    """Time every statement on an engine and attribute it to the current request"""
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        # Drivers report -1 when the row count isn't known (e.g. some SELECTs)
+        rows = max(getattr(cursor, "rowcount", -1) or 0, 0)
+
+        metrics.observe(f"db.{name}.query", elapsed)
+        stats = _current.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += elapsed
+            stats.rows += rows
+            stats.statements[statement] += 1
+
+        if elapsed * 1000 >= SQL_SLOW_QUERY_MS:
+            metrics.incr(f"db.{name}.slow_queries")
+            if random.random() < SQL_SLOW_QUERY_SAMPLE_RATE:
+                logger.warning(
+                    f"Slow query on {name} ({elapsed * 1000:.1f} ms, {rows} rows): "
+                    f"{redact(statement)} [{describe_parameters(parameters)}]"
+                )
+
+def finish_request(stats: QueryStats, route: str):
+    """Record per-route totals and warn about statements repeated within one request"""
+    if not stats.queries:
+        return
+    metrics.incr(f"db.route.{route}.queries", stats.queries)
+    metrics.incr(f"db.route.{route}.rows", stats.rows)
+    metrics.observe(f"db.route.{route}.time", stats.seconds)
+    for statement, count in stats.statements.items():
+        if count >= SQL_N_PLUS_ONE_THRESHOLD:
+            metrics.incr(f"db.route.{route}.n_plus_one")
+            logger.warning(f"Possible N+1 in {route}: statement ran {count} times: {redact(statement)[:200]}")
@@ -0,0 +1,41 @@
+import os
+import sys
+import base64
+import pytest
+
+# Tests import the flat backend modules directly, as the app does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Engines are created at import but only connect when TEST_DATABASE_URL is set
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/vets4claims_test")
+
+# utils.encryption refuses to load without a key; use a fixed test-only one
+os.environ.setdefault("ENCRYPTION_RAW_KEY", base64.urlsafe_b64encode(b"k" * 32).decode())
+os.environ.setdefault("ENCRYPTION_BLIND_INDEX_KEY", base64.urlsafe_b64encode(b"b" * 32).decode())
+
+# Tests that need Postgres run only when TEST_DATABASE_URL names a disposable database
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+@pytest.fixture
+def database():
+    """Async runner: `await database(test)` calls test(engine) on a freshly created schema"""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import NullPool
+    from database import to_async_url
+    # Through models, so every table is registered on Base
+    from models import Base
+
+    async def run(test):
+        engine = create_async_engine(to_async_url(TEST_DATABASE_URL), poolclass=NullPool)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+        try:
+            await test(engine)
+        finally:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.drop_all)
+            await engine.dispose()
+    return run
@@ -0,0 +1,105 @@
+import asyncio
+import pytest
+from admission import AdmissionController, AdmissionRejected
+
+def controller(**options):
+    options = {"max_concurrency": 2, "min_concurrency": 1, "max_wait": 5.0, "latency_target": 1.0, **options}
+    return AdmissionController("test", **options)
+
+def test_slots_are_granted_immediately_below_the_limit():
+    admission = controller()
+
+    async def run():
+        async with admission.slot("a"):
+            async with admission.slot("b"):
+                assert admission.active == 2
+                assert admission.queued == 0
+        assert admission.active == 0
+    asyncio.run(run())
+
+def test_waiters_are_served_round_robin_across_keys():
+    admission = controller(max_concurrency=1, max_queue_per_key=8)
+    order = []
+
+    async def request(key, n):
+        async with admission.slot(key):
+            order.append(f"{key}{n}")
+            await asyncio.sleep(0)
+
+    async def run():
+        await admission.acquire("holder")
+        # One user queues three requests before another user queues one
+        tasks = [asyncio.create_task(request("a", n)) for n in range(3)]
+        tasks.append(asyncio.create_task(request("b", 0)))
+        await asyncio.sleep(0)
+        assert admission.queued == 4
+        admission.release(None, success=True)
+        await asyncio.gather(*tasks)
+    asyncio.run(run())
+    assert order == ["a0", "b0", "a1", "a2"]
+
+def test_per_key_and_global_queue_limits_reject():
+    admission = controller(max_concurrency=1, max_queue=2, max_queue_per_key=1)
+
+    async def run():
+        await admission.acquire("holder")
+        waiters = [asyncio.create_task(admission.acquire("a"))]
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected, match="this user"):
+            await admission.acquire("a")
+        waiters.append(asyncio.create_task(admission.acquire("b")))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected, match="queue full") as rejected:
+            await admission.acquire("c")
+        assert rejected.value.retry_after >= 1
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        assert admission.queued == 0
+    asyncio.run(run())
+
+def test_requests_that_cannot_meet_their_deadline_are_shed_up_front():
+    admission = controller(max_concurrency=1, latency_target=10.0)
+
+    async def run():
+        await admission.acquire("holder")
+        with pytest.raises(AdmissionRejected, match="exceeds deadline"):
+            await admission.acquire("a", max_wait=1.0)
+        assert admission.queued == 0
+    asyncio.run(run())
+
+def test_timed_out_waiter_leaves_the_queue():
+    admission = controller(max_concurrency=1, latency_target=0.001)
+
+    async def run():
+        await admission.acquire("holder")
+        with pytest.raises(AdmissionRejected, match="timed out"):
+            await admission.acquire("a", max_wait=0.01)
+        assert admission.queued == 0
+        admission.release(None, success=True)
+        assert admission.active == 0
+    asyncio.run(run())
+
+def test_failures_shrink_the_limit_and_successes_grow_it_back():
+    admission = controller(max_concurrency=8, min_concurrency=2, latency_target=1.0)
+
+    async def fail():
+        async with admission.slot("a"):
+            raise RuntimeError("upstream error")
+
+    async def run():
+        for _ in range(20):
+            with pytest.raises(RuntimeError):
+                await fail()
+        assert admission.limit == 2.0
+        for _ in range(50):
+            async with admission.slot("a"):
+                pass
+        assert 2.0 < admission.limit <= 8.0
+    asyncio.run(run())
+
+def test_slow_responses_shrink_the_limit():
+    admission = controller(max_concurrency=8, latency_target=1.0)
+    admission.active = 1
+    admission.release(5.0, success=True)
+    assert admission.limit < 8.0
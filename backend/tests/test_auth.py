@@ -0,0 +1,46 @@
+import time
+import asyncio
+import jwt
+import httpx
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+from starlette.requests import Request
+import auth
+from auth import SupabaseJWTVerifier, authenticate
+
+private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+public_jwk = {**jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key(), as_dict=True), "kid": "k1", "alg": "RS256", "use": "sig"}
+
+@pytest.fixture
+def make_verifier(monkeypatch):
+    """Verifier whose keys were loaded from a mocked Supabase JWKS endpoint"""
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"keys": [public_jwk]}))
+    monkeypatch.setattr(auth.http_clients, "get", lambda name: httpx.AsyncClient(transport=transport, base_url="https://supabase.test"))
+
+    def make() -> SupabaseJWTVerifier:
+        verifier = SupabaseJWTVerifier(jwt_secret=None)
+        asyncio.run(verifier.refresh_keys())
+        return verifier
+    return make
+
+def claims() -> dict:
+    return {"sub": "user-1", "role": "authenticated", "exp": int(time.time()) + 600}
+
+def test_accepts_token_signed_with_jwks_key(make_verifier):
+    token = jwt.encode(claims(), private_key, algorithm="RS256", headers={"kid": "k1"})
+    assert asyncio.run(make_verifier().verify(token))["sub"] == "user-1"
+
+@pytest.mark.parametrize("algorithm,key", [("none", None), ("HS512", "not-the-key-" * 4)])
+def test_rejects_token_whose_alg_does_not_match_the_key(make_verifier, algorithm, key):
+    token = jwt.encode(claims(), key, algorithm=algorithm, headers={"kid": "k1"})
+    with pytest.raises(jwt.PyJWTError):
+        asyncio.run(make_verifier().verify(token))
+
+def test_authenticate_maps_key_errors_to_401(monkeypatch, make_verifier):
+    monkeypatch.setattr(auth, "jwt_verifier", make_verifier())
+    token = jwt.encode(claims(), None, algorithm="none", headers={"kid": "k1"})
+    request = Request({"type": "http", "headers": [(b"authorization", f"Bearer {token}".encode())]})
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(authenticate(request))
+    assert error.value.status_code == 401
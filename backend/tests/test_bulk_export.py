@@ -0,0 +1,26 @@
+import asyncio
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+import bulk_export
+from models import VeteranProfile
+
+def test_unknown_columns_are_rejected():
+    assert bulk_export.resolve_columns("email, has_paid") == ["email", "has_paid"]
+    with pytest.raises(ValueError):
+        bulk_export.resolve_columns("email,ssn_encrypted")
+
+def test_streaming_and_buffered_exports_report_every_row(database, monkeypatch):
+    async def test(engine):
+        async with engine.begin() as conn:
+            await conn.execute(insert(VeteranProfile), [
+                {"email": f"vet{n}@example.com", "first_name": "Ann", "last_name": "Lee", "address": {"city": "X"}}
+                for n in range(25)
+            ])
+        monkeypatch.setattr(bulk_export, "ReadSessionLocal", async_sessionmaker(engine))
+        monkeypatch.setattr(bulk_export, "EXPORT_BATCH_SIZE", 10)
+        for fmt in ("ndjson", "csv"):
+            for buffered in (False, True):
+                result = await bulk_export.measure_export(fmt, buffered)
+                assert result["rows"] == 25
+    asyncio.run(database(test))
@@ -0,0 +1,128 @@
+import codecs
+import asyncio
+import pytest
+from typing import Optional
+from pydantic import BaseModel
+from sqlalchemy import text
+import bulk_import
+from bulk_import import iter_csv_records, iter_lines, iter_ndjson_records
+
+async def _lines(lines):
+    for line in lines:
+        yield line
+
+async def _chunks(chunks):
+    for chunk in chunks:
+        yield chunk
+
+def split(chunks):
+    async def collect():
+        return [line async for line in iter_lines(_chunks(chunks))]
+    return asyncio.run(collect())
+
+def parse_ndjson(chunks):
+    async def collect():
+        return [record async for record in iter_ndjson_records(iter_lines(_chunks(chunks)))]
+    return asyncio.run(collect())
+
+def parse(lines):
+    async def collect():
+        return [record async for record in iter_csv_records(_lines(lines))]
+    return asyncio.run(collect())
+
+def test_quoted_field_may_span_lines():
+    records = parse(["email,claim_statement", 'a@x.com,"first line', 'second line"', "b@x.com,short"])
+    assert records == [
+        (1, {"email": "a@x.com", "claim_statement": "first line\nsecond line"}),
+        (2, {"email": "b@x.com", "claim_statement": "short"}),
+    ]
+
+def test_unbalanced_quote_is_bounded_and_reported(monkeypatch):
+    monkeypatch.setattr(bulk_import, "IMPORT_MAX_RECORD_LINES", 3)
+    records = parse(["email,first_name", 'a@x.com,"Ann', "b@x.com,Bo", "c@x.com,Cy", "d@x.com,Di"])
+    assert isinstance(records[0][1], ValueError)
+    assert "line 2" in str(records[0][1])
+    # Parsing resumes after the skipped lines instead of buffering the rest of the file
+    assert records[1] == (2, {"email": "d@x.com", "first_name": "Di"})
+
+def test_unterminated_record_at_end_of_input_is_reported():
+    records = parse(["email,first_name", "a@x.com,Ann", 'b@x.com,"Bo'])
+    assert records[0] == (1, {"email": "a@x.com", "first_name": "Ann"})
+    assert records[1][0] == 2 and isinstance(records[1][1], ValueError)
+
+def test_missing_or_extra_cells_are_row_errors():
+    records = parse(["email,first_name,last_name", "a@x.com,Ann", "b@x.com,Bo,Lee,extra", "c@x.com,Cy,Lee"])
+    assert [str(error) for _, error in records[:2]] == ["Expected 3 cells, got 2", "Expected 3 cells, got 4"]
+    assert records[2] == (3, {"email": "c@x.com", "first_name": "Cy", "last_name": "Lee"})
+
+def test_conflicting_dotted_column_is_a_row_error():
+    records = parse(["email,address,address.zip", "a@x.com,Main St,12345"])
+    assert isinstance(records[0][1], ValueError)
+
+def test_byte_order_mark_is_stripped_only_at_the_start():
+    bom = codecs.BOM_UTF8
+    # Split inside the BOM so it only becomes recognizable after the second chunk
+    assert split([bom[:2], bom[2:] + b"email\n" + bom + b"x\n"]) == ["email", "\ufeffx"]
+
+def parse_bytes(chunks):
+    async def collect():
+        return [record async for record in iter_csv_records(iter_lines(_chunks(chunks)))]
+    return asyncio.run(collect())
+
+def test_undecodable_line_fails_only_its_row():
+    records = parse_bytes([b"email,first_name\na@x.com,\xff\nb@x.com,Bo\n"])
+    assert isinstance(records[0][1], ValueError) and "line 2" in str(records[0][1])
+    assert records[1] == (2, {"email": "b@x.com", "first_name": "Bo"})
+
+def test_unreadable_header_rejects_the_file():
+    with pytest.raises(ValueError, match="header"):
+        parse_bytes([b"\xffemail\na@x.com\n"])
+
+def test_overlong_line_is_capped_without_a_newline(monkeypatch):
+    monkeypatch.setattr(bulk_import, "IMPORT_MAX_RECORD_BYTES", 10)
+    # Far more than the cap and no newline until the end
+    lines = split([b"x" * 8] * 1000 + [b"\nok\n"])
+    assert len(lines) == 2
+    assert isinstance(lines[0], ValueError) and "longer than 10 bytes" in str(lines[0])
+    assert lines[1] == "ok"
+
+def test_ndjson_lines_must_be_objects():
+    records = parse_ndjson([b'{"email": "a@x.com"}\n[1, 2]\n"x"\n\xff\n{"email": "b@x.com"}\n'])
+    assert records[0] == (1, {"email": "a@x.com"})
+    assert [type(error).__name__ for _, error in records[1:4]] == ["ValueError", "ValueError", "ValueError"]
+    assert "got list" in str(records[1][1]) and "got str" in str(records[2][1])
+    assert records[4] == (5, {"email": "b@x.com"})
+
+class ImportedProfile(BaseModel):
+    email: str
+    first_name: str
+    last_name: str
+    middle_initial: Optional[str] = None
+    ssn: Optional[str] = None
+    phone: Optional[str] = None
+    date_of_birth: Optional[str] = None
+    file_number: Optional[str] = None
+    veterans_service_number: Optional[str] = None
+    military_service: Optional[dict] = None
+    claim_info: Optional[dict] = None
+    address: Optional[dict] = None
+    claim_statement: Optional[str] = None
+
+def test_bad_ndjson_lines_are_row_errors_and_the_rest_loads(database, monkeypatch):
+    body = b"\n".join([
+        b'{"email": "a@x.com", "first_name": "Ann", "last_name": "Lee", "ssn": "123-45-6789"}',
+        b"[1, 2]",
+        b'"x"',
+        b"\xff",
+        b'{"email": "b@x.com", "first_name": "Bo", "last_name": "Lee"}',
+    ])
+
+    async def test(engine):
+        monkeypatch.setattr(bulk_import, "async_engine", engine)
+        report = await bulk_import.import_profiles(_chunks([body]), "ndjson", ImportedProfile, batch_size=1)
+        assert (report.rows, report.imported, report.failed) == (5, 2, 3)
+        assert [error["row"] for error in report.errors] == [2, 3, 4]
+        async with engine.connect() as conn:
+            emails = (await conn.execute(text("SELECT email FROM veteran_profiles ORDER BY email"))).scalars().all()
+        assert emails == ["a@x.com", "b@x.com"]
+    asyncio.run(database(test))
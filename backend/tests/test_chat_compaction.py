@@ -0,0 +1,88 @@
+import asyncio
+from chat_compaction import ConversationCompactor, SUMMARY_PREFIX, extractive_summary, message_tokens
+
+def turn(n, size=200):
+    role = "user" if n % 2 == 0 else "assistant"
+    return {"role": role, "content": f"turn {n} " + "x" * size}
+
+class RecordingSummarizer:
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    async def __call__(self, previous_summary, messages):
+        self.calls.append((previous_summary, [m["content"] for m in messages]))
+        if self.fail:
+            raise RuntimeError("upstream down")
+        return f"summary of {len(messages)} after {previous_summary!r}"
+
+def compact(compactor, messages):
+    return asyncio.run(compactor.compact(messages))
+
+def test_history_under_budget_is_untouched():
+    summarize = RecordingSummarizer()
+    messages = [turn(n, size=10) for n in range(4)]
+    result = compact(ConversationCompactor(summarize, token_budget=1000), messages)
+    assert result.messages is messages
+    assert result.tokens_saved == 0
+    assert summarize.calls == []
+
+def test_older_turns_are_summarized_and_recent_ones_kept():
+    summarize = RecordingSummarizer()
+    system = {"role": "system", "content": "You help veterans with VA claims."}
+    conversation = [turn(n) for n in range(10)]
+    result = compact(ConversationCompactor(summarize, token_budget=400, keep_recent=4), [system] + conversation)
+
+    assert result.messages[0] == system
+    assert result.messages[1]["role"] == "system"
+    assert result.messages[1]["content"].startswith(SUMMARY_PREFIX)
+    assert result.messages[2:] == conversation[-4:]
+    assert summarize.calls == [(None, [m["content"] for m in conversation[:6]])]
+    assert result.compacted_tokens == sum(message_tokens(m) for m in result.messages)
+    assert result.tokens_saved > 0
+
+def test_latest_turn_is_kept_even_when_it_alone_exceeds_the_budget():
+    summarize = RecordingSummarizer()
+    conversation = [turn(0), turn(1), turn(2, size=4000)]
+    result = compact(ConversationCompactor(summarize, token_budget=100, keep_recent=4), conversation)
+    assert result.messages[-1] == conversation[-1]
+    assert len(result.messages) == 2
+
+def test_summaries_are_extended_incrementally():
+    summarize = RecordingSummarizer()
+    compactor = ConversationCompactor(summarize, token_budget=400, keep_recent=4)
+    conversation = [turn(n) for n in range(10)]
+    first = compact(compactor, conversation)
+
+    # Same history again: served from the cache
+    assert compact(compactor, conversation).messages == first.messages
+    assert len(summarize.calls) == 1
+
+    # Two more turns: only the newly evicted ones are sent, with the previous summary
+    compact(compactor, conversation + [turn(10), turn(11)])
+    previous_summary, delta = summarize.calls[1]
+    assert previous_summary == "summary of 6 after None"
+    assert delta == [m["content"] for m in conversation[6:8]]
+    assert compactor.stats()["cached_summaries"] == 2
+
+def test_failed_summarization_falls_back_to_extractive_summary():
+    summarize = RecordingSummarizer(fail=True)
+    compactor = ConversationCompactor(summarize, token_budget=400, keep_recent=4)
+    conversation = [turn(n) for n in range(10)]
+    result = compact(compactor, conversation)
+    assert result.messages[0]["content"] == SUMMARY_PREFIX + extractive_summary(None, conversation[:6])
+    # Fallbacks aren't cached, so the next request tries the summarizer again
+    compact(compactor, conversation)
+    assert len(summarize.calls) == 2
+
+def test_summary_cache_is_bounded():
+    compactor = ConversationCompactor(RecordingSummarizer(), token_budget=400, keep_recent=4, cache_size=2)
+    for n in range(4):
+        compact(compactor, [{"role": "user", "content": f"conversation {n} " + "y" * 300}] + [turn(i) for i in range(9)])
+    assert compactor.stats()["cached_summaries"] == 2
+
+def test_extractive_summary_truncates_long_turns():
+    summary = extractive_summary("Earlier: intake done.", [{"role": "user", "content": "a  b\n" + "z" * 500}], max_chars=20)
+    lines = summary.split("\n")
+    assert lines[0] == "Earlier: intake done."
+    assert lines[1].startswith("user: a b ") and lines[1].endswith("...")
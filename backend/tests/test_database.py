@@ -0,0 +1,22 @@
+import asyncio
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+import database
+from conftest import TEST_DATABASE_URL
+
+def test_event_loop_benchmark_reports_both_sessions(monkeypatch):
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_engine(TEST_DATABASE_URL)
+    async_engine = create_async_engine(database.to_async_url(TEST_DATABASE_URL))
+    monkeypatch.setattr(database, "engine", engine)
+    monkeypatch.setattr(database, "async_engine", async_engine)
+    monkeypatch.setattr(database, "SessionLocal", sessionmaker(bind=engine))
+    monkeypatch.setattr(database, "AsyncSessionLocal", async_sessionmaker(async_engine))
+
+    result = asyncio.run(database.benchmark_event_loop(requests=40, concurrency=4, query_ms=1))
+
+    assert set(result) == {"sync", "async"}
+    assert all(stats["requests_per_second"] > 0 for stats in result.values())
@@ -0,0 +1,79 @@
+import json
+import asyncio
+import httpx
+import pytest
+from urllib.parse import parse_qs
+import email_service as email_service_module
+import resilience
+from email_service import EmailService, BatchRecipient, EMAIL_BATCH_MAX_ATTEMPTS
+from resilience import UpstreamPolicy
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    async def sleep(seconds):
+        pass
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    # A fresh breaker per test, so failures in one test don't short-circuit the next
+    monkeypatch.setitem(resilience.upstreams, "mailgun", UpstreamPolicy("mailgun", max_attempts=1))
+
+def run_campaign(monkeypatch, handler, count=3, batch_size=1000, emails=None):
+    requests = []
+
+    def record(request):
+        requests.append(request)
+        return handler(request, len(requests))
+
+    transport = httpx.MockTransport(record)
+    monkeypatch.setattr(email_service_module.http_clients, "get", lambda name: httpx.AsyncClient(transport=transport))
+    service = EmailService()
+    service.mailgun_api_key, service.mailgun_domain = "key", "mg.test"
+
+    async def recipients():
+        for n, email in enumerate(emails or [f"vet{n}@example.com" for n in range(count)]):
+            yield BatchRecipient(email=email, variables={"first_name": f"Vet {n}"})
+
+    report = asyncio.run(service.send_campaign(recipients(), "Subject", "Hi %recipient.first_name%", batch_size=batch_size))
+    return report, requests
+
+def test_batches_use_recipient_variables_and_respect_the_limit(monkeypatch):
+    report, requests = run_campaign(monkeypatch, lambda request, n: httpx.Response(200, json={"id": f"<{n}>"}), count=2500)
+    assert [b.recipients for b in report.batches] == [1000, 1000, 500]
+    assert report.sent == 2500 and report.failed == 0
+    form = parse_qs(requests[-1].content.decode())
+    assert len(form["to"]) == 500
+    assert json.loads(form["recipient-variables"][0])["vet2000@example.com"] == {"first_name": "Vet 2000"}
+
+def test_ambiguous_failure_is_reported_not_resent(monkeypatch):
+    def timeout(request, n):
+        raise httpx.ReadTimeout("read timed out", request=request)
+    report, requests = run_campaign(monkeypatch, timeout)
+    assert len(requests) == 1
+    assert report.failed == 3 and report.sent == 0
+    assert all("outcome unknown" in failure["error"] for failure in report.failures)
+
+@pytest.mark.parametrize("status", [500, 502, 504])
+def test_server_errors_that_may_have_sent_are_not_resent(monkeypatch, status):
+    report, requests = run_campaign(monkeypatch, lambda request, n: httpx.Response(status))
+    assert len(requests) == 1 and report.failed == 3
+
+def test_unsent_batches_are_retried(monkeypatch):
+    def flaky(request, n):
+        if n == 1:
+            raise httpx.ConnectError("refused", request=request)
+        if n == 2:
+            return httpx.Response(503)
+        return httpx.Response(200, json={"id": "<ok>"})
+    report, requests = run_campaign(monkeypatch, flaky)
+    assert len(requests) == 3
+    assert report.sent == 3 and report.batches[0].attempts == 3
+
+def test_retries_stop_after_max_attempts(monkeypatch):
+    report, requests = run_campaign(monkeypatch, lambda request, n: httpx.Response(429))
+    assert len(requests) == EMAIL_BATCH_MAX_ATTEMPTS
+    assert report.failed == 3
+
+def test_repeated_addresses_in_order_are_sent_once(monkeypatch):
+    emails = ["a@example.com", "A@Example.com ", "b@example.com", "b@example.com", "c@example.com"]
+    report, requests = run_campaign(monkeypatch, lambda request, n: httpx.Response(200, json={"id": "<ok>"}), emails=emails)
+    assert report.sent == 3
+    assert parse_qs(requests[0].content.decode())["to"] == ["a@example.com", "b@example.com", "c@example.com"]
@@ -0,0 +1,80 @@
+import uuid
+import pytest
+from cryptography.fernet import InvalidToken
+from utils.encryption import EncryptionService, FORMAT_AES_GCM_V1, HEADER_SIZE, benchmark, benchmark_import, field_aad
+
+@pytest.fixture
+def service():
+    return EncryptionService()
+
+def test_field_round_trip_is_compact(service):
+    row_id = uuid.uuid4()
+    token = service.encrypt_ssn("123-45-6789", row_id)
+    assert token[0] == FORMAT_AES_GCM_V1
+    # Header + 9 plaintext bytes + 16-byte tag
+    assert len(token) == HEADER_SIZE + 9 + 16
+    assert service.decrypt_ssn(token, row_id) == "123-45-6789"
+    assert service.is_current(token)
+
+def test_nonces_are_not_reused(service):
+    aad = field_aad("ssn", uuid.uuid4())
+    assert service.encrypt_field(b"123456789", aad) != service.encrypt_field(b"123456789", aad)
+
+def test_legacy_fernet_values_still_decrypt(service):
+    legacy = service.cipher_suite.encrypt(b"123456789")
+    assert legacy[:1] == b"g"
+    # Fernet tokens carry no associated data, so any aad is accepted
+    assert service.decrypt_field(legacy, field_aad("ssn", uuid.uuid4())) == b"123456789"
+    assert not service.is_current(legacy)
+
+def test_ciphertext_is_bound_to_row_and_column(service):
+    row_id = uuid.uuid4()
+    token = service.encrypt_field(b"123456789", field_aad("ssn", row_id))
+    with pytest.raises(InvalidToken):
+        service.decrypt_field(token, field_aad("ssn", uuid.uuid4()))
+    with pytest.raises(InvalidToken):
+        service.decrypt_field(token, field_aad("file_number", row_id))
+
+def test_tampered_ciphertext_is_rejected(service):
+    aad = field_aad("ssn", uuid.uuid4())
+    token = bytearray(service.encrypt_field(b"123456789", aad))
+    token[-1] ^= 1
+    with pytest.raises(InvalidToken):
+        service.decrypt_field(bytes(token), aad)
+
+def test_batch_decrypt_reports_failures_per_value(service):
+    good, other = field_aad("ssn", uuid.uuid4()), field_aad("ssn", uuid.uuid4())
+    token = service.encrypt_field(b"123456789", good)
+    results = service.decrypt_fields([(token, good), (token, other), (b"garbage", good)])
+    assert results[0] == b"123456789"
+    assert isinstance(results[1], InvalidToken) and isinstance(results[2], InvalidToken)
+
+def test_blind_index_ignores_formatting(service):
+    assert service.ssn_blind_index("123-45-6789") == service.ssn_blind_index("123456789")
+    assert service.ssn_blind_index("123-45-6789") != service.ssn_blind_index("123-45-6780")
+
+def test_blind_index_key_is_required_on_use(monkeypatch):
+    monkeypatch.delenv("ENCRYPTION_BLIND_INDEX_KEY")
+    service = EncryptionService()
+    row_id = uuid.uuid4()
+    assert service.decrypt_ssn(service.encrypt_ssn("123-45-6789", row_id), row_id) == "123-45-6789"
+    with pytest.raises(RuntimeError, match="ENCRYPTION_BLIND_INDEX_KEY"):
+        service.protect_ssn("123-45-6789", row_id)
+    with pytest.raises(RuntimeError, match="ENCRYPTION_BLIND_INDEX_KEY"):
+        service.ssn_blind_index("123-45-6789")
+
+def test_rebind_moves_ssn_to_new_row(service):
+    old_id, new_id = uuid.uuid4(), uuid.uuid4()
+    token = service.rebind_ssn(service.encrypt_ssn("123456789", old_id), old_id, new_id)
+    assert service.decrypt_ssn(token, new_id) == "123-45-6789"
+    with pytest.raises(Exception):
+        service.decrypt_ssn(token, old_id)
+
+def test_benchmark_reports_both_formats(service):
+    result = benchmark(service, iterations=10)
+    assert result["aes_gcm_v1"]["bytes"] == 39
+    assert result["fernet"]["bytes"] == 100
+
+def test_import_benchmark_reports_import_and_kdf_time():
+    result = benchmark_import(iterations=1, module="utils.encryption")
+    assert set(result) == {"utils.encryption_ms", "kdf_ms"}
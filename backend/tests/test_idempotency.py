@@ -0,0 +1,46 @@
+import asyncio
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+import idempotency
+
+def test_a_committed_key_replays_and_a_rolled_back_one_is_released(database):
+    async def test(engine):
+        sessions = async_sessionmaker(engine, expire_on_commit=False)
+        async with sessions() as db:
+            assert await idempotency.claim(db, "k", "f1") is None
+            await db.rollback()
+        async with sessions() as db:
+            assert await idempotency.claim(db, "k", "f1") is None
+            await idempotency.save(db, "k", {"updated": 1})
+            await db.commit()
+        async with sessions() as db:
+            assert await idempotency.claim(db, "k", "f2") == ("f1", {"updated": 1})
+    asyncio.run(database(test))
+
+def test_a_concurrent_retry_waits_for_the_first_response(database):
+    async def test(engine):
+        sessions = async_sessionmaker(engine, expire_on_commit=False)
+        async with sessions() as first, sessions() as second:
+            assert await idempotency.claim(first, "k", "f") is None
+            retry = asyncio.create_task(idempotency.claim(second, "k", "f"))
+            await asyncio.sleep(0.2)
+            # Blocked on the first transaction's uncommitted row
+            assert not retry.done()
+            await idempotency.save(first, "k", {"updated": 2})
+            await first.commit()
+            assert await retry == ("f", {"updated": 2})
+    asyncio.run(database(test))
+
+def test_an_expired_key_is_taken_over(database):
+    async def test(engine):
+        sessions = async_sessionmaker(engine, expire_on_commit=False)
+        async with sessions() as db:
+            await idempotency.claim(db, "k", "f1")
+            await idempotency.save(db, "k", {"updated": 1})
+            await db.execute(text("UPDATE idempotency_keys SET created_at = now() - interval '2 days'"))
+            await db.commit()
+        async with sessions() as db:
+            assert await idempotency.claim(db, "k", "f2", ttl=86400) is None
+            await db.commit()
+            assert (await db.execute(text("SELECT fingerprint FROM idempotency_keys"))).scalar_one() == "f2"
+    asyncio.run(database(test))
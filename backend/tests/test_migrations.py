@@ -0,0 +1,84 @@
+import threading
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+import database
+from models import Base
+from conftest import TEST_DATABASE_URL
+
+CONCURRENT_INDEXES = ("idx_veteran_profiles_payment", "ix_veteran_profiles_ssn_blind_index", "ix_veteran_profiles_email_lower")
+
+INVALID_INDEXES_SQL = text(
+    "SELECT count(*) FROM pg_index WHERE NOT indisvalid AND indexrelid::regclass::text = ANY(:names)"
+)
+
+@pytest.fixture
+def migration_engine(monkeypatch):
+    """Sync engine on an empty TEST_DATABASE_URL schema, patched in for upgrade_schema"""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_engine(TEST_DATABASE_URL, poolclass=NullPool)
+    monkeypatch.setattr(database, "engine", engine)
+    monkeypatch.setattr(database, "MIGRATION_LOCK_POLL_SECONDS", 0.05)
+
+    def reset():
+        Base.metadata.drop_all(engine)
+        with engine.begin() as connection:
+            connection.execute(text("DROP TABLE IF EXISTS alembic_version"))
+
+    reset()
+    try:
+        yield engine
+    finally:
+        reset()
+        engine.dispose()
+
+def _invalid_indexes(engine) -> int:
+    with engine.connect() as connection:
+        return connection.scalar(INVALID_INDEXES_SQL, {"names": list(CONCURRENT_INDEXES)})
+
+def test_concurrent_workers_migrate_once(migration_engine):
+    errors = []
+
+    def worker():
+        try:
+            database.upgrade_schema()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert errors == []
+    with migration_engine.connect() as connection:
+        assert connection.scalar(text("SELECT version_num FROM alembic_version")) == database.schema_head()
+    assert _invalid_indexes(migration_engine) == 0
+
+def test_upgrade_rebuilds_an_invalid_index(migration_engine):
+    from alembic import command
+    database.upgrade_schema()
+    # What an interrupted CREATE INDEX CONCURRENTLY leaves behind
+    with migration_engine.begin() as connection:
+        connection.execute(text(
+            "UPDATE pg_index SET indisvalid = false WHERE indexrelid = 'ix_veteran_profiles_ssn_blind_index'::regclass"
+        ))
+    assert _invalid_indexes(migration_engine) == 1
+
+    command.downgrade(database.alembic_config(), "0005")
+    database.upgrade_schema()
+
+    assert _invalid_indexes(migration_engine) == 0
+
+def test_schema_head_matches_alembic():
+    from alembic.script import ScriptDirectory
+    assert database.schema_head() == ScriptDirectory.from_config(database.alembic_config()).get_current_head()
+
+def test_startup_benchmark_reports_both_steps(migration_engine, monkeypatch):
+    database.upgrade_schema()
+    monkeypatch.setenv("DATABASE_URL", TEST_DATABASE_URL)
+    result = database.benchmark_startup(iterations=1)
+    assert set(result) == {"create_all_ms", "check_schema_ms"}
@@ -0,0 +1,221 @@
+import uuid
+import asyncio
+from sqlalchemy import event, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from models import VeteranProfile
+import profile_store
+from profile_store import update_status_flags, upsert_profile
+from utils.encryption import encryption_service
+
+class RecordingSession:
+    """Stands in for AsyncSession and records the SQL each call would run"""
+
+    def __init__(self):
+        self.statements = []
+
+    def _record(self, statement):
+        self.statements.append(str(statement.compile(dialect=postgresql.dialect())))
+
+    async def execute(self, statement, *args, **kwargs):
+        self._record(statement)
+        return self
+
+    async def scalar(self, statement, *args, **kwargs):
+        self._record(statement)
+        return None
+
+    def first(self):
+        return None
+
+def test_empty_flags_read_without_writing():
+    for full in (False, True):
+        db = RecordingSession()
+        asyncio.run(update_status_flags(db, "a@x.com", {}, full=full))
+        assert len(db.statements) == 1
+        assert db.statements[0].lstrip().startswith("SELECT")
+        assert "updated_at=now()" not in db.statements[0].replace(" ", "")
+
+def test_flags_are_written_in_one_update():
+    db = RecordingSession()
+    asyncio.run(update_status_flags(db, "a@x.com", {"has_paid": True}))
+    assert len(db.statements) == 1
+    assert db.statements[0].startswith("UPDATE veteran_profiles SET has_paid=")
+
+def test_anonymous_save_is_a_single_upsert():
+    db = RecordingSession()
+    asyncio.run(upsert_profile(db, {"email": "a@x.com", "first_name": "Ann", "last_name": "Lee"}))
+    assert len(db.statements) == 1
+    statement = " ".join(db.statements[0].split())
+    assert statement.startswith("INSERT INTO veteran_profiles")
+    assert "ON CONFLICT (email) DO UPDATE" in statement and "RETURNING" in statement
+
+def test_authenticated_save_locks_then_upserts():
+    db = RecordingSession()
+    asyncio.run(upsert_profile(db, {"email": "a@x.com", "first_name": "Ann", "last_name": "Lee"}, user_id=str(uuid.uuid4())))
+    assert len(db.statements) == 3
+    assert "pg_advisory_xact_lock(hashtext(" in db.statements[0]
+    assert db.statements[1].rstrip().endswith("FOR UPDATE")
+    assert db.statements[2].startswith("INSERT INTO veteran_profiles")
+
+# Concurrency against a real Postgres (see the database fixture)
+async def _with_database(database, test):
+    async def run(engine):
+        statements = []
+        event.listen(engine.sync_engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+        await test(async_sessionmaker(engine, expire_on_commit=False), statements)
+    await database(run)
+
+def profile_payload(email, n):
+    """Every field the /veteran-profiles endpoint sends, distinct per save"""
+    return {
+        "email": email,
+        "first_name": f"Ann{n}",
+        "middle_initial": "Q",
+        "last_name": f"Lee{n}",
+        "ssn": f"123-45-{n:04d}",
+        "phone": f"555-01{n:02d}",
+        "date_of_birth": f"01/{n + 1:02d}/1970",
+        "file_number": f"C{n}",
+        "veterans_service_number": f"V{n}",
+        "military_service": {"branch": "Army", "save": n},
+        "claim_info": {"save": n},
+        "address": {"zip": f"{n:05d}"},
+        "claim_statement": f"statement {n}",
+        "has_signed_up": False,
+        "has_paid": n % 2 == 0,
+    }
+
+async def _save(sessions, payload, user_id=None):
+    """Save a profile the way the endpoint does: one transaction per request"""
+    profile_data = dict(payload)
+    ssn = profile_data.pop("ssn")
+    async with sessions() as db:
+        profile = await upsert_profile(db, profile_data, user_id, ssn=ssn)
+        await db.commit()
+        return profile
+
+async def _stored(sessions, email):
+    async with sessions() as db:
+        return (await db.execute(select(VeteranProfile.__table__).where(VeteranProfile.email == email))).all()
+
+def _assert_is_one_payload(row, payloads):
+    """The row holds one save's payload in full, never a mix of concurrent saves"""
+    ssn = encryption_service.decrypt_ssn(row.ssn_encrypted, row.id)
+    matches = [payload for payload in payloads if payload["ssn"] == ssn]
+    assert len(matches) == 1
+    for key, value in matches[0].items():
+        if key != "ssn":
+            assert getattr(row, key) == value, key
+
+def test_concurrent_full_saves_of_one_email_converge_on_one_payload(database):
+    async def test(sessions, statements):
+        for round in range(5):
+            email = f"vet{round}@example.com"
+            payloads = [profile_payload(email, n) for n in range(8)]
+            profiles = await asyncio.gather(*(_save(sessions, payload) for payload in payloads))
+            # No save lost the race with an IntegrityError, and all of them hit the same row
+            assert len({profile.id for profile in profiles}) == 1
+
+            stored = await _stored(sessions, email)
+            assert len(stored) == 1
+            _assert_is_one_payload(stored[0], payloads)
+    asyncio.run(_with_database(database, test))
+
+def test_save_round_trips(database):
+    async def test(sessions, statements):
+        def queries():
+            return [s.lstrip() for s in statements if not s.lstrip().upper().startswith(("BEGIN", "COMMIT"))]
+
+        # Without an SSN an anonymous save is the upsert alone
+        for n in range(2):
+            statements.clear()
+            await _save(sessions, {**profile_payload("a@example.com", n), "ssn": None})
+            assert len(queries()) == 1 and queries()[0].startswith("INSERT")
+
+        # An SSN is bound to the row id, so the email is locked and the id looked up first
+        statements.clear()
+        await _save(sessions, profile_payload("a@example.com", 2))
+        assert len(queries()) == 3
+        assert "pg_advisory_xact_lock" in queries()[0]
+        assert queries()[1].rstrip().endswith("FOR UPDATE")
+        assert queries()[2].startswith("INSERT")
+    asyncio.run(_with_database(database, test))
+
+def test_concurrent_claims_converge_on_the_user_id(database):
+    async def test(sessions, statements):
+        email = "claim@example.com"
+        await _save(sessions, profile_payload(email, 0))
+        user_id = str(uuid.uuid4())
+        # Signed-in clients send has_signed_up, so every payload agrees with the re-keyed row
+        payloads = [{**profile_payload(email, n), "has_signed_up": True} for n in range(1, 5)]
+        profiles = await asyncio.gather(*(_save(sessions, payload, user_id=user_id) for payload in payloads))
+        assert {str(profile.id) for profile in profiles} == {user_id}
+
+        stored = await _stored(sessions, email)
+        assert len(stored) == 1 and str(stored[0].id) == user_id
+        _assert_is_one_payload(stored[0], payloads)
+    asyncio.run(_with_database(database, test))
+
+def _pause_after_lookup(monkeypatch):
+    """Hold authenticated saves between the id lookup and the upsert"""
+    resolved, release = asyncio.Event(), asyncio.Event()
+    resolve = profile_store._resolve_profile_id
+
+    async def paused(db, profile_data, user_id, ssn):
+        profile_id = await resolve(db, profile_data, user_id, ssn)
+        if user_id:
+            resolved.set()
+            await release.wait()
+        return profile_id
+    monkeypatch.setattr(profile_store, "_resolve_profile_id", paused)
+    return resolved, release
+
+def test_first_save_waits_for_a_claim_in_progress(database, monkeypatch):
+    resolved, release = _pause_after_lookup(monkeypatch)
+
+    async def test(sessions, statements):
+        email = "race@example.com"
+        user_id = str(uuid.uuid4())
+        claim = asyncio.create_task(_save(sessions, {**profile_payload(email, 1), "has_signed_up": True}, user_id=user_id))
+        await resolved.wait()
+        # The claim saw no row; an anonymous save with an SSN must not slip in under another id
+        anonymous = asyncio.create_task(_save(sessions, {**profile_payload(email, 2), "has_signed_up": True}))
+        await asyncio.sleep(0.3)
+        blocked = not anonymous.done()
+        release.set()
+        await asyncio.gather(claim, anonymous, return_exceptions=True)
+        assert blocked
+
+        stored = await _stored(sessions, email)
+        assert len(stored) == 1 and str(stored[0].id) == user_id
+        assert encryption_service.decrypt_ssn(stored[0].ssn_encrypted, stored[0].id) == "123-45-0002"
+    asyncio.run(_with_database(database, test))
+
+def test_claim_drops_an_ssn_bound_to_an_id_it_did_not_see(database, monkeypatch):
+    resolved, release = _pause_after_lookup(monkeypatch)
+
+    async def test(sessions, statements):
+        email = "unlocked@example.com"
+        user_id = str(uuid.uuid4())
+        claim = asyncio.create_task(_save(sessions, {**profile_payload(email, 1), "ssn": None, "has_signed_up": True}, user_id=user_id))
+        await resolved.wait()
+        # A writer that doesn't take the email lock inserts the row under its own id meanwhile
+        other_id = uuid.uuid4()
+        try:
+            async with sessions() as db:
+                await db.execute(insert(VeteranProfile).values(
+                    id=other_id, email=email, first_name="Bo", last_name="Lee",
+                    **encryption_service.protect_ssn("123-45-6789", other_id)
+                ))
+                await db.commit()
+        finally:
+            release.set()
+            await claim
+
+        stored = await _stored(sessions, email)
+        assert str(stored[0].id) == user_id
+        # Never left holding a ciphertext bound to other_id
+        assert stored[0].ssn_encrypted is None and stored[0].ssn_last4 is None
+    asyncio.run(_with_database(database, test))
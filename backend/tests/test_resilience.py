@@ -0,0 +1,155 @@
+import asyncio
+import httpx
+import pytest
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, RetryBudget, UpstreamPolicy
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    async def sleep(seconds):
+        pass
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+
+def open_breaker(clock, **options):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30.0, **options)
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure()
+    return breaker
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3)
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker = open_breaker(clock)
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 10
+    with pytest.raises(CircuitOpenError) as short_circuited:
+        breaker.before_call()
+    assert short_circuited.value.retry_after == pytest.approx(20.0)
+
+def test_half_open_allows_one_probe_and_closes_on_success(clock):
+    breaker = open_breaker(clock)
+    clock.now += 30
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+def test_failed_probe_reopens(clock):
+    breaker = open_breaker(clock)
+    clock.now += 30
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+def test_lost_probe_is_replaced_after_twice_the_reset_timeout(clock):
+    breaker = open_breaker(clock)
+    # Open long enough that opened_at alone would already allow a new probe
+    clock.now += 1000
+    breaker.before_call()
+    clock.now += 30
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    clock.now += 30
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+def test_retry_budget_refills_with_traffic():
+    budget = RetryBudget(ratio=0.5, min_tokens=1.0, max_tokens=2.0)
+    assert budget.try_spend()
+    assert not budget.try_spend()
+    budget.record_request()
+    assert not budget.try_spend()
+    budget.record_request()
+    assert budget.try_spend()
+    for _ in range(10):
+        budget.record_request()
+    assert budget.tokens == 2.0
+
+def call(policy, handler, **options):
+    requests = []
+
+    async def send():
+        request = httpx.Request("GET", "https://upstream.test/")
+        requests.append(request)
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await client.send(request)
+
+    async def run():
+        return await policy.call(send, **options)
+    return asyncio.run(run()), requests
+
+def test_every_server_error_counts_towards_the_breaker(no_backoff):
+    policy = UpstreamPolicy("test", max_attempts=1, breaker=CircuitBreaker("test", failure_threshold=3))
+    for status in (500, 501, 503):
+        response, _ = call(policy, lambda request: httpx.Response(status), idempotent=True)
+        assert response.status_code == status
+    assert policy.breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        call(policy, lambda request: httpx.Response(200))
+
+def test_client_errors_do_not_trip_the_breaker(no_backoff):
+    policy = UpstreamPolicy("test", breaker=CircuitBreaker("test", failure_threshold=1))
+    response, requests = call(policy, lambda request: httpx.Response(404), idempotent=True)
+    assert response.status_code == 404 and len(requests) == 1
+    assert policy.breaker.state == CircuitBreaker.CLOSED
+
+def test_transient_statuses_are_retried_only_when_idempotent(no_backoff):
+    policy = UpstreamPolicy("test", max_attempts=3)
+    statuses = iter([503, 502, 200])
+    response, requests = call(policy, lambda request: httpx.Response(next(statuses)), idempotent=True)
+    assert response.status_code == 200 and len(requests) == 3
+
+    policy = UpstreamPolicy("test", max_attempts=3)
+    response, requests = call(policy, lambda request: httpx.Response(503))
+    assert response.status_code == 503 and len(requests) == 1
+
+def test_plain_server_errors_are_not_retried(no_backoff):
+    policy = UpstreamPolicy("test", max_attempts=3)
+    response, requests = call(policy, lambda request: httpx.Response(500), idempotent=True)
+    assert response.status_code == 500 and len(requests) == 1
+
+def test_connect_errors_are_retried_even_when_not_idempotent(no_backoff):
+    def refuse_once(request):
+        if len(attempts) == 0:
+            attempts.append(request)
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(200)
+    attempts = []
+    response, requests = call(UpstreamPolicy("test", max_attempts=2), refuse_once)
+    assert response.status_code == 200 and len(requests) == 2
+
+    def read_timeout(request):
+        raise httpx.ReadTimeout("timed out", request=request)
+    with pytest.raises(httpx.ReadTimeout):
+        call(UpstreamPolicy("test", max_attempts=2), read_timeout)
+
+def test_retries_stop_when_the_budget_is_spent(no_backoff):
+    policy = UpstreamPolicy("test", max_attempts=5, retry_budget=RetryBudget(ratio=0.0, min_tokens=2.0))
+    response, requests = call(policy, lambda request: httpx.Response(503), idempotent=True)
+    assert response.status_code == 503
+    # One original attempt plus the two retries the budget allows
+    assert len(requests) == 3
@@ -1,8 +1,17 @@
 import os
+import sys
+import time
+import uuid
+import threading
 from dotenv import load_dotenv
 import base64
-from cryptography.fernet import Fernet
+import hmac
+import hashlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import logging
 
@@ -11,72 +20,360 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+KDF_SALT = b'vets4claims_salt'  # Use a consistent salt for this application
+KDF_ITERATIONS = 100000
+
+# Binary field format: version (1) | key id (1) | nonce (12) | AES-256-GCM ciphertext + tag (16).
+# Fernet tokens are base64 and always start with b"g", so the first byte tells the formats apart.
+FORMAT_AES_GCM_V1 = 0x01
+NONCE_SIZE = 12
+HEADER_SIZE = 2 + NONCE_SIZE
+
+def derive_key(passphrase: str) -> bytes:
+    """Derive the Fernet key for a passphrase (PBKDF2-HMAC-SHA256)"""
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=KDF_SALT,
+        iterations=KDF_ITERATIONS,
+    )
+    return base64.urlsafe_b64encode(kdf.derive(passphrase.encode()))
+
+def derive_aead_key(fernet_key: bytes) -> bytes:
+    """AES-256-GCM key for a configured Fernet key, so one secret serves both formats"""
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b"vets4claims-phi-aes-gcm-v1",
+    ).derive(base64.urlsafe_b64decode(fernet_key))
+
+def field_aad(field: str, row_id) -> bytes:
+    """Associated data binding a ciphertext to one column of one row"""
+    return field.encode() + b":" + uuid.UUID(str(row_id)).bytes
+
 class EncryptionService:
     def __init__(self):
-        # Get encryption key from environment variable
-        encryption_key = os.getenv("ENCRYPTION_KEY")
-        if not encryption_key:
-            raise ValueError("ENCRYPTION_KEY environment variable is required for PHI encryption")
-        
-        # Derive a Fernet key from the encryption key
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=b'vets4claims_salt',  # Use a consistent salt for this application
-            iterations=100000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(encryption_key.encode()))
-        self.cipher_suite = Fernet(key)
-
-    def encrypt_ssn(self, ssn: str) -> bytes:
-        """Encrypt SSN using Fernet encryption"""
+        # A pre-derived key (see `python -m utils.encryption derive`) skips PBKDF2 entirely
+        self._raw_key = os.getenv("ENCRYPTION_RAW_KEY")
+        self._passphrase = os.getenv("ENCRYPTION_KEY")
+        if not self._raw_key and not self._passphrase:
+            raise ValueError("ENCRYPTION_KEY or ENCRYPTION_RAW_KEY environment variable is required for PHI encryption")
+        # Retired keys, newest first: still accepted for decryption until rotate-keys has run
+        self._previous_keys = [k.strip() for k in os.getenv("ENCRYPTION_PREVIOUS_RAW_KEYS", "").split(",") if k.strip()]
+        # Dedicated HMAC key for ssn_blind_index, read on first use (see blind_index_key)
+        self._blind_index_key = None
+        self._primary_key = None
+        self._cipher_suite = None
+        # (key id, AESGCM) pairs, current key first
+        self._aead_keys: List[Tuple[int, AESGCM]] = []
+        self._lock = threading.Lock()
+        self.kdf_seconds = 0.0
+
+    @property
+    def cipher_suite(self) -> MultiFernet:
+        """Legacy Fernet keys (decrypting values written before AES-GCM); built on first use"""
+        if self._cipher_suite is None:
+            with self._lock:
+                if self._cipher_suite is None:
+                    self._primary_key = self._build_primary_key()
+                    fernet_keys = [self._primary_key, *(key.encode() for key in self._previous_keys)]
+                    self._aead_keys = [self._build_aead(key) for key in fernet_keys]
+                    self._cipher_suite = MultiFernet([Fernet(key) for key in fernet_keys])
+        return self._cipher_suite
+
+    def _build_primary_key(self) -> bytes:
+        if self._raw_key:
+            return self._raw_key.encode()
+        started = time.perf_counter()
+        key = derive_key(self._passphrase)
+        self.kdf_seconds = time.perf_counter() - started
+        logger.info(f"Derived encryption key in {self.kdf_seconds * 1000:.0f} ms")
+        return key
+
+    @staticmethod
+    def _build_aead(fernet_key: bytes) -> Tuple[int, AESGCM]:
+        aead_key = derive_aead_key(fernet_key)
+        return hashlib.sha256(aead_key).digest()[0], AESGCM(aead_key)
+
+    def warm_up(self) -> float:
+        """Build the ciphers now (e.g. during startup) and return the KDF time in seconds"""
+        self.cipher_suite
+        return self.kdf_seconds
+
+    def encrypt_field(self, plaintext: bytes, aad: bytes) -> bytes:
+        """Encrypt one value in the AES-GCM field format under the current key"""
+        return self.encrypt_fields([(plaintext, aad)])[0]
+
+    def encrypt_fields(self, items: Sequence[Tuple[bytes, bytes]]) -> List[bytes]:
+        """Encrypt (plaintext, aad) pairs, resolving the key once for the whole batch"""
+        self.cipher_suite
+        key_id, aead = self._aead_keys[0]
+        header = bytes((FORMAT_AES_GCM_V1, key_id))
+        results = []
+        for plaintext, aad in items:
+            nonce = os.urandom(NONCE_SIZE)
+            results.append(header + nonce + aead.encrypt(nonce, plaintext, aad))
+        return results
+
+    def decrypt_field(self, token: bytes, aad: bytes) -> bytes:
+        """Decrypt an AES-GCM field (checking aad) or a legacy Fernet token"""
+        result = self.decrypt_fields([(token, aad)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def decrypt_fields(self, items: Sequence[Tuple[bytes, bytes]]) -> List[Any]:
+        """Decrypt (token, aad) pairs; values that fail come back as InvalidToken"""
+        cipher_suite = self.cipher_suite
+        results = []
+        for token, aad in items:
+            token = bytes(token)
+            if token[:1] != bytes((FORMAT_AES_GCM_V1,)):
+                try:
+                    results.append(cipher_suite.decrypt(token))
+                except InvalidToken as e:
+                    results.append(e)
+                continue
+            nonce, ciphertext = token[2:HEADER_SIZE], token[HEADER_SIZE:]
+            result = InvalidToken()
+            # Key ids are one byte, so more than one configured key may share an id
+            for key_id, aead in self._aead_keys:
+                if key_id != token[1]:
+                    continue
+                try:
+                    result = aead.decrypt(nonce, ciphertext, aad)
+                    break
+                except Exception:
+                    continue
+            results.append(result)
+        return results
+
+    def is_current(self, token: bytes) -> bool:
+        """Whether a value already uses the AES-GCM format and the current key"""
+        self.cipher_suite
+        token = bytes(token)
+        return token[:1] == bytes((FORMAT_AES_GCM_V1,)) and token[1] == self._aead_keys[0][0]
+
+    @property
+    def blind_index_key(self) -> bytes:
+        """HMAC key for ssn_blind_index; must stay stable across encryption key rotations.
+
+        Resolved on the first SSN write or lookup rather than at import, so a missing key fails
+        those operations with a clear error instead of every process that imports this module.
+        RuntimeError, not ValueError, so callers don't report it as an invalid SSN.
+        """
+        if self._blind_index_key is None:
+            secret = os.getenv("ENCRYPTION_BLIND_INDEX_KEY")
+            if not secret:
+                raise RuntimeError(
+                    "ENCRYPTION_BLIND_INDEX_KEY environment variable is required to store or look up SSNs"
+                )
+            self._blind_index_key = secret.encode()
+        return self._blind_index_key
+
+    @staticmethod
+    def normalize_ssn(ssn: str) -> str:
+        """Strip formatting and validate that an SSN is 9 digits"""
+        clean_ssn = ssn.replace("-", "").replace(" ", "")
+        if not clean_ssn.isdigit() or len(clean_ssn) != 9:
+            raise ValueError("Invalid SSN format. Must be 9 digits.")
+        return clean_ssn
+
+    @staticmethod
+    def format_ssn(clean_ssn: str) -> str:
+        return f"{clean_ssn[:3]}-{clean_ssn[3:5]}-{clean_ssn[5:]}"
+
+    def ssn_blind_index(self, ssn: str) -> bytes:
+        """Deterministic keyed HMAC of an SSN, for equality lookups without decrypting rows"""
+        return hmac.new(self.blind_index_key, self.normalize_ssn(ssn).encode(), hashlib.sha256).digest()
+
+    def protect_ssn(self, ssn: str, row_id) -> Dict[str, bytes]:
+        """Column values for an SSN write: ciphertext bound to the row plus its blind index"""
+        return {
+            "ssn_encrypted": self.encrypt_ssn(ssn, row_id),
+            "ssn_blind_index": self.ssn_blind_index(ssn),
+            "ssn_last4": self.normalize_ssn(ssn)[-4:],
+        }
+
+    def protect_ssns(self, items: Sequence[Tuple[str, Any]]) -> List[Any]:
+        """protect_ssn over (ssn, row_id) pairs; invalid SSNs come back as the ValueError"""
+        valid, results = [], []
+        for ssn, row_id in items:
+            try:
+                valid.append((self.normalize_ssn(ssn), row_id))
+                results.append(None)
+            except ValueError as e:
+                results.append(e)
+        encrypted = iter(self.encrypt_fields([(ssn.encode(), field_aad("ssn", row_id)) for ssn, row_id in valid]))
+        derived = iter((self.ssn_blind_index(ssn), ssn[-4:]) for ssn, _ in valid)
+        protected = []
+        for result in results:
+            if result is None:
+                blind_index, last4 = next(derived)
+                result = {"ssn_encrypted": next(encrypted), "ssn_blind_index": blind_index, "ssn_last4": last4}
+            protected.append(result)
+        return protected
+
+    def rebind_ssn(self, token: bytes, old_row_id, new_row_id) -> bytes:
+        """Re-encrypt an SSN for a row whose id changed (e.g. a profile claimed at signup)"""
+        plaintext = self.decrypt_field(token, field_aad("ssn", old_row_id))
+        return self.encrypt_field(plaintext, field_aad("ssn", new_row_id))
+
+    def rotate(self, token: bytes, row_id) -> Optional[bytes]:
+        """Re-encrypt a value under the current key and format; None if it is already current"""
+        if self.is_current(token):
+            return None
+        aad = field_aad("ssn", row_id)
+        return self.encrypt_field(self.decrypt_field(token, aad), aad)
+
+    def rotate_batch(self, items: Sequence[Tuple[Any, bytes]]) -> List[Any]:
+        """rotate() over (row_id, token) pairs; values no key can decrypt come back as the exception"""
+        pending = [(index, row_id, token) for index, (row_id, token) in enumerate(items) if not self.is_current(token)]
+        results: List[Any] = [None] * len(items)
+        decrypted = self.decrypt_fields([(token, field_aad("ssn", row_id)) for _, row_id, token in pending])
+        ok = [(index, row_id, value) for (index, row_id, _), value in zip(pending, decrypted) if not isinstance(value, Exception)]
+        for (index, _, _), value in zip(pending, decrypted):
+            if isinstance(value, Exception):
+                results[index] = value
+        encrypted = self.encrypt_fields([(value, field_aad("ssn", row_id)) for _, row_id, value in ok])
+        for (index, _, _), token in zip(ok, encrypted):
+            results[index] = token
+        return results
+
+    def blind_index_batch(self, items: Sequence[Tuple[Any, bytes]]) -> List[Any]:
+        """Blind indexes for (row_id, token) pairs; undecryptable values come back as the exception"""
+        results = []
+        for value in self.decrypt_fields([(token, field_aad("ssn", row_id)) for row_id, token in items]):
+            if isinstance(value, Exception):
+                results.append(value)
+                continue
+            try:
+                results.append(self.ssn_blind_index(value.decode()))
+            except ValueError as e:
+                results.append(e)
+        return results
+
+    def last4_batch(self, items: Sequence[Tuple[Any, bytes]]) -> List[Any]:
+        """Last four SSN digits for (row_id, token) pairs; undecryptable values come back as the exception"""
+        return [
+            value if isinstance(value, Exception) else value.decode()[-4:]
+            for value in self.decrypt_fields([(token, field_aad("ssn", row_id)) for row_id, token in items])
+        ]
+
+    def encrypt_ssn(self, ssn: str, row_id) -> bytes:
+        """Encrypt SSN (AES-GCM, bound to the profile row id)"""
         try:
-            # Remove any formatting from SSN
-            clean_ssn = ssn.replace("-", "").replace(" ", "")
-            
-            # Validate SSN format (9 digits)
-            if not clean_ssn.isdigit() or len(clean_ssn) != 9:
-                raise ValueError("Invalid SSN format. Must be 9 digits.")
-            
+            # Remove any formatting and validate SSN format (9 digits)
+            clean_ssn = self.normalize_ssn(ssn)
+
             # Encrypt the SSN
-            encrypted_ssn = self.cipher_suite.encrypt(clean_ssn.encode())
-            logger.info("SSN encrypted successfully")
+            encrypted_ssn = self.encrypt_field(clean_ssn.encode(), field_aad("ssn", row_id))
+            logger.debug("SSN encrypted successfully")
             return encrypted_ssn
-            
+
         except Exception as e:
             logger.error(f"Error encrypting SSN: {str(e)}")
             raise
 
-    def decrypt_ssn(self, encrypted_ssn: bytes) -> str:
+    def decrypt_ssn(self, encrypted_ssn: bytes, row_id) -> str:
         """Decrypt SSN and return in XXX-XX-XXXX format"""
         try:
             # Decrypt the SSN
-            decrypted_ssn = self.cipher_suite.decrypt(encrypted_ssn).decode()
-            
+            decrypted_ssn = self.decrypt_field(encrypted_ssn, field_aad("ssn", row_id)).decode()
+
             # Format as XXX-XX-XXXX
-            formatted_ssn = f"{decrypted_ssn[:3]}-{decrypted_ssn[3:5]}-{decrypted_ssn[5:]}"
-            logger.info("SSN decrypted successfully")
+            formatted_ssn = self.format_ssn(decrypted_ssn)
+            logger.debug("SSN decrypted successfully")
             return formatted_ssn
-            
+
         except Exception as e:
             logger.error(f"Error decrypting SSN: {str(e)}")
             raise
 
-    def encrypt_text(self, text: str) -> bytes:
+    def decrypt_ssns(self, items: Sequence[Tuple[bytes, Any]]) -> List[Optional[str]]:
+        """Decrypt (token, row_id) pairs to XXX-XX-XXXX; None for missing or undecryptable values"""
+        present = [(token, field_aad("ssn", row_id)) for token, row_id in items if token]
+        decrypted = iter(self.decrypt_fields(present))
+        results = []
+        for token, _ in items:
+            value = next(decrypted) if token else None
+            results.append(None if value is None or isinstance(value, Exception) else self.format_ssn(value.decode()))
+        return results
+
+    def encrypt_text(self, text: str, aad: bytes = b"") -> bytes:
         """Encrypt any text data"""
         try:
-            return self.cipher_suite.encrypt(text.encode())
+            return self.encrypt_field(text.encode(), aad)
         except Exception as e:
             logger.error(f"Error encrypting text: {str(e)}")
             raise
 
-    def decrypt_text(self, encrypted_text: bytes) -> str:
+    def decrypt_text(self, encrypted_text: bytes, aad: bytes = b"") -> str:
         """Decrypt any text data"""
         try:
-            return self.cipher_suite.decrypt(encrypted_text).decode()
+            return self.decrypt_field(encrypted_text, aad).decode()
         except Exception as e:
             logger.error(f"Error decrypting text: {str(e)}")
             raise
 
+def benchmark(service: EncryptionService, iterations: int = 20000) -> Dict[str, Dict[str, float]]:
+    """Size and batched per-field encrypt/decrypt time of an SSN in the AES-GCM and Fernet formats"""
+    cipher_suite = service.cipher_suite
+    row_ids = [uuid.uuid4() for _ in range(iterations)]
+    aads = [field_aad("ssn", row_id) for row_id in row_ids]
+    plaintext = b"123456789"
+
+    def timed(run) -> Tuple[Any, float]:
+        started = time.perf_counter()
+        result = run()
+        return result, (time.perf_counter() - started) / iterations * 1e6
+
+    tokens, gcm_encrypt = timed(lambda: service.encrypt_fields([(plaintext, aad) for aad in aads]))
+    _, gcm_decrypt = timed(lambda: service.decrypt_fields(list(zip(tokens, aads))))
+    legacy, fernet_encrypt = timed(lambda: [cipher_suite.encrypt(plaintext) for _ in row_ids])
+    _, fernet_decrypt = timed(lambda: [cipher_suite.decrypt(token) for token in legacy])
+    return {
+        "aes_gcm_v1": {"bytes": len(tokens[0]), "encrypt_us": round(gcm_encrypt, 2), "decrypt_us": round(gcm_decrypt, 2)},
+        "fernet": {"bytes": len(legacy[0]), "encrypt_us": round(fernet_encrypt, 2), "decrypt_us": round(fernet_decrypt, 2)},
+    }
+
+def benchmark_import(iterations: int = 5, module: str = "main") -> Dict[str, float]:
+    """Median cumulative `python -X importtime` of a backend module and of utils.encryption, in ms,
+    plus the PBKDF2 derivation that importing no longer pays (it now runs on first use)"""
+    import subprocess
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    samples: Dict[str, List[float]] = {module: [], "utils.encryption": []}
+    for _ in range(iterations):
+        stderr = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=backend_dir, check=True, capture_output=True, text=True
+        ).stderr
+        for line in stderr.splitlines():
+            # "import time: self [us] | cumulative | imported package"
+            fields = [field.strip() for field in line.split("|")]
+            if len(fields) == 3 and fields[2] in samples:
+                samples[fields[2]].append(int(fields[1]) / 1000)
+    started = time.perf_counter()
+    derive_key("benchmark passphrase")
+    result = {f"{name}_ms": round(sorted(values)[len(values) // 2], 1) for name, values in samples.items() if values}
+    result["kdf_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
 # Create a global instance
-encryption_service = EncryptionService()
\ No newline at end of file
+encryption_service = EncryptionService()
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "derive" and len(sys.argv) == 2:
+        # Print the derived key so deployments can set ENCRYPTION_RAW_KEY instead of ENCRYPTION_KEY
+        print(derive_key(os.environ["ENCRYPTION_KEY"]).decode())
+    elif command == "benchmark" and len(sys.argv) <= 3:
+        for name, result in benchmark(encryption_service, *map(int, sys.argv[2:])).items():
+            print(f"{name}: {result['bytes']} B per SSN, encrypt {result['encrypt_us']} µs, decrypt {result['decrypt_us']} µs")
+    elif command == "import-time" and len(sys.argv) <= 3:
+        result = benchmark_import(*map(int, sys.argv[2:]))
+        print(", ".join(f"{name.removesuffix('_ms')} {value} ms" for name, value in result.items()))
+    else:
+        print("Usage: python -m utils.encryption derive | benchmark [iterations] | import-time [iterations]")
+        sys.exit(1)
@@ -133,7 +133,7 @@ function App() {
               firstName: profile.first_name,
               middleInitial: profile.middle_initial,
               lastName: profile.last_name,
-              ssn: profile.ssn, // Already decrypted by backend
+              ssnMasked: profile.ssn_masked, // The full SSN stays on the server until the form is filled
               phone: profile.phone,
               dateOfBirth: profile.date_of_birth,
               fileNumber: profile.file_number,
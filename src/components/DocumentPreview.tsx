@@ -4,6 +4,7 @@ import { motion } from 'framer-motion';
 import { FileText, Download, Send, ExternalLink, Mail, CheckCircle, ArrowLeft, Edit3, Save, X, MessageCircle, User } from 'lucide-react';
 import { VeteranProfile, VA214138FormData } from '../types/veteran';
 import { bastionGPT } from '../lib/bastionGPT';
+import { getVeteranProfile } from '../lib/supabase';
 import MobileShell from './layout/MobileShell';
 import toast from 'react-hot-toast';
 
@@ -96,9 +97,9 @@ const DocumentPreview: React.FC<Props> = ({
     }
   };
 
-  const convertToFormData = (): VA214138FormData => {
+  const convertToFormData = (ssn = veteranData.ssn): VA214138FormData => {
     // Clean and format SSN
-    const ssnClean = veteranData.ssn?.replace(/\D/g, '') || '';
+    const ssnClean = ssn?.replace(/\D/g, '') || '';
     const ssn1 = ssnClean.substring(0, 3).padEnd(3, '');
     const ssn2 = ssnClean.substring(3, 5).padEnd(2, '');
     const ssn3 = ssnClean.substring(5, 9).padEnd(4, '');
@@ -221,8 +222,20 @@ const DocumentPreview: React.FC<Props> = ({
     setIsEditing(false);
   };
 
-  const handleDocuSealSign = () => {
-    const formData = convertToFormData();
+  const handleDocuSealSign = async () => {
+    let ssn = veteranData.ssn;
+    if (!ssn && veteranData.ssnMasked && veteranData.email) {
+      // Profiles load with the masked SSN only; the form is the one place that needs all of it
+      try {
+        const profile = await getVeteranProfile(veteranData.email, { includeSsn: true });
+        ssn = profile?.ssn || '';
+      } catch (error) {
+        console.error('Error loading SSN for the claim form:', error);
+        toast.error('Could not load your SSN for the claim form. Please try again.');
+        return;
+      }
+    }
+    const formData = convertToFormData(ssn);
     onDocuSealSign(formData);
   };
 
@@ -350,7 +363,7 @@ const DocumentPreview: React.FC<Props> = ({
             </div>
             <div>
               <span className="font-medium text-gray-700">SSN:</span>
-              <span className="ml-2">{veteranData.ssn ? `***-**-${veteranData.ssn.slice(-4)}` : 'Not provided'}</span>
+              <span className="ml-2">{veteranData.ssn ? `***-**-${veteranData.ssn.slice(-4)}` : veteranData.ssnMasked || 'Not provided'}</span>
             </div>
             <div>
               <span className="font-medium text-gray-700">Service Branch:</span>
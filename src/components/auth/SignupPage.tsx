@@ -76,7 +76,7 @@ const SignupPage: React.FC<Props> = ({ onSignup, onSwitchToLogin, onBackToChat }
       const { data: { session } } = await supabase.auth.getSession();
       
       if (session?.user?.email) {
-        const response = await fetch(`${backendUrl}/update-signup-status`, {
+        const response = await fetch(`${backendUrl}/update-signup-status?compact=true`, {
           method: 'POST',
           headers: {
             'Content-Type': 'application/json',
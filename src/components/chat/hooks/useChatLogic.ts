@@ -681,7 +681,8 @@ Be encouraging, professional, and provide actionable advice. Focus on next steps
     ];
     
     return requiredFields.every(field => {
-      const value = getNestedValue(data, field);
+      // A returning veteran's SSN is on file even though only the masked form is loaded
+      const value = field === 'ssn' ? data.ssn || data.ssnMasked : getNestedValue(data, field);
       return value && value.trim().length > 0;
     });
   };
@@ -55,7 +55,8 @@ export const saveVeteranProfile = async (profile: any) => {
     throw error;
   }
 };
-export const getVeteranProfile = async (email: string) => {
+// The full SSN is only decrypted and returned when requested; otherwise profiles carry ssn_masked
+export const getVeteranProfile = async (email: string, { includeSsn = false }: { includeSsn?: boolean } = {}) => {
   try {
     const backendUrl = import.meta.env.VITE_BACKEND_URL;
     
@@ -63,7 +64,8 @@ export const getVeteranProfile = async (email: string) => {
       throw new Error('Backend URL not configured. Please check VITE_BACKEND_URL environment variable.');
     }
     
-    const response = await fetch(`${backendUrl}/veteran-profiles/${encodeURIComponent(email)}`, {
+    const query = includeSsn ? '?fields=ssn' : '';
+    const response = await fetch(`${backendUrl}/veteran-profiles/${encodeURIComponent(email)}${query}`, {
       method: 'GET',
       headers: {
         'Content-Type': 'application/json',
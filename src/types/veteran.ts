@@ -6,6 +6,7 @@ export interface VeteranProfile {
   middleInitial?: string;
   lastName: string;
   ssn: string;
+  ssnMasked?: string; // ***-**-1234 as served by the backend; the full SSN is only fetched when a form needs it
   phone: string;
   dateOfBirth: string;
   fileNumber?: string;
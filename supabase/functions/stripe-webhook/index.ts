@@ -217,7 +217,7 @@ async function updateBackendPaymentStatus(customerId: string) {
     // Update backend PostgreSQL database
     const backendUrl = Deno.env.get('BACKEND_URL') || 'http://localhost:8000';
     
-    const response = await fetch(`${backendUrl}/update-payment-status`, {
+    const response = await fetch(`${backendUrl}/update-payment-status?compact=true`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',